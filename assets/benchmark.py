@@ -0,0 +1,173 @@
+# *************************************************************
+# Benchmark of the meshing scripts on the shipped data/ geometries.
+# The outer pipeline (makemesh.py on data/gmsh22.stl) and the inner
+# pipeline (makemesh_inner.py on data/MostInnerSurface.stl) are run at
+# several meshSize values, each in its own process with --report.
+# Time per phase, node/element counts, peak memory and output file
+# size are collected and compared with a stored baseline.
+# The run fails (exit code 1) when the throughput (elements per second)
+# of a case drops by more than the tolerance, and before any case is run
+# when there is no baseline (unless --allow-missing-baseline).
+#
+# usage  : python benchmark.py --update-baseline   (record the baseline on this machine)
+#          python benchmark.py                     (compare with the baseline)
+#          python benchmark.py --cases inner --mesh-sizes 0.9 --tolerance 0.3
+# *************************************************************
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ASSETS_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(os.path.dirname(ASSETS_DIR), "data")
+DEFAULT_BASELINE = os.path.join(ASSETS_DIR, "benchmark_baseline.json")
+
+# case name -> (script, input stl, meshSize values)
+CASES = {
+    "outer": ("makemesh.py", os.path.join(DATA_DIR, "gmsh22.stl"), [1.0, 0.7, 0.5]),
+    "inner": ("makemesh_inner.py", os.path.join(DATA_DIR, "MostInnerSurface.stl"), [1.2, 0.9, 0.7]),
+}
+
+
+# ===============================================
+# command line of one run
+def CaseCommand(script, stl, msh, vtk, meshSize, reportPath, extraArgs):
+    command = [sys.executable, os.path.join(ASSETS_DIR, script)]
+    if script == "makemesh.py":
+        command += ["--stl", stl, "--msh", msh, "--vtk", vtk]
+    else:
+        command += [stl, msh, vtk]
+    command += ["--mesh-size", str(meshSize), "--report", reportPath, "-nopopup"]
+    return command + extraArgs
+# ===============================================
+
+
+# ===============================================
+# run one case once and return its measurements
+def RunCase(name, script, stl, meshSize, workDir, extraArgs):
+    msh = os.path.join(workDir, f"{name}-{meshSize}.msh")
+    vtk = os.path.join(workDir, f"{name}-{meshSize}.vtk")
+    reportPath = os.path.join(workDir, f"{name}-{meshSize}.json")
+    command = CaseCommand(script, stl, msh, vtk, meshSize, reportPath, extraArgs)
+    completed = subprocess.run(command, cwd=workDir, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"{name} meshSize={meshSize} failed:\n{completed.stderr}")
+
+    with open(reportPath) as f:
+        record = json.load(f)
+    # the written files may be compressed or have another extension (see meshoutput.py)
+    outputs = record.get("outputs") or {"msh": msh, "vtk": vtk}
+    elements = record["gmshElements"] or 0
+    wall = record["total"]["wall"]
+    return {
+        "wall": wall,
+        "phases": {phase["name"]: phase["wall"] for phase in record["phases"]},
+        "gmshPhases": {phase["name"]: phase["wall"] for phase in record["gmshPhases"]},
+        "nodes": record["gmshNodes"],
+        "elements": elements,
+        "peakRss": record["total"]["peakRss"],
+        "mshBytes": FileSize(outputs.get("msh")),
+        "vtkBytes": FileSize(outputs.get("vtk")),
+        "throughput": elements / wall if wall > 0 else 0.0,
+        "meshOptions": record.get("meshOptions"),
+    }
+
+
+def FileSize(path):
+    return os.path.getsize(path) if path and os.path.exists(path) else 0
+
+
+# the fastest of several repeats is kept, it is the least disturbed by the machine
+def RunBenchmark(caseNames, meshSizes, repeat, extraArgs):
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="vmd-benchmark-") as workDir:
+        for name in caseNames:
+            script, stl, defaultSizes = CASES[name]
+            for meshSize in meshSizes or defaultSizes:
+                key = f"{name}-{meshSize}"
+                runs = [RunCase(name, script, stl, meshSize, workDir, extraArgs) for _ in range(repeat)]
+                results[key] = min(runs, key=lambda run: run["wall"])
+                PrintResult(key, results[key])
+    return results
+# ===============================================
+
+
+# ===============================================
+# comparison with the baseline
+# returns the list of the cases that got slower than the tolerance
+def CompareWithBaseline(results, baseline, tolerance):
+    regressions = []
+    print()
+    print(f"{'case':<14}{'elements/s':>14}{'baseline':>14}{'change':>10}")
+    for key, result in results.items():
+        if key not in baseline:
+            print(f"{key:<14}{result['throughput']:>14.0f}{'-':>14}{'new':>10}")
+            continue
+        reference = baseline[key]
+        change = result["throughput"] / reference["throughput"] - 1.0 if reference["throughput"] else 0.0
+        flag = ""
+        if change < -tolerance:
+            regressions.append(key)
+            flag = "  REGRESSION"
+        print(f"{key:<14}{result['throughput']:>14.0f}{reference['throughput']:>14.0f}{change:>+10.1%}{flag}")
+        if result["elements"] != reference["elements"]:
+            print(f"    element count changed: {reference['elements']} -> {result['elements']}")
+        for phase, wall in result["phases"].items():
+            referenceWall = reference["phases"].get(phase)
+            if referenceWall and wall > referenceWall * (1.0 + tolerance) and wall - referenceWall > 0.5:
+                print(f"    {phase}: {referenceWall:.2f} s -> {wall:.2f} s")
+    return regressions
+
+
+def PrintResult(key, result):
+    print(f"{key}: {result['wall']:.2f} s, {result['nodes']} nodes, {result['elements']} elements, "
+          f"{result['peakRss'] / 2**20:.0f} MiB peak, msh {result['mshBytes'] / 2**20:.1f} MiB")
+    for phase, wall in result["phases"].items():
+        print(f"    {phase:<16}{wall:8.2f} s")
+# ===============================================
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark the meshing scripts on the data/ geometries")
+    parser.add_argument("--cases", nargs="+", choices=sorted(CASES), default=sorted(CASES))
+    parser.add_argument("--mesh-sizes", nargs="+", type=float, default=None, help="override the meshSize values of every case")
+    parser.add_argument("--repeat", type=int, default=1, help="run every case this many times and keep the fastest")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--update-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--allow-missing-baseline", action="store_true", help="only print the results when there is no baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed drop of elements/s (0.2 = 20 %%)")
+    parser.add_argument("--output", default=None, help="also write the results to this JSON file")
+    # the rest is passed to the meshing scripts (e.g. --algorithm3d hxt --threads 0)
+    args, extraArgs = parser.parse_known_args()
+    missingBaseline = not args.update_baseline and not os.path.exists(args.baseline)
+    if missingBaseline and not args.allow_missing_baseline:
+        parser.error(f"no baseline {args.baseline}, run with --update-baseline first (or --allow-missing-baseline)")
+
+    results = RunBenchmark(args.cases, args.mesh_sizes, args.repeat, extraArgs)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2)
+        print(f"baseline written to {args.baseline}")
+        sys.exit(0)
+
+    if missingBaseline:
+        print(f"no baseline {args.baseline}, nothing compared")
+        sys.exit(0)
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = CompareWithBaseline(results, baseline, args.tolerance)
+    if regressions:
+        print(f"throughput regression in {', '.join(regressions)}")
+        sys.exit(1)
@@ -0,0 +1,68 @@
+# *************************************************************
+# INLET / OUTLET of a mesh made by makemesh.py or makemesh_inner.py.
+# gmsh writes the cap triangles and the side quadrangles of the prism
+# layer as SOMETHING (99); the entities at the first and last centerline
+# node are given the INLET (11) and OUTLET (12) physical groups.
+# Python version of Boundary.DetectCorrespondTriangleEntityID /
+# DetectCorrespondQuadrilateralEntityID and Mesh.RewritePhysicalID.
+# *************************************************************
+
+import numpy as np
+
+import msh22
+
+SOMETHING = 99
+INLET = 11
+OUTLET = 12
+# gmsh element types
+TRIANGLE = 2
+QUADRANGLE = 3
+
+
+# ===============================================
+# SOMETHING triangle entity nearest to the location (L1 distance of the
+# mean of the triangle centers) and the SOMETHING quadrangle entities that
+# share more than 2 nodes with it
+# returns (triangle entity, [quadrangle entities])
+def DetectEntities(mesh, location):
+    rows, triangles = msh22.ElementsOfType(mesh, TRIANGLE, SOMETHING)
+    if len(rows) == 0:
+        raise ValueError("the mesh has no SOMETHING triangles")
+    entities, inverse = np.unique(mesh["elementEntity"][rows], return_inverse=True)
+    centers = mesh["nodes"][triangles].mean(axis=1)
+    count = np.bincount(inverse)
+    entityCenter = np.column_stack([np.bincount(inverse, weights=centers[:, k]) / count for k in range(3)])
+    nearest = int(np.argmin(np.abs(entityCenter - location).sum(axis=1)))
+    triangleNodes = np.unique(triangles[inverse == nearest])
+
+    quadRows, quads = msh22.ElementsOfType(mesh, QUADRANGLE, SOMETHING)
+    quadEntities = []
+    quadEntity = mesh["elementEntity"][quadRows]
+    for entity in np.unique(quadEntity):
+        # 1 or 2 shared nodes are entities that only touch the cap at a corner
+        shared = np.intersect1d(triangleNodes, quads[quadEntity == entity])
+        if len(shared) > 2:
+            quadEntities.append(int(entity))
+    return int(entities[nearest]), quadEntities
+
+
+# copy of the mesh with the SOMETHING cells at the inlet and outlet location
+# rewritten to INLET and OUTLET, and the two physical names added
+def RewriteInletOutlet(mesh, inletLocation, outletLocation):
+    physical = mesh["elementPhysical"].copy()
+    something = physical == SOMETHING
+    for location, tag in ((inletLocation, INLET), (outletLocation, OUTLET)):
+        triangleEntity, quadEntities = DetectEntities(mesh, np.asarray(location, dtype=np.float64))
+        triangleCells = something & (mesh["elementTypes"] == TRIANGLE) & (mesh["elementEntity"] == triangleEntity)
+        quadCells = something & (mesh["elementTypes"] == QUADRANGLE) & np.isin(mesh["elementEntity"], quadEntities)
+        physical[triangleCells | quadCells] = tag
+
+    names = [entry for entry in mesh["physicalNames"] if entry[1] not in (INLET, OUTLET)]
+    names += [(2, INLET, "INLET"), (2, OUTLET, "OUTLET")]
+    return dict(mesh, elementPhysical=physical, physicalNames=sorted(names))
+
+
+# True if the mesh still has SOMETHING caps to be rewritten
+def HasSomethingTriangles(mesh):
+    return bool(np.any((mesh["elementTypes"] == TRIANGLE) & (mesh["elementPhysical"] == SOMETHING)))
+# ===============================================
@@ -0,0 +1,144 @@
+# *************************************************************
+# Centerline and radius files shared by the Python tools.
+# centerline : "#pt3d <n>" followed by n lines "x y z"
+#              (data/centerline.txt, data/centerlineFinal.txt)
+# radius     : "# <n>" followed by n lines with one value
+#              (same as IO.WriteRadius / IO.ReadRadius of the C# code)
+# correspondence PLY : ASCII PLY of the lumen surface, every face has the
+#              index of its centerline node (face_correspond_node_index,
+#              data/test.ply, same as IO.WritePLY / IO.ReadPLY)
+# *************************************************************
+
+import numpy as np
+
+
+# ===============================================
+# centerline file -> (n, 3) float64
+def ReadCenterline(path):
+    points = np.loadtxt(path, comments="#", dtype=np.float64, ndmin=2)
+    return points[:, :3]
+
+
+def WriteCenterline(path, points):
+    with open(path, "w") as f:
+        f.write(f"#pt3d {len(points)}\n")
+        np.savetxt(f, points, fmt="%.17g")
+# ===============================================
+
+
+# ===============================================
+def ReadRadius(path):
+    return np.loadtxt(path, comments="#", dtype=np.float64, ndmin=1)
+
+
+def WriteRadius(path, radius):
+    with open(path, "w") as f:
+        f.write(f"# {len(radius)}\n")
+        np.savetxt(f, radius, fmt="%.7g")
+# ===============================================
+
+
+# ===============================================
+# correspondence PLY -> vertices (n, 3), triangles (m, 3), centerline index of every triangle (m,)
+def ReadCorrespondPly(path):
+    with open(path, "rb") as f:
+        text = f.read()
+    header, _, body = text.partition(b"end_header")
+    vertexCount = faceCount = 0
+    for line in header.decode("ascii").splitlines():
+        if line.startswith("element vertex"):
+            vertexCount = int(line.split()[2])
+        elif line.startswith("element face"):
+            faceCount = int(line.split()[2])
+    tokens = body.split()
+    vertices = np.array(tokens[:3 * vertexCount], dtype=np.float64).reshape(-1, 3)
+    # "3 n0 n1 n2 index" for every face
+    faces = np.array(tokens[3 * vertexCount:3 * vertexCount + 5 * faceCount], dtype=np.int64).reshape(-1, 5)
+    return vertices, faces[:, 1:4], faces[:, 4]
+
+
+def WriteCorrespondPly(path, vertices, triangles, correspondIndex):
+    with open(path, "w") as f:
+        f.write("ply\nformat ascii 1.0\n")
+        f.write(f"element vertex {len(vertices)}\n")
+        f.write("property float x\nproperty float y\nproperty float z\n")
+        f.write(f"element face {len(triangles)}\n")
+        f.write("property list uchar int vertex_indices\n")
+        f.write("property uchar face_correspond_node_index\n")
+        f.write("end_header\n")
+        np.savetxt(f, vertices, fmt="%.7g")
+        faces = np.column_stack([np.full(len(triangles), 3), triangles, correspondIndex])
+        np.savetxt(f, faces, fmt="%d")
+# ===============================================
+
+
+# ===============================================
+# unit tangent at every centerline node
+# central difference inside, one-sided difference at both ends
+def TangentVectors(points):
+    tangent = np.gradient(points, axis=0)
+    length = np.linalg.norm(tangent, axis=1, keepdims=True)
+    return tangent / np.where(length > 0.0, length, 1.0)
+# ===============================================
+
+
+# ===============================================
+# same filter as Utility.MovingAverage7 of the C# code
+# window of 7 inside, shrinking to 5, 3 and 2 values towards both ends
+# (n,) or (n, k): a 2D array is filtered along the centerline, e.g. the tangent vectors
+# (same as Centerline.SmootheCenterlineTangentVectors)
+def MovingAverage7(data):
+    data = np.asarray(data, dtype=np.float64)
+    n = len(data)
+    if n < 7:
+        print("Input list must contain at least 7 elements.")
+        return data
+    cumulative = np.concatenate([np.zeros((1,) + data.shape[1:]), np.cumsum(data, axis=0)])
+    # half width of the window at every index
+    half = np.full(n, 3)
+    half[[2, n - 3]] = 2
+    half[[1, n - 2]] = 1
+    half[[0, n - 1]] = 0
+    index = np.arange(n)
+    width = (2 * half + 1).reshape((-1,) + (1,) * (data.ndim - 1))
+    filtered = (cumulative[index + half + 1] - cumulative[index - half]) / width
+    filtered[0] = (data[0] + data[1]) / 2
+    filtered[-1] = (data[-1] + data[-2]) / 2
+    return filtered
+# ===============================================
+
+
+# ===============================================
+# projection of surface points onto the centerline edges next to their centerline node
+# vectorized version of Algorithm.calculateEdgeRadius
+# index    : nearest centerline node of every point (n,)
+# returns projection (n, 3), vector from the projection to the point (n, 3)
+#         and sameEdge (n,): True if the point belongs to edge index, False for edge index - 1
+def EdgeProjection(points, centerlinePoints, index):
+    last = len(centerlinePoints) - 1
+    node = centerlinePoints[index]
+    previous = centerlinePoints[np.maximum(index - 1, 0)]
+    following = centerlinePoints[np.minimum(index + 1, last)]
+
+    previousEdge = node - previous
+    nextEdge = following - node
+    previousToPoint = points - previous
+    previousLength = np.einsum("ij,ij->i", previousEdge, previousEdge)
+    nextLength = np.einsum("ij,ij->i", nextEdge, nextEdge)
+    # both parameters are measured from the previous node, as in the C# code
+    with np.errstate(divide="ignore", invalid="ignore"):
+        a = np.where(previousLength != 0, np.einsum("ij,ij->i", previousEdge, previousToPoint) / previousLength, 0.0)
+        b = np.where(nextLength != 0, np.einsum("ij,ij->i", nextEdge, previousToPoint) / nextLength, 0.0)
+    onPrevious = (a > 0) & (a < 1)
+    onNext = (b > 0) & (b < 1)
+
+    projectionPrevious = previous + a[:, None] * previousEdge
+    projectionNext = node + b[:, None] * nextEdge
+    # on both edges: the nearer projection
+    usePrevious = onPrevious & ~(onNext & (
+        np.linalg.norm(points - projectionPrevious, axis=1) >= np.linalg.norm(points - projectionNext, axis=1)))
+
+    projection = np.where(usePrevious[:, None], projectionPrevious, np.where(onNext[:, None], projectionNext, node))
+    sameEdge = np.where(usePrevious, False, np.where(onNext, True, b != 0))
+    return projection, points - projection, sameEdge
+# ===============================================
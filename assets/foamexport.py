@@ -0,0 +1,338 @@
+# *************************************************************
+# OpenFOAM polyMesh written directly from the mesh, without gmshToFoam.
+# constant/polyMesh/points, faces, owner, neighbour, boundary are written
+# in binary OpenFOAM format (label 32 bit, scalar 64 bit).
+# 1. every face of every cell (tetra, prism, hexahedron, pyramid) is
+#    listed with its cell, turned to point out of the cell
+# 2. the faces are sorted by their node numbers: a face found twice is an
+#    internal face (owner = lower cell, neighbour = higher cell), a face found
+#    once is a boundary face and gets the physical group of the boundary
+#    triangle / quadrangle with the same nodes (patch "defaultFaces" if none)
+# 3. internal faces are ordered by (owner, neighbour), boundary faces by
+#    (patch, owner), as OpenFOAM requires
+# patches whose name contains WALL (WALL, INNERWALL) are of type wall,
+# the others of type patch
+# input  : MSH 2.2 file (ASCII or binary) or the current gmsh model
+# output : <case>/constant/polyMesh/
+#
+# usage  : python foamexport.py MeshMerged.msh case
+# *************************************************************
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+import msh22
+
+# faces of every cell type, gmsh node order; the faces point out of a
+# positive cell, faces that point inwards are turned around anyway
+CELL_FACES = {
+    4: [[0, 2, 1], [0, 1, 3], [0, 3, 2], [1, 2, 3]],
+    5: [[0, 3, 2, 1], [4, 5, 6, 7], [0, 1, 5, 4], [1, 2, 6, 5], [2, 3, 7, 6], [0, 4, 7, 3]],
+    6: [[0, 2, 1], [3, 4, 5], [0, 1, 4, 3], [1, 2, 5, 4], [0, 3, 5, 2]],
+    7: [[0, 3, 2, 1], [0, 1, 4], [1, 2, 4], [2, 3, 4], [3, 0, 4]],
+}
+# boundary element types
+FACE_TYPES = (2, 3)
+DEFAULT_PATCH = "defaultFaces"
+
+
+# ===============================================
+# the current gmsh model in the layout of msh22.py
+# only the elements of physical groups are taken (same as the *.msh file), in
+# the order gmsh writes them: entity by entity, an entity with its first group
+def MeshFromGmsh():
+    import gmsh
+    nodeTags, coordinates, _ = gmsh.model.mesh.getNodes()
+    physicalNames = [(dim, physicalTag, gmsh.model.getPhysicalName(dim, physicalTag))
+                     for dim, physicalTag in gmsh.model.getPhysicalGroups()]
+    tags, types, physical, entity, nodes, counts = [], [], [], [], [], []
+    for dim, entityTag in gmsh.model.getEntities():
+        physicalTags = gmsh.model.getPhysicalGroupsForEntity(dim, entityTag)
+        if len(physicalTags) == 0:
+            continue
+        elementTypes, elementTags, elementNodeTags = gmsh.model.mesh.getElements(dim, entityTag)
+        for elementType, elementTag, elementNodes in zip(elementTypes, elementTags, elementNodeTags):
+            tags.append(elementTag.astype(np.int64))
+            types.append(np.full(len(elementTag), elementType, dtype=np.int32))
+            physical.append(np.full(len(elementTag), physicalTags[0], dtype=np.int32))
+            entity.append(np.full(len(elementTag), entityTag, dtype=np.int32))
+            nodes.append(elementNodes.astype(np.int64))
+            counts.append(np.full(len(elementTag), len(elementNodes) // max(len(elementTag), 1), dtype=np.int64))
+    mesh = {
+        "physicalNames": physicalNames,
+        "nodeTags": nodeTags.astype(np.int64),
+        "nodes": coordinates.reshape(-1, 3).astype(np.float64),
+        "elementTags": np.concatenate(tags),
+        "elementTypes": np.concatenate(types),
+        "elementPhysical": np.concatenate(physical),
+        "elementEntity": np.concatenate(entity),
+        "elementOffsets": np.concatenate([[0], np.cumsum(np.concatenate(counts))]).astype(np.int64),
+        "elementNodes": np.concatenate(nodes),
+    }
+    return mesh
+# ===============================================
+
+
+# ===============================================
+# all faces of all cells: nodes (f, 4) with -1 as 4th node of triangles, cell (f,)
+# a cell whose first face points inwards (negative cell) gets all its faces turned
+def CellFaces(mesh):
+    volumeRows = VolumeRows(mesh)
+    if len(volumeRows) == 0:
+        raise ValueError("the mesh has no volume elements")
+    points = mesh["nodes"]
+    faces, faceCells = [], []
+    for elementType, templates in CELL_FACES.items():
+        rows, connectivity = msh22.ElementsOfType(mesh, elementType)
+        if len(rows) == 0:
+            continue
+        cells = np.searchsorted(volumeRows, rows)
+        first = points[connectivity[:, templates[0]]]
+        normal = np.cross(first[:, 1] - first[:, 0], first[:, -1] - first[:, 0])
+        inverted = np.einsum("ij,ij->i", normal, first.mean(axis=1) - points[connectivity].mean(axis=1)) < 0.0
+        connectivity[inverted] = connectivity[inverted][:, ReversedOrder(connectivity.shape[1])]
+        for template in templates:
+            face = np.full((len(rows), 4), -1, dtype=np.int64)
+            face[:, :len(template)] = connectivity[:, template]
+            faces.append(face)
+            faceCells.append(cells)
+    return np.concatenate(faces), np.concatenate(faceCells), len(volumeRows)
+
+
+# element rows of the cells, row i of the result is cell i
+def VolumeRows(mesh):
+    return np.flatnonzero(np.isin(mesh["elementTypes"], list(CELL_FACES)))
+
+
+# node order of a cell mirrored so that every face of the templates turns around
+def ReversedOrder(numNodes):
+    if numNodes == 4:
+        return [0, 2, 1, 3]
+    if numNodes == 5:
+        return [0, 3, 2, 1, 4]
+    if numNodes == 6:
+        return [0, 2, 1, 3, 5, 4]
+    return [0, 3, 2, 1, 4, 7, 6, 5]
+
+
+# sorted node numbers of every face packed into two int64 (the key to find
+# equal faces) and the order of the keys
+def FaceKeys(faces, numNodes):
+    keys = np.sort(faces, axis=1) + 1
+    base = numNodes + 1
+    keys = np.column_stack([keys[:, 0] * base + keys[:, 1], keys[:, 2] * base + keys[:, 3]])
+    order = np.lexsort((keys[:, 1], keys[:, 0]))
+    keys = keys[order]
+    same = (keys[1:, 0] == keys[:-1, 0]) & (keys[1:, 1] == keys[:-1, 1])
+    return order, same
+
+
+# faces found twice: the two copies (first, second) of every internal face
+def SharedFaces(faces, numNodes):
+    order, same = FaceKeys(faces, numNodes)
+    if np.any(same[1:] & same[:-1]):
+        raise ValueError("a face is shared by more than two cells")
+    return order[:-1][same], order[1:][same]
+
+
+# cell of every triangle / quadrangle element (a cell with a face on the same nodes)
+# returns the element rows and their cells, -1 for elements on no cell face
+def FaceElementCells(mesh):
+    faces, faceCells, _ = CellFaces(mesh)
+    rows, elements = FaceElements(mesh)
+    elementCells = np.full(len(rows), -1, dtype=np.int64)
+    order, same = FaceKeys(np.concatenate([faces, elements]), len(mesh["nodes"]))
+    a = order[:-1][same]
+    b = order[1:][same]
+    match = (a < len(faces)) & (b >= len(faces))
+    elementCells[b[match] - len(faces)] = faceCells[a[match]]
+    return rows, elementCells
+
+
+# triangle and quadrangle elements as (rows, nodes (k, 4)) with -1 as 4th node of triangles
+def FaceElements(mesh):
+    rows = np.flatnonzero(np.isin(mesh["elementTypes"], FACE_TYPES))
+    elements = np.full((len(rows), 4), -1, dtype=np.int64)
+    for elementType in FACE_TYPES:
+        selected, connectivity = msh22.ElementsOfType(mesh, elementType)
+        elements[np.searchsorted(rows, selected), :connectivity.shape[1]] = connectivity
+    return rows, elements
+
+
+# physical group of every boundary face, -1 if no boundary element has its nodes
+def BoundaryPhysical(mesh, boundaryFaces):
+    rows, elements = FaceElements(mesh)
+    physical = np.full(len(boundaryFaces), -1, dtype=np.int64)
+    if len(rows) == 0:
+        return physical
+
+    # boundary faces first, so an equal key is (face, element)
+    order, same = FaceKeys(np.concatenate([boundaryFaces, elements]), len(mesh["nodes"]))
+    a = order[:-1][same]
+    b = order[1:][same]
+    numFaces = len(boundaryFaces)
+    match = (a < numFaces) & (b >= numFaces)
+    physical[a[match]] = mesh["elementPhysical"][rows[b[match] - numFaces]]
+    return physical
+# ===============================================
+
+
+# ===============================================
+# polyMesh of the mesh (msh22 layout)
+# returns dict with points, faceOffsets, faceLabels, owner, neighbour and
+# patches [(name, type, nFaces, startFace)]
+def PolyMesh(mesh):
+    faces, faceCells, numCells = CellFaces(mesh)
+    # internal faces: the copy of the lower cell is kept, it points to the higher cell
+    first, second = SharedFaces(faces, len(mesh["nodes"]))
+    swap = faceCells[second] < faceCells[first]
+    ownerFace = np.where(swap, second, first)
+    neighbourFace = np.where(swap, first, second)
+    owner = faceCells[ownerFace]
+    neighbour = faceCells[neighbourFace]
+    internalOrder = np.lexsort((neighbour, owner))
+
+    single = np.ones(len(faces), dtype=bool)
+    single[first] = False
+    single[second] = False
+    boundaryFaces = np.flatnonzero(single)
+    boundaryPhysical = BoundaryPhysical(mesh, faces[boundaryFaces])
+
+    # patches in the order of the physical tags, defaultFaces last
+    names = {tag: name for dim, tag, name in mesh["physicalNames"] if dim == 2}
+    patchTags = [int(t) for t in np.unique(boundaryPhysical) if t >= 0]
+    patchOf = np.full(len(boundaryFaces), len(patchTags), dtype=np.int64)
+    for i, tag in enumerate(patchTags):
+        patchOf[boundaryPhysical == tag] = i
+    boundaryOrder = np.lexsort((faceCells[boundaryFaces], patchOf))
+
+    allFaces = np.concatenate([faces[ownerFace[internalOrder]], faces[boundaryFaces[boundaryOrder]]])
+    allOwner = np.concatenate([owner[internalOrder], faceCells[boundaryFaces[boundaryOrder]]])
+
+    # only the points used by the cells, numbered from 0
+    used = np.zeros(len(mesh["nodes"]), dtype=bool)
+    used[allFaces[allFaces >= 0]] = True
+    renumber = np.cumsum(used) - 1
+    sizes = np.where(allFaces[:, 3] < 0, 3, 4)
+
+    patches = []
+    start = len(internalOrder)
+    counts = np.bincount(patchOf, minlength=len(patchTags) + 1)
+    for i in range(len(patchTags) + 1):
+        if counts[i] == 0:
+            continue
+        name = names.get(patchTags[i], f"patch{patchTags[i]}") if i < len(patchTags) else DEFAULT_PATCH
+        patches.append((name, "wall" if "WALL" in name.upper() else "patch", int(counts[i]), start))
+        start += int(counts[i])
+
+    return {
+        "points": mesh["nodes"][used],
+        "faceOffsets": np.concatenate([[0], np.cumsum(sizes)]),
+        "faceLabels": renumber[allFaces[allFaces >= 0]],
+        "owner": allOwner,
+        "neighbour": neighbour[internalOrder],
+        "numCells": numCells,
+        "patches": patches,
+    }
+# ===============================================
+
+
+# ===============================================
+# FoamFile header of the binary files
+def Header(foamClass, objectName, note=None, fileFormat="binary", location="constant/polyMesh"):
+    lines = [
+        "FoamFile",
+        "{",
+        "    version     2.0;",
+        f"    format      {fileFormat};",
+        '    arch        "LSB;label=32;scalar=64";',
+    ]
+    if note:
+        lines.append(f'    note        "{note}";')
+    lines += [
+        f"    class       {foamClass};",
+        f'    location    "{location}";',
+        f"    object      {objectName};",
+        "}",
+        "",
+        "",
+    ]
+    return "\n".join(lines).encode("ascii")
+
+
+# "n\n(" raw data ")"
+def BinaryList(array, dtype, count):
+    return f"{count}\n(".encode("ascii") + np.ascontiguousarray(array, dtype=dtype).tobytes() + b")\n"
+
+
+def Labels(array):
+    if len(array) and int(array.max()) > np.iinfo(np.int32).max:
+        raise ValueError("the mesh is too large for 32 bit labels")
+    return array
+
+
+def WritePolyMesh(caseDir, polyMesh):
+    directory = os.path.join(caseDir, "constant", "polyMesh")
+    os.makedirs(directory, exist_ok=True)
+    numFaces = len(polyMesh["owner"])
+    note = (f"nPoints:{len(polyMesh['points'])}  nCells:{polyMesh['numCells']}  "
+            f"nFaces:{numFaces}  nInternalFaces:{len(polyMesh['neighbour'])}")
+
+    with open(os.path.join(directory, "points"), "wb") as f:
+        f.write(Header("vectorField", "points"))
+        f.write(BinaryList(polyMesh["points"], "<f8", len(polyMesh["points"])))
+    with open(os.path.join(directory, "faces"), "wb") as f:
+        f.write(Header("faceCompactList", "faces"))
+        f.write(BinaryList(Labels(polyMesh["faceOffsets"]), "<i4", len(polyMesh["faceOffsets"])))
+        f.write(b"\n")
+        f.write(BinaryList(Labels(polyMesh["faceLabels"]), "<i4", len(polyMesh["faceLabels"])))
+    for name in ("owner", "neighbour"):
+        with open(os.path.join(directory, name), "wb") as f:
+            f.write(Header("labelList", name, note))
+            f.write(BinaryList(Labels(polyMesh[name]), "<i4", len(polyMesh[name])))
+
+    with open(os.path.join(directory, "boundary"), "wb") as f:
+        f.write(Header("polyBoundaryMesh", "boundary", fileFormat="ascii"))
+        text = [f"{len(polyMesh['patches'])}", "("]
+        for name, patchType, count, start in polyMesh["patches"]:
+            text += [f"    {name}", "    {", f"        type            {patchType};"]
+            if patchType == "wall":
+                text.append("        inGroups        1(wall);")
+            text += [f"        nFaces          {count};", f"        startFace       {start};", "    }"]
+        text += [")", ""]
+        f.write("\n".join(text).encode("ascii"))
+    return directory
+
+
+# polyMesh of the current gmsh model, next to the *.msh file
+def FoamCasePath(mshPath):
+    return os.path.splitext(mshPath)[0] + "_openfoam"
+
+
+def ExportGmshPolyMesh(mshPath):
+    caseDir = FoamCasePath(mshPath)
+    WritePolyMesh(caseDir, PolyMesh(MeshFromGmsh()))
+    return caseDir
+# ===============================================
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="write an OpenFOAM polyMesh from a MSH 2.2 file")
+    parser.add_argument("msh", help="mesh (MSH 2.2, ASCII or binary)")
+    parser.add_argument("case", help="OpenFOAM case folder, constant/polyMesh is written in it")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    mesh = msh22.ReadMsh22(args.msh)
+    read = time.perf_counter()
+    polyMesh = PolyMesh(mesh)
+    convert = time.perf_counter()
+    WritePolyMesh(args.case, polyMesh)
+    print(f"{len(polyMesh['points'])} points, {polyMesh['numCells']} cells, {len(polyMesh['owner'])} faces "
+          f"({len(polyMesh['neighbour'])} internal)")
+    for name, patchType, count, _ in polyMesh["patches"]:
+        print(f"  {name} ({patchType}): {count} faces")
+    print(f"read {read - start:.2f} s, faces {convert - read:.2f} s, write {time.perf_counter() - convert:.2f} s")
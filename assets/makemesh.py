@@ -4,13 +4,24 @@
 # output : *.msh, *.vtk
 # *************************************************************
 
+import argparse
 import gmsh
+import json
 import math
 import os
 import sys
+import tempfile
 import numpy as np
 
-gmsh.initialize(sys.argv)
+import meshcache
+import meshoptions
+import meshoutput
+import meshpartition
+import meshprofile
+import meshquality
+import sizefield
+import surfaceio
+import surfaceprep
 
 # ===============================================
 # input parameter
@@ -18,6 +29,30 @@ meshSize = 0.5 # mesh size
 N = 5 # number of layers
 r = 1.2 # ration
 h = 0.08 # first_layer_thickness
+classifyAngle = 40 # angle of classifySurfaces [deg]
+# meshing algorithm and number of threads (see meshoptions.py)
+meshOptions = dict(meshoptions.DEFAULT_MESH_OPTIONS)
+# output formats (see meshoutput.py)
+outputOptions = dict(meshoutput.DEFAULT_OUTPUT_OPTIONS)
+# element size following the lumen radius along the centerline (see sizefield.py)
+# uniform meshSize while centerline is None
+sizeFieldOptions = dict(sizefield.DEFAULT_SIZE_FIELD_OPTIONS)
+# optimization after generate(3), always or only below the quality targets (see meshquality.py)
+qualityOptions = dict(meshquality.DEFAULT_QUALITY_OPTIONS)
+# cleaning / decimation of the STL before gmsh (see surfaceprep.py)
+prepOptions = dict(surfaceprep.DEFAULT_PREP_OPTIONS)
+# tetra inside the boundary layers
+# False: prism layers and caps only, the inside is meshed later (see meshpipeline.py)
+innerVolume = True
+# the classified surfaces of ImportStl() are stored here (meshcache.MeshCache, set by --cache-dir)
+# None: classifySurfaces() runs every time
+geometryCache = None
+# ===============================================
+
+# input / output files (can be changed with --stl, --msh, --vtk)
+stlPath = "WALL.stl"
+outputMeshPath = "MeshOriginal.msh"
+outputVTKPath = "MeshOriginal.vtk"
 # ===============================================
 
 # ===============================================
@@ -25,6 +60,18 @@ h = 0.08 # first_layer_thickness
 surface_real_wall = []
 surface_fake_wall = []
 surface_inlet_outlet = []
+# meshing algorithm and number of threads actually used in Meshing()
+usedMeshOptions = {}
+# summary of the size field used in Meshing()
+usedSizeField = {}
+# partition of the mesh made in OutputMshVtk() (meshpartition.py)
+usedPartition = {}
+# quality and optimizer passes of Meshing() (meshquality.py)
+usedQuality = {}
+# geometry cache hit or miss of ImportStl()
+usedGeometry = {}
+# triangle counts and timings of the surface preparation (surfaceprep.py)
+usedPrep = {}
 # ===============================================
 
 
@@ -58,14 +105,23 @@ def OptionSetting():
 # ===============================================
 # read stl
 def ImportStl():
-    # Absorb differences in directory and file paths between operating systems
-    path = os.path.dirname(os.path.abspath(__file__))
-    # read stl
-    gmsh.merge(os.path.join(path, "WALL.stl"))
-
-    # Decompose the loaded shape at a set angle
-    # it takes time if forReparametrization is not True
-    gmsh.model.mesh.classifySurfaces(angle = 40 * math.pi / 180, boundary=True, forReparametrization=True)
+    usedPrep.clear()
+    # the same STL was already classified with the same angle
+    if not LoadClassifiedSurfaces():
+        # read stl
+        # with --surface-prep the surface is cleaned (and decimated) first (see surfaceprep.py)
+        # *.npz/*.npy/*.bin are given to gmsh as arrays (see surfaceio.py)
+        if prepOptions["mode"] != "off":
+            usedPrep.update(surfaceprep.ImportPreparedSurface(InputPath(), prepOptions, meshSize))
+        elif surfaceio.IsSurfaceArrayFile(InputPath()):
+            surfaceio.ImportSurface(InputPath())
+        else:
+            gmsh.merge(InputPath())
+
+        # Decompose the loaded shape at a set angle
+        # it takes time if forReparametrization is not True
+        gmsh.model.mesh.classifySurfaces(angle = classifyAngle * math.pi / 180, boundary=True, forReparametrization=True)
+        StoreClassifiedSurfaces()
     # use with classifySurfaces
     gmsh.model.mesh.createGeometry()
 
@@ -81,6 +137,61 @@ def ImportStl():
     Syncronize()
 # ===============================================
 
+# ===============================================
+# cache of the classified surfaces
+# classifySurfaces() only depends on the STL and the angle, not on meshSize, N, r or h,
+# so the classified mesh is stored as MSH 4.1 (entities and their boundaries) in geometryCache
+# and merged again on the next run; createGeometry() then runs on it as after classifySurfaces()
+def GeometryCacheKey():
+    return geometryCache.Key(InputPath(), {"script": "makemesh-geometry", "classifyAngle": classifyAngle,
+                                           "boundary": True, "forReparametrization": True, "surfacePrep": prepOptions,
+                                           # the decimation target follows meshSize
+                                           "prepMeshSize": meshSize if prepOptions["mode"] == "decimate" else None})
+
+
+def MergeClassifiedSurfaces(path):
+    gmsh.merge(path)
+    # classifySurfaces() also gives the discrete entities to the built-in (geo) kernel,
+    # without this extrudeBoundaryLayer() makes no side walls; the entities keep their tags
+    gmsh.model.mesh.createTopology()
+
+
+# returns True if the classified surfaces were merged from the cache
+def LoadClassifiedSurfaces():
+    usedGeometry.clear()
+    if geometryCache is None:
+        return False
+    usedGeometry["key"] = GeometryCacheKey()
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "geometry.msh")
+        if geometryCache.Lookup(usedGeometry["key"], {"geometry": path}) is None:
+            usedGeometry["cache"] = "miss"
+            return False
+        MergeClassifiedSurfaces(path)
+    print(f"geometry cache hit {usedGeometry['key']}")
+    usedGeometry["cache"] = "hit"
+    return True
+
+
+# the model is then made again from the stored file, because the reparametrization of
+# a merged model differs in a few triangles from the one of classifySurfaces();
+# so the first run and all later runs with the cache give the same mesh
+def StoreClassifiedSurfaces():
+    if geometryCache is None:
+        return
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "geometry.msh")
+        gmsh.option.setNumber("Mesh.MshFileVersion", 4.1)
+        gmsh.option.setNumber("Mesh.Binary", 1)
+        gmsh.option.setNumber("Mesh.SaveAll", 1)
+        gmsh.write(path)
+        gmsh.option.setNumber("Mesh.Binary", 0)
+        gmsh.option.setNumber("Mesh.SaveAll", 0)
+        geometryCache.Store(usedGeometry["key"], {"geometry": path}, {"stl": stlPath, "classifyAngle": classifyAngle})
+        gmsh.clear()
+        MergeClassifiedSurfaces(path)
+# ===============================================
+
 # ===============================================
 # Create boundary layers and tetra meshes inside the boundary layers for regions
 # Shape creation, such as setting volume
@@ -132,9 +243,10 @@ def ShapeCreation():
         surface_inlet_outlet.append(eachClosedSurface)
 
     # surface_fake_wall is a set of surfaces (2D Entity) surrounding the area where the tetra mesh is created
-    innerSurfaceLoop = gmsh.model.geo.addSurfaceLoop(surface_fake_wall)
-    # Assign the actual volume to the area created above
-    gmsh.model.geo.addVolume([innerSurfaceLoop])
+    if innerVolume:
+        innerSurfaceLoop = gmsh.model.geo.addSurfaceLoop(surface_fake_wall)
+        # Assign the actual volume to the area created above
+        gmsh.model.geo.addVolume([innerSurfaceLoop])
 
     Syncronize()
 # ===============================================
@@ -202,10 +314,13 @@ def ConfirmMesh():
 # .msh files are used for OpenFOAM, which outputs a mesh for the extension depending on the extension.
 # To use .msh for OpenFOAM, the file format version of .msh must be 2.2.
 # vtk files are also output for viewing in paraview.
+# binary, compression or no vtk are selected with outputOptions
 def OutputMshVtk():
-    gmsh.option.setNumber("Mesh.MshFileVersion", 2.2)
-    gmsh.write("MeshOriginal.msh")
-    gmsh.write("MeshOriginal.vtk")
+    usedPartition.clear()
+    summary, processor = meshpartition.PartitionMesh(outputOptions)
+    usedPartition.update(summary)
+    written = meshoutput.WriteOutputs(outputMeshPath, outputVTKPath, outputOptions, processor)
+    print(f"output = {written}")
 # ===============================================
 
 # ===============================================
@@ -216,21 +331,61 @@ def Meshing():
     # 0 is no optimization
     # 1 is maximum optimization
     gmsh.option.setNumber("Mesh.OptimizeThreshold", 0.9)
-    # Set mesh algorithm
-    gmsh.option.setNumber('Mesh.Algorithm', 1)
+    # Set mesh algorithm and number of threads
+    # HXT (algorithm3d 10) makes the tetrahedra in parallel
+    usedMeshOptions.clear()
+    usedMeshOptions.update(meshoptions.ApplyMeshOptions(meshOptions))
+    print(f"mesh options = {json.dumps(usedMeshOptions)}")
     # How many times to repeat optimization->why the quality gets worse
     # gmsh.option.setNumber(“Mesh.Optimize”, 10)
     # Overall mesh control
     # interpolate between Min and Max
     # Basically, it is cut based on Max
     # Min may be meaningless
-    gmsh.option.setNumber("Mesh.MeshSizeMin", meshSize)
-    gmsh.option.setNumber("Mesh.MeshSizeMax", meshSize)
-    gmsh.model.mesh.generate(3)
-    gmsh.model.mesh.optimize()
+    usedSizeField.clear()
+    if sizeFieldOptions["centerline"] is None:
+        gmsh.option.setNumber("Mesh.MeshSizeMin", meshSize)
+        gmsh.option.setNumber("Mesh.MeshSizeMax", meshSize)
+    else:
+        # finer in stenoses, coarser in aneurysms
+        usedSizeField.update(sizefield.ApplySizeField(sizeFieldOptions, meshSize))
+        print(f"size field = {json.dumps(usedSizeField)}")
+    usedQuality.clear()
+    usedQuality.update(meshquality.GenerateAndOptimize(qualityOptions))
+    sizefield.RemoveSizeFieldFile(usedSizeField)
     print("finish meshing")
 # ===============================================
 
+# ===============================================
+# path of the input STL
+# Absorb differences in directory and file paths between operating systems
+# relative paths are from the folder of this script
+def InputPath():
+    path = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(path, stlPath)
+# ===============================================
+
+# ===============================================
+# every parameter that changes the resulting mesh
+# used as the key of meshcache.py
+def CacheParameters():
+    return {
+        "script": "makemesh",
+        "meshSize": meshSize,
+        "N": N,
+        "r": r,
+        "h": h,
+        "classifyAngle": classifyAngle,
+        "meshOptions": meshOptions,
+        "outputOptions": outputOptions,
+        "sizeField": sizeFieldOptions,
+        "quality": qualityOptions,
+        "surfacePrep": prepOptions,
+        # another key when the content of the centerline file changes
+        "sizeFieldCenterline": meshcache.FileHash(sizeFieldOptions["centerline"]) if sizeFieldOptions["centerline"] else None,
+    }
+# ===============================================
+
 # ===============================================
 # Defined shapes, etc. in gmsh shape kernel? Reflected in
 # Functionalized as it is used many times
@@ -238,12 +393,78 @@ def Syncronize():
     gmsh.model.geo.synchronize()
 # ===============================================
 
-OptionSetting()
-ImportStl()
-ShapeCreation()
-NamingBoundary()
-Meshing()
-OutputMshVtk()
-ConfirmMesh()
+# ===============================================
+# make the whole model from the STL
+# returns the record of the run (see meshprofile.py)
+# if cache (meshcache.MeshCache) is given, identical inputs and parameters are not meshed again
+def MakeMesh(cache=None):
+    outputFiles = meshoutput.OutputFiles(outputMeshPath, outputVTKPath, outputOptions)
+    if cache is not None:
+        cacheKey = cache.Key(InputPath(), CacheParameters())
+        record = cache.Lookup(cacheKey, outputFiles)
+        if record is not None:
+            print(f"cache hit {cacheKey}")
+            record["cache"] = "hit"
+            return record
+
+    # measure time and memory of each step (see meshprofile.py)
+    profiler = meshprofile.PhaseProfiler()
+    profiler.Start()
+    try:
+        for phase in (OptionSetting, ImportStl, ShapeCreation, NamingBoundary, Meshing, OutputMshVtk):
+            with profiler.Phase(phase.__name__):
+                phase()
+    finally:
+        # also stop the sampler and the gmsh logger when a phase fails (the server and batch go on with the next job)
+        profiler.Stop()
+    record = {"script": "makemesh", "stl": stlPath, "meshSize": meshSize, "N": N, "r": r, "h": h, "meshOptions": usedMeshOptions, "sizeField": usedSizeField, "partition": usedPartition, "quality": usedQuality, "geometry": usedGeometry, "surfacePrep": usedPrep, "outputs": outputFiles}
+    record.update(profiler.Finish())
+    if cache is not None:
+        cache.Store(cacheKey, outputFiles, record)
+        record["cache"] = "miss"
+    return record
+# ===============================================
 
-gmsh.finalize()
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="make the 3D model (boundary layer + tetra) from WALL.stl")
+    parser.add_argument("--stl", default=stlPath, help="input surface (relative paths are from the folder of this script)")
+    parser.add_argument("--msh", default=outputMeshPath)
+    parser.add_argument("--vtk", default=outputVTKPath)
+    parser.add_argument("--mesh-size", type=float, default=meshSize)
+    parser.add_argument("--layers", type=int, default=N, help="number of boundary layers N")
+    parser.add_argument("--growth-ratio", type=float, default=r, help="thickness ratio r of two neighbouring layers")
+    parser.add_argument("--first-layer", type=float, default=h, help="thickness h of the first layer")
+    parser.add_argument("--classify-angle", type=float, default=classifyAngle, help="angle of classifySurfaces [deg]")
+    meshoptions.AddMeshOptionArguments(parser)
+    meshprofile.AddReportArgument(parser)
+    meshcache.AddCacheArguments(parser)
+    meshoutput.AddOutputArguments(parser)
+    sizefield.AddSizeFieldArguments(parser)
+    meshquality.AddQualityArguments(parser)
+    surfaceprep.AddPrepArguments(parser)
+    # gmsh options such as -nopopup are passed to gmsh as they are
+    args, gmshArgs = parser.parse_known_args()
+    stlPath = args.stl
+    outputMeshPath = args.msh
+    outputVTKPath = args.vtk
+    meshSize = args.mesh_size
+    N = args.layers
+    r = args.growth_ratio
+    h = args.first_layer
+    classifyAngle = args.classify_angle
+    meshOptions = meshoptions.MeshOptionsFromArgs(args)
+    outputOptions = meshoutput.OutputOptionsFromArgs(args)
+    sizeFieldOptions = sizefield.ResolveSizeFieldOptions(sizefield.SizeFieldOptionsFromArgs(args), meshSize)
+    qualityOptions = meshquality.QualityOptionsFromArgs(args)
+    prepOptions = surfaceprep.PrepOptionsFromArgs(args)
+
+    # --cache-dir also keeps the classified surfaces, so that runs with other meshSize, N, r, h skip classifySurfaces()
+    geometryCache = meshcache.MeshCacheFromArgs(args)
+
+    gmsh.initialize([sys.argv[0]] + gmshArgs)
+    record = MakeMesh(geometryCache)
+    meshprofile.WriteReport(record, args.report)
+    if record.get("cache") != "hit":
+        ConfirmMesh()
+
+    gmsh.finalize()
\ No newline at end of file
@@ -1,14 +1,20 @@
+import argparse
 import gmsh
+import json
 import math
 import os
 import sys
 import numpy as np
 
-gmsh.initialize(sys.argv)
-
-stlPath = sys.argv[1]
-outputMeshPath = sys.argv[2]
-outputVTKPath = sys.argv[3]
+import meshcache
+import meshoptions
+import meshoutput
+import meshpartition
+import meshprofile
+import meshquality
+import sizefield
+import surfaceio
+import surfaceprep
 
 # ===============================================
 # パラメータ
@@ -17,15 +23,48 @@ meshSize = 0.9 # mesh size
 # N = 5 # number of layers
 # r = 1.1 # ration
 # h = 0.05 # first_layer_thickness
+# メッシュのアルゴリズムとスレッド数 (meshoptions.py参照)
+meshOptions = dict(meshoptions.DEFAULT_MESH_OPTIONS)
+# 出力形式 (meshoutput.py参照)
+outputOptions = dict(meshoutput.DEFAULT_OUTPUT_OPTIONS)
+# 中心線から求めた半径に合わせたメッシュサイズ (sizefield.py参照)
+# centerlineがNoneのときは全体でmeshSize
+sizeFieldOptions = dict(sizefield.DEFAULT_SIZE_FIELD_OPTIONS)
+# generate(3)の後の最適化、毎回か品質が目標より低いときだけか (meshquality.py参照)
+qualityOptions = dict(meshquality.DEFAULT_QUALITY_OPTIONS)
+# Trueのときは壁面の三角形をそのまま使い、流出入部の面と体積だけメッシュを作る
+# メッシュ後に壁面が入力と同じ三角形か確認し、違えばエラー (--volume-only)
+volumeOnly = False
+# stlの修復 (surfaceprep.py参照)
+# 壁面の節点はプリズム層の一番内側の節点と同じでないといけないので、間引き (decimate) は使えない
+prepOptions = dict(surfaceprep.DEFAULT_PREP_OPTIONS)
 # ===========================
 
 
 
 # ===============================================
 # グローバル変数
+# 入出力のパスはMakeInnerMesh()でセットする
+stlPath = None
+# stlPathの代わりに頂点と三角形の配列 (vertices, triangles) から読む (meshpipeline.py参照)
+surfaceArrays = None
+outputMeshPath = None
+outputVTKPath = None
 surface_real_wall = []
 surface_fake_wall = []
 surface_inlet_outlet = []
+# Meshing()で実際に使われたアルゴリズムとスレッド数
+usedMeshOptions = {}
+# Meshing()で使ったサイズ場の概要
+usedSizeField = {}
+# OutputMshVtk()で作った分割の概要 (meshpartition.py)
+usedPartition = {}
+# volumeOnlyのときの壁面の確認結果 (SurfaceConformity)
+usedInterface = {}
+# Meshing()の品質と最適化の各パス (meshquality.py)
+usedQuality = {}
+# stlの修復の前後の三角形数と時間 (surfaceprep.py)
+usedPrep = {}
 # ===============================================
 
 
@@ -60,10 +99,20 @@ def OptionSetting():
 # ===============================================
 # stlの読み込み
 def ImportStl():
-    # ディレクトリやファイルのパスのOSごとの差を吸収
-    path = os.path.dirname(os.path.abspath(__file__))
     # stlの読み込み
-    gmsh.merge(os.path.join(path, stlPath))
+    # *.npz/*.npy/*.binは配列のままgmshに渡す (surfaceio.py参照)
+    # surfaceArraysがあるときはファイルを読まない
+    # 節点番号は頂点の番号+1のまま残る
+    # --surface-prep repairのときは重複した頂点・三角形と潰れた三角形を除いてから渡す
+    usedPrep.clear()
+    if surfaceArrays is not None:
+        surfaceio.AddSurfaceToGmsh(*surfaceArrays)
+    elif prepOptions["mode"] != "off":
+        usedPrep.update(surfaceprep.ImportPreparedSurface(InputPath(), prepOptions, meshSize))
+    elif surfaceio.IsSurfaceArrayFile(InputPath()):
+        surfaceio.ImportSurface(InputPath())
+    else:
+        gmsh.merge(InputPath())
 
     # 読み込んだ形状を設定した角度で分解
     # forReparametrizationをTrueにしないとメッシングで時間がかかる
@@ -228,10 +277,13 @@ def Syncronize():
 # OpenFOAMに用いるのは.mshファイル
 # .mshをOpneFOAMで用いるには、.mshのファイルフォーマットバージョンを2.2にする必要がある
 # paraviewで見るように.vtkファイルも出力
+# バイナリ・圧縮・vtkなしはoutputOptionsで指定
 def OutputMshVtk():
-    gmsh.option.setNumber("Mesh.MshFileVersion", 2.2)
-    gmsh.write(outputMeshPath)
-    gmsh.write(outputVTKPath)
+    usedPartition.clear()
+    summary, processor = meshpartition.PartitionMesh(outputOptions)
+    usedPartition.update(summary)
+    written = meshoutput.WriteOutputs(outputMeshPath, outputVTKPath, outputOptions, processor)
+    print(f"output = {written}")
 # ===============================================
 
 
@@ -243,28 +295,227 @@ def Meshing():
     # 0が最適化なし
     # 1が最適化最大
     gmsh.option.setNumber("Mesh.OptimizeThreshold", 0.9)
-    # メッシュのアルゴリズムを設定
-    gmsh.option.setNumber('Mesh.Algorithm', 1)
+    # メッシュのアルゴリズムとスレッド数を設定
+    # HXT (algorithm3d 10) は並列でテトラを作る
+    usedMeshOptions.clear()
+    usedMeshOptions.update(meshoptions.ApplyMeshOptions(meshOptions))
+    print(f"mesh options = {json.dumps(usedMeshOptions)}")
     # 最適化を何回繰り返すか->なぜか品質わるくなる
     # gmsh.option.setNumber("Mesh.Optimize", 10)
     # 全体的なメッシュの制御
     # MinとMaxではさむ
     # 基本的にMaxを基準に切られる
     # Minは意味ないかも
-    gmsh.option.setNumber("Mesh.MeshSizeMin", meshSize)
-    gmsh.option.setNumber("Mesh.MeshSizeMax", meshSize)
-    gmsh.model.mesh.generate(3)
-    gmsh.model.mesh.optimize()
+    usedSizeField.clear()
+    if sizeFieldOptions["centerline"] is None:
+        gmsh.option.setNumber("Mesh.MeshSizeMin", meshSize)
+        gmsh.option.setNumber("Mesh.MeshSizeMax", meshSize)
+    else:
+        # 狭窄部は細かく、瘤は粗く
+        usedSizeField.update(sizefield.ApplySizeField(sizeFieldOptions, meshSize))
+        print(f"size field = {json.dumps(usedSizeField)}")
+    usedInterface.clear()
+    if volumeOnly:
+        # 壁面は2次元のメッシュ作成から外す (見えない面はメッシュを作らない)
+        inputSurface = WallTriangles()
+        gmsh.option.setNumber("Mesh.MeshOnlyVisible", 1)
+        gmsh.model.setVisibility([(2, tag) for tag in surface_real_wall], 0)
+    usedQuality.clear()
+    try:
+        usedQuality.update(meshquality.GenerateAndOptimize(qualityOptions))
+    finally:
+        # 失敗しても元に戻す (meshserverでは同じgmshセッションで次のジョブを実行する)
+        if volumeOnly:
+            gmsh.option.setNumber("Mesh.MeshOnlyVisible", 0)
+            gmsh.model.setVisibility([(2, tag) for tag in surface_real_wall], 1)
+        sizefield.RemoveSizeFieldFile(usedSizeField)
+    if volumeOnly:
+        usedInterface.update(SurfaceConformity(inputSurface, WallTriangles()))
+        print(f"interface = {json.dumps(usedInterface)}")
+        if not usedInterface["conforming"]:
+            raise RuntimeError(f"the INNERWALL triangles are not the input triangles: {json.dumps(usedInterface)}")
     print("finish meshing")
 # ===============================================
 
 
-OptionSetting()
-ImportStl()
-ShapeCreation()
-NamingBoundary()
-Meshing()
-OutputMshVtk()
-# ConfirmMesh()
+# ===============================================
+# 壁面 (surface_real_wall) の三角形の座標 (m, 3, 3)
+def WallTriangles():
+    nodeTags, coordinates, _ = gmsh.model.mesh.getNodes()
+    index = np.zeros(int(nodeTags.max()) + 1, dtype=np.int64)
+    index[nodeTags.astype(np.int64)] = np.arange(len(nodeTags))
+    triangles = [gmsh.model.mesh.getElementsByType(2, tag)[1] for tag in surface_real_wall]
+    return coordinates.reshape(-1, 3)[index[np.concatenate(triangles).astype(np.int64)]].reshape(-1, 3, 3)
+
+
+# メッシュ前後の壁面の比較
+# 座標が完全に同じ節点を同じ節点とみなし、三角形を節点の組で比べる
+# (C#のAlgorithm.KDTreeと同じく節点数も比べる)
+def SurfaceConformity(before, after):
+    _, ids = np.unique(np.concatenate([before, after]).reshape(-1, 3), axis=0, return_inverse=True)
+    ids = ids.reshape(-1, 3)
+    triangles, inverse = np.unique(np.sort(ids, axis=1), axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    countBefore = np.bincount(inverse[:len(before)], minlength=len(triangles))
+    countAfter = np.bincount(inverse[len(before):], minlength=len(triangles))
+    result = {
+        "inputTriangles": int(len(before)),
+        "wallTriangles": int(len(after)),
+        "inputNodes": int(len(np.unique(ids[:len(before)]))),
+        "wallNodes": int(len(np.unique(ids[len(before):]))),
+        "missingTriangles": int(np.maximum(countBefore - countAfter, 0).sum()),
+        "extraTriangles": int(np.maximum(countAfter - countBefore, 0).sum()),
+    }
+    result["conforming"] = (result["missingTriangles"] == 0 and result["extraTriangles"] == 0
+                            and result["inputNodes"] == result["wallNodes"])
+    return result
+# ===============================================
+
+
+# ===============================================
+# 入力stlのパス
+# ディレクトリやファイルのパスのOSごとの差を吸収
+# 相対パスはこのスクリプトのフォルダから
+def InputPath():
+    path = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(path, stlPath)
+# ===============================================
+
+
+# ===============================================
+# メッシュの結果を変えるパラメータ全部
+# meshcache.pyのキーに使う
+def CacheParameters():
+    return {
+        "script": "makemesh_inner",
+        "meshSize": meshSize,
+        "meshOptions": meshOptions,
+        "outputOptions": outputOptions,
+        "sizeField": sizeFieldOptions,
+        "volumeOnly": volumeOnly,
+        "quality": qualityOptions,
+        "surfacePrep": prepOptions,
+        # 中心線ファイルの中身が変わったら別のキー
+        "sizeFieldCenterline": meshcache.FileHash(sizeFieldOptions["centerline"]) if sizeFieldOptions["centerline"] else None,
+    }
+# ===============================================
+
+
+# ===============================================
+# 前のジョブの形状とグローバル変数を消去
+# gmshを初期化し直さずに何度もメッシュを作るため
+def ResetModel():
+    gmsh.clear()
+    surface_real_wall.clear()
+    surface_fake_wall.clear()
+    surface_inlet_outlet.clear()
+# ===============================================
+
+
+# ===============================================
+# 作成したメッシュの節点数と要素数
+def MeshStatistics():
+    nodeTags, _, _ = gmsh.model.mesh.getNodes()
+    elementCounts = {}
+    for dim in range(1, 4):
+        _, elementTags, _ = gmsh.model.mesh.getElements(dim)
+        elementCounts[dim] = int(sum(len(t) for t in elementTags))
+    return {
+        "nodes": int(len(nodeTags)),
+        "elements2D": elementCounts[2],
+        "elements3D": elementCounts[3],
+        "meshOptions": dict(usedMeshOptions),
+        "sizeField": dict(usedSizeField),
+        "partition": dict(usedPartition),
+        "interface": dict(usedInterface),
+        "quality": dict(usedQuality),
+        "surfacePrep": dict(usedPrep),
+    }
+# ===============================================
+
+
+# ===============================================
+# stl1つから内側のテトラメッシュを作成
+# gmsh.initialize()は呼び出し側で済ませておく
+# 節点数・要素数と各段階の計測結果を返す
+# cache (meshcache.MeshCache) を渡すと、同じ入力とパラメータのメッシュは作り直さない
+def MakeInnerMesh(stl, msh, vtk, size=None, options=None, cache=None, outputs=None, sizeField=None, volume=None, quality=None, prep=None):
+    global stlPath, outputMeshPath, outputVTKPath, meshSize, meshOptions, outputOptions, sizeFieldOptions, volumeOnly, qualityOptions, prepOptions
+    stlPath = stl
+    outputMeshPath = msh
+    outputVTKPath = vtk
+    if size is not None:
+        meshSize = size
+    if options is not None:
+        meshOptions = meshoptions.ResolveMeshOptions(options)
+    if outputs is not None:
+        outputOptions = meshoutput.ResolveOutputOptions(outputs)
+    if sizeField is not None:
+        sizeFieldOptions = sizefield.ResolveSizeFieldOptions(sizeField, meshSize)
+    if volume is not None:
+        volumeOnly = bool(volume)
+    if quality is not None:
+        qualityOptions = meshquality.ResolveQualityOptions(quality)
+    if prep is not None:
+        prepOptions = surfaceprep.ResolvePrepOptions(prep)
+    if prepOptions["mode"] == "decimate":
+        raise ValueError("surface preparation decimate moves the wall nodes, the inner mesh would not match the prism layer; use repair")
+
+    outputFiles = meshoutput.OutputFiles(outputMeshPath, outputVTKPath, outputOptions)
+    if cache is not None:
+        cacheKey = cache.Key(InputPath(), CacheParameters())
+        record = cache.Lookup(cacheKey, outputFiles)
+        if record is not None:
+            print(f"cache hit {cacheKey}")
+            record["cache"] = "hit"
+            return record
+
+    # 各段階の時間とメモリを計測 (meshprofile.py参照)
+    profiler = meshprofile.PhaseProfiler()
+    profiler.Start()
+    try:
+        ResetModel()
+        for phase in (OptionSetting, ImportStl, ShapeCreation, NamingBoundary, Meshing, OutputMshVtk):
+            with profiler.Phase(phase.__name__):
+                phase()
+    finally:
+        # 失敗した場合もサンプラーとgmshのloggerを止める (サーバーやバッチは次のジョブへ進むため)
+        profiler.Stop()
+    record = {"script": "makemesh_inner", "stl": stlPath, "meshSize": meshSize, "outputs": outputFiles}
+    record.update(MeshStatistics())
+    record.update(profiler.Finish())
+    if cache is not None:
+        cache.Store(cacheKey, outputFiles, record)
+        record["cache"] = "miss"
+    return record
+# ===============================================
+
 
-gmsh.finalize()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="make the inner tetra mesh from the most inner surface stl")
+    parser.add_argument("stl")
+    parser.add_argument("msh")
+    parser.add_argument("vtk")
+    parser.add_argument("--mesh-size", type=float, default=meshSize)
+    meshoptions.AddMeshOptionArguments(parser)
+    meshprofile.AddReportArgument(parser)
+    meshcache.AddCacheArguments(parser)
+    meshoutput.AddOutputArguments(parser)
+    sizefield.AddSizeFieldArguments(parser)
+    meshquality.AddQualityArguments(parser)
+    surfaceprep.AddPrepArguments(parser)
+    parser.add_argument("--volume-only", action="store_true", help="keep the surface triangles, mesh only the caps and the volume, check the interface")
+    # -nopopupなどgmshのオプションはそのままgmshに渡す
+    args, gmshArgs = parser.parse_known_args()
+
+    gmsh.initialize([sys.argv[0]] + gmshArgs)
+    options = meshoptions.MeshOptionsFromArgs(args)
+    cache = meshcache.MeshCacheFromArgs(args)
+    outputs = meshoutput.OutputOptionsFromArgs(args)
+    sizeField = sizefield.SizeFieldOptionsFromArgs(args)
+    quality = meshquality.QualityOptionsFromArgs(args)
+    prep = surfaceprep.PrepOptionsFromArgs(args)
+    record = MakeInnerMesh(args.stl, args.msh, args.vtk, args.mesh_size, options, cache, outputs, sizeField, args.volume_only, quality, prep)
+    meshprofile.WriteReport(record, args.report)
+    # ConfirmMesh()
+    gmsh.finalize()
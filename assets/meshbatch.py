@@ -0,0 +1,168 @@
+# *************************************************************
+# Batch mode for makemesh_inner.py.
+# Many STL -> mesh jobs listed in a manifest are meshed in a pool of
+# worker processes. The gmsh API is process-global, so every worker
+# is a separate process with its own gmsh session.
+# input  : manifest (*.json or *.csv)
+#          json : [{"id": "p001", "stl": "...", "msh": "...", "vtk": "...", "meshSize": 0.9,
+#                   "meshOptions": {"algorithm3d": "hxt"}, "outputOptions": {"vtk": "none"},
+#                   "sizeField": {"centerline": "..."}, "volumeOnly": true,
+#                   "qualityOptions": {"optimize": "gated"}, "surfacePrep": {"mode": "repair"}}, ...]
+#                 or {"jobs": [...]}
+#          csv  : header line "id,stl,msh,vtk,meshSize" (id and meshSize may be empty)
+#          relative paths are resolved from the folder of the manifest
+#          the flags of meshoptions.py / meshoutput.py set the defaults of all jobs
+#          --cache-dir DIR is shared by all workers (see meshcache.py)
+# output : *.msh, *.vtk of every job
+#          checkpoint (*.checkpoint.jsonl) with one JSON result per finished job
+#
+# usage  : python meshbatch.py cohort.json --workers 16
+#          running the same command again skips the jobs already done
+# *************************************************************
+
+import argparse
+import csv
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import meshcache
+import meshoptions
+import meshoutput
+
+
+# ===============================================
+# read the manifest and return the list of jobs
+# every job gets an "id" (its line number if not given) and absolute paths
+def ReadManifest(manifestPath, defaultOptions=None, defaultOutputOptions=None):
+    baseDir = os.path.dirname(os.path.abspath(manifestPath))
+    if manifestPath.lower().endswith(".csv"):
+        with open(manifestPath, newline="") as f:
+            jobs = [dict(row) for row in csv.DictReader(f)]
+    else:
+        with open(manifestPath) as f:
+            jobs = json.load(f)
+        if isinstance(jobs, dict):
+            jobs = jobs["jobs"]
+
+    for i, job in enumerate(jobs):
+        if not job.get("id"):
+            job["id"] = str(i)
+        job["id"] = str(job["id"])
+        if job.get("meshSize") in ("", None):
+            job.pop("meshSize", None)
+        for key in ("stl", "msh", "vtk"):
+            job[key] = os.path.join(baseDir, job[key])
+        options = dict(defaultOptions or {})
+        options.update(job.get("meshOptions") or {})
+        job["meshOptions"] = options
+        outputs = dict(defaultOutputOptions or {})
+        outputs.update(job.get("outputOptions") or {})
+        job["outputOptions"] = outputs
+        if (job.get("sizeField") or {}).get("centerline"):
+            job["sizeField"]["centerline"] = os.path.join(baseDir, job["sizeField"]["centerline"])
+
+    ids = [job["id"] for job in jobs]
+    if len(set(ids)) != len(ids):
+        raise ValueError(f"job ids in {manifestPath} are not unique")
+    return jobs
+# ===============================================
+
+
+# ===============================================
+# ids of the jobs already finished successfully
+# a line cut off by an interrupted run is ignored
+def ReadCheckpoint(checkpointPath):
+    done = set()
+    if not os.path.exists(checkpointPath):
+        return done
+    with open(checkpointPath) as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if result.get("status") == "ok":
+                done.add(str(result["id"]))
+    return done
+
+
+def AppendCheckpoint(checkpointFile, result):
+    checkpointFile.write(json.dumps(result) + "\n")
+    checkpointFile.flush()
+    os.fsync(checkpointFile.fileno())
+# ===============================================
+
+
+# ===============================================
+# worker process
+# gmsh is initialized once per worker and reused for all its jobs
+def InitWorker(cacheDir=None, cacheBudget=None):
+    import atexit
+    import gmsh
+    import meshserver
+    gmsh.initialize()
+    atexit.register(gmsh.finalize)
+    if cacheDir is not None:
+        meshserver.meshCache = meshcache.MeshCache(cacheDir, cacheBudget)
+
+
+def WorkerRunJob(job):
+    from meshserver import RunJob
+    return RunJob(job)
+# ===============================================
+
+
+# ===============================================
+# run all jobs not yet in the checkpoint
+# returns the number of failed jobs
+def RunBatch(jobs, checkpointPath, workers, cache=None):
+    done = ReadCheckpoint(checkpointPath)
+    pending = [job for job in jobs if job["id"] not in done]
+    print(f"{len(jobs)} jobs, {len(jobs) - len(pending)} already done, {len(pending)} to run with {workers} workers")
+    if not pending:
+        return 0
+
+    failed = 0
+    finished = 0
+    with open(checkpointPath, "a") as checkpointFile:
+        # the cache object itself is rebuilt in every worker from its folder and budget
+        initargs = (cache.cacheDir, cache.budgetBytes) if cache is not None else ()
+        with ProcessPoolExecutor(max_workers=workers, initializer=InitWorker, initargs=initargs) as pool:
+            futures = {pool.submit(WorkerRunJob, job): job for job in pending}
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    result = future.result()
+                except BrokenProcessPool as e:
+                    # gmshがクラッシュするとプール全体が使えなくなる
+                    # 終わっていないジョブは次回の実行でやり直す
+                    print(f"worker pool broken while running {job['id']}: {e}", file=sys.stderr)
+                    return failed + len(pending) - finished
+                AppendCheckpoint(checkpointFile, result)
+                finished += 1
+                if result["status"] != "ok":
+                    failed += 1
+                    print(f"[{finished}/{len(pending)}] {job['id']} failed: {result['error']}", file=sys.stderr)
+                else:
+                    print(f"[{finished}/{len(pending)}] {job['id']} done in {result['elapsed']:.1f} s")
+    return failed
+# ===============================================
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="mesh many STL files listed in a manifest with makemesh_inner.py")
+    parser.add_argument("manifest", help="job list (*.json or *.csv)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--checkpoint", default=None, help="checkpoint file (default: <manifest>.checkpoint.jsonl)")
+    meshoptions.AddMeshOptionArguments(parser)
+    meshcache.AddCacheArguments(parser)
+    meshoutput.AddOutputArguments(parser)
+    args = parser.parse_args()
+
+    checkpointPath = args.checkpoint or os.path.splitext(args.manifest)[0] + ".checkpoint.jsonl"
+    jobs = ReadManifest(args.manifest, meshoptions.MeshOptionsFromArgs(args), meshoutput.OutputOptionsFromArgs(args))
+    failed = RunBatch(jobs, checkpointPath, args.workers, meshcache.MeshCacheFromArgs(args))
+    sys.exit(1 if failed else 0)
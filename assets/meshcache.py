@@ -0,0 +1,154 @@
+# *************************************************************
+# Content-addressed cache of meshing results.
+# The key is the SHA-256 of the input STL bytes, every meshing parameter
+# (meshSize, N, r, h, algorithm options, ...) and the gmsh version.
+# On a hit the stored output files (*.msh, *.vtk, ...) are copied to the
+# requested paths and the meshing is skipped.
+# The least recently used entries are removed when the cache gets larger
+# than the disk budget.
+#
+# layout : <cacheDir>/<key>/meta.json   parameters, record of the run, last access
+#          <cacheDir>/<key>/<name>      stored output files or folders ("msh", "vtk", "arrays", ...)
+# *************************************************************
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import gmsh
+
+# size of the chunks when hashing the input file [byte]
+HASH_CHUNK_SIZE = 1 << 20
+
+
+# ===============================================
+# hash of a file, read in chunks so that large STL files do not fill the memory
+def FileHash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# copy a file or a whole folder
+def CopyPath(source, target):
+    if os.path.isdir(source):
+        shutil.rmtree(target, ignore_errors=True)
+        shutil.copytree(source, target)
+    else:
+        shutil.copyfile(source, target)
+
+
+def DirectorySize(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+# ===============================================
+
+
+# ===============================================
+class MeshCache:
+    def __init__(self, cacheDir, budgetBytes):
+        self.cacheDir = os.path.abspath(cacheDir)
+        self.budgetBytes = budgetBytes
+        os.makedirs(self.cacheDir, exist_ok=True)
+
+    # key of one meshing job
+    # parameters must contain every setting that changes the result
+    def Key(self, inputPath, parameters):
+        description = {
+            "input": FileHash(inputPath),
+            "parameters": parameters,
+            "gmsh": gmsh.__version__,
+        }
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def EntryPath(self, key):
+        return os.path.join(self.cacheDir, key)
+
+    # copy the stored files to outputs ({name: path}) and return the stored record
+    # returns None on a miss
+    def Lookup(self, key, outputs):
+        entry = self.EntryPath(key)
+        metaPath = os.path.join(entry, "meta.json")
+        try:
+            with open(metaPath) as f:
+                meta = json.load(f)
+            if set(outputs) - set(meta["files"]):
+                return None
+            for name, path in outputs.items():
+                CopyPath(os.path.join(entry, name), path)
+        except (OSError, ValueError, KeyError):
+            # the entry may have been evicted by another process meanwhile
+            return None
+        meta["lastAccess"] = time.time()
+        self.WriteMeta(entry, meta)
+        return meta["record"]
+
+    # store the output files of a finished job
+    def Store(self, key, outputs, record):
+        entry = self.EntryPath(key)
+        if os.path.exists(entry):
+            return
+        # build the entry in a temporary folder and rename it at the end,
+        # so that parallel workers never see a half-written entry
+        tempEntry = tempfile.mkdtemp(prefix=".tmp-", dir=self.cacheDir)
+        try:
+            for name, path in outputs.items():
+                CopyPath(path, os.path.join(tempEntry, name))
+            meta = {"files": sorted(outputs), "record": record, "lastAccess": time.time()}
+            self.WriteMeta(tempEntry, meta)
+            os.rename(tempEntry, entry)
+        except OSError:
+            shutil.rmtree(tempEntry, ignore_errors=True)
+            return
+        self.Evict()
+
+    def WriteMeta(self, entry, meta):
+        tempPath = os.path.join(entry, "meta.json.tmp")
+        with open(tempPath, "w") as f:
+            json.dump(meta, f)
+        os.replace(tempPath, os.path.join(entry, "meta.json"))
+
+    # remove the least recently used entries until the cache fits in the budget
+    def Evict(self):
+        entries = []
+        for key in os.listdir(self.cacheDir):
+            entry = self.EntryPath(key)
+            if key.startswith(".tmp-") or not os.path.isdir(entry):
+                continue
+            try:
+                with open(os.path.join(entry, "meta.json")) as f:
+                    lastAccess = json.load(f)["lastAccess"]
+            except (OSError, ValueError, KeyError):
+                lastAccess = 0.0
+            entries.append((lastAccess, DirectorySize(entry), entry))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.budgetBytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+# ===============================================
+
+
+# ===============================================
+# command line
+def AddCacheArguments(parser):
+    group = parser.add_argument_group("mesh cache")
+    group.add_argument("--cache-dir", default=None, help="reuse meshes of identical inputs stored in this folder")
+    group.add_argument("--cache-budget", type=float, default=20.0, help="disk budget of the cache [GB]")
+
+
+def MeshCacheFromArgs(args):
+    if args.cache_dir is None:
+        return None
+    return MeshCache(args.cache_dir, int(args.cache_budget * 1e9))
+# ===============================================
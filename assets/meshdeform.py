@@ -0,0 +1,252 @@
+# *************************************************************
+# Centerline-driven deformation of the prism layer mesh.
+# Python version of Form1.button4_Click / Model.MeshDeformationMultiple
+# of the C# code, with every node handled at once as NumPy arrays.
+# 1. rotation matrix and translation of every centerline node from the
+#    centerline pair (Model.CalculateCenterlineAndCenterlineFinalPositoin)
+# 2. every WALL triangle gets its centerline node from the PLY, the prisms
+#    under it get the same node, and every node collects the nodes of all
+#    its cells (Mesh.AssignFaceCorrespondIndexToNodeCorrespondIndexList)
+# 3. the new position of a node is the mean of the rotated and translated
+#    positions over its list (Model.ExecuteMeshDeformation)
+# 4. with a radius file, every node is moved to the target radius of the
+#    nearest target centerline edge (Model.MeshDeformationRadius)
+# input  : centerline.txt (#pt3d), centerlineFinal.txt (#pt3d, same number of nodes)
+#          test.ply (centerline node of every WALL triangle)
+#          *.msh (MSH 2.2, WALL 10 triangles and INTERNAL 100 prisms, N prisms per triangle;
+#                 SOMETHING 99 caps are rewritten to INLET/OUTLET, see boundary.py)
+#          radius file of the target centerline (optional)
+# output : MeshNeed.msh (WALL triangles, INLET/OUTLET quadrangles and prisms)
+#          MostInnerSurface.stl (inner face of the innermost prisms, input of makemesh_inner.py)
+# the physical groups are kept as in the input and the edge swap of the
+# C# tool after the deformation is not done here
+# the base mesh is analysed once (PrepareDeformation) and any number of
+# target centerlines can be applied to it (DeformTargets, see meshdeformbatch.py)
+#
+# usage  : python meshdeform.py centerline.txt centerlineFinal.txt test.ply MeshOriginal.msh MeshNeed.msh
+#          --inner-stl MostInnerSurface.stl --radius radius.txt
+# *************************************************************
+
+import argparse
+import time
+
+import numpy as np
+from scipy import sparse
+from scipy.spatial import cKDTree
+
+import boundary
+import centerline
+import msh22
+import surfaceio
+
+# physical groups of the prism layer mesh
+WALL = 10
+INLET = 11
+OUTLET = 12
+INTERNAL = 100
+# gmsh element types
+TRIANGLE = 2
+QUADRANGLE = 3
+PRISM = 6
+
+
+# ===============================================
+# rotation matrix (n, 3, 3) that turns every vector a into b (Rodrigues)
+# same special cases as Utility.RotationMatrix: identity for equal vectors,
+# -identity for opposite vectors; vectors that differ only by rounding
+# (cross product exactly 0, same direction) get the identity too
+def RotationMatrices(a, b):
+    axis = np.cross(a, b)
+    length = np.linalg.norm(axis, axis=1)
+    axis = axis / np.where(length > 0.0, length, 1.0)[:, None]
+    cosine = np.einsum("ij,ij->i", a, b) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+    theta = np.arccos(np.clip(cosine, -1.0, 1.0))
+
+    K = np.zeros((len(a), 3, 3))
+    K[:, 0, 1] = -axis[:, 2]
+    K[:, 0, 2] = axis[:, 1]
+    K[:, 1, 0] = axis[:, 2]
+    K[:, 1, 2] = -axis[:, 0]
+    K[:, 2, 0] = -axis[:, 1]
+    K[:, 2, 1] = axis[:, 0]
+    KK = axis[:, :, None] * axis[:, None, :]
+    rotation = (np.cos(theta)[:, None, None] * np.eye(3)
+                + np.sin(theta)[:, None, None] * K
+                + (1.0 - np.cos(theta))[:, None, None] * KK)
+
+    rotation[length == 0.0] = np.where((cosine[length == 0.0] < 0.0)[:, None, None], -np.eye(3), np.eye(3))
+    rotation[np.all(a == b, axis=1)] = np.eye(3)
+    return rotation
+# ===============================================
+
+
+# ===============================================
+# part of the mesh that is deformed (Mesh.MakeNeedPart):
+# prisms, WALL triangles and INLET/OUTLET quadrangles
+def NeedPart(mesh):
+    types = mesh["elementTypes"]
+    physical = mesh["elementPhysical"]
+    need = ((types == PRISM)
+            | ((types == TRIANGLE) & (physical == WALL))
+            | ((types == QUADRANGLE) & ((physical == INLET) | (physical == OUTLET))))
+    return msh22.SubMesh(mesh, need)
+
+
+# (node row, centerline index) for every node of every WALL triangle and prism
+# the prisms are stored as numberOfLayer prisms per WALL triangle, in the order of the triangles
+def NodeCorrespondence(mesh, surfaceCorrespond):
+    _, triangles = msh22.ElementsOfType(mesh, TRIANGLE, WALL)
+    _, prisms = msh22.ElementsOfType(mesh, PRISM, INTERNAL)
+    if len(triangles) == 0:
+        raise ValueError("the mesh has no WALL triangles")
+    if len(surfaceCorrespond) < len(triangles):
+        raise ValueError(f"the PLY has {len(surfaceCorrespond)} faces for {len(triangles)} WALL triangles")
+    numberOfLayer = len(prisms) // len(triangles)
+
+    triangleIndex = surfaceCorrespond[:len(triangles)]
+    prismIndex = np.repeat(triangleIndex, numberOfLayer)[:len(prisms)]
+    nodeRows = np.concatenate([triangles.ravel(), prisms.ravel()])
+    centerlineIndex = np.concatenate([np.repeat(triangleIndex, 3), np.repeat(prismIndex, 6)])
+    return nodeRows, centerlineIndex
+# ===============================================
+
+
+# ===============================================
+# everything that depends only on the base mesh and its centerline,
+# computed once for any number of target centerlines
+# the (node, centerline node) pairs are merged and sorted by the centerline node:
+#   localSum      (u, 3)  sum of the node positions relative to the centerline node
+#   multiplicity  (u,)    number of cells that gave the pair
+#   gather        sparse (nodes, u), sums the pairs of every node and divides by its list length
+def PrepareDeformation(mesh, centerlinePoints, surfaceCorrespond):
+    # MeshOriginal.msh still has the caps as SOMETHING (Model.SetBoundaries)
+    if boundary.HasSomethingTriangles(mesh):
+        mesh = boundary.RewriteInletOutlet(mesh, centerlinePoints[0], centerlinePoints[-1])
+    need = NeedPart(mesh)
+    nodeRows, centerlineIndex = NodeCorrespondence(need, surfaceCorrespond)
+    numNodes = len(need["nodes"])
+    count = np.bincount(nodeRows, minlength=numNodes)
+    if np.any(count == 0):
+        raise ValueError(f"{np.count_nonzero(count == 0)} nodes have no centerline node")
+
+    # an index -1 (no centerline node) adds nothing but is counted, as in ExecuteMeshDeformation
+    valid = centerlineIndex >= 0
+    rows = nodeRows[valid]
+    index = centerlineIndex[valid]
+    pairs, inverse, multiplicity = np.unique(index * numNodes + rows, return_inverse=True, return_counts=True)
+    pairRows = pairs % numNodes
+    pairIndex = pairs // numNodes
+    local = need["nodes"][rows] - centerlinePoints[index]
+    localSum = np.column_stack([np.bincount(inverse, weights=local[:, k], minlength=len(pairs)) for k in range(3)])
+    gather = sparse.csr_matrix((1.0 / count[pairRows], (pairRows, np.arange(len(pairs)))), shape=(numNodes, len(pairs)))
+
+    return {
+        "mesh": need,
+        "centerline": centerlinePoints,
+        "tangent": centerline.MovingAverage7(centerline.TangentVectors(centerlinePoints)),
+        "pairBounds": np.searchsorted(pairIndex, np.arange(len(centerlinePoints) + 1)),
+        "localSum": localSum,
+        "multiplicity": multiplicity.astype(np.float64),
+        "gather": gather,
+    }
+
+
+# node positions for a stack of target centerlines (targets, centerline nodes, 3)
+# returns (targets, nodes, 3)
+# the targets are processed chunkSize at a time to bound the memory
+def DeformTargets(base, targets, chunkSize=32):
+    targets = np.asarray(targets, dtype=np.float64)
+    if targets.shape[1:] != base["centerline"].shape:
+        raise ValueError(f"the target centerlines have {targets.shape[1]} nodes, the base centerline {len(base['centerline'])}")
+    numTargets = len(targets)
+    numPairs = len(base["localSum"])
+    result = np.empty((numTargets, base["gather"].shape[0], 3))
+    for first in range(0, numTargets, chunkSize):
+        chunk = targets[first:first + chunkSize]
+        tangentFinal = np.stack([centerline.MovingAverage7(centerline.TangentVectors(points)) for points in chunk])
+        tangent = np.broadcast_to(base["tangent"], tangentFinal.shape)
+        rotation = RotationMatrices(tangent.reshape(-1, 3), tangentFinal.reshape(-1, 3)).reshape(len(chunk), -1, 3, 3)
+
+        # rotated and translated sum of every pair:
+        # R (x - c) + c + (c' - c) summed over the cells = R localSum + multiplicity c'
+        moved = np.empty((len(chunk), numPairs, 3))
+        bounds = base["pairBounds"]
+        for c in range(len(bounds) - 1):
+            pairs = slice(bounds[c], bounds[c + 1])
+            moved[:, pairs] = (np.einsum("tij,uj->tui", rotation[:, c], base["localSum"][pairs])
+                               + base["multiplicity"][pairs, None] * chunk[:, c, None, :])
+
+        gathered = base["gather"] @ moved.transpose(1, 0, 2).reshape(numPairs, -1)
+        result[first:first + len(chunk)] = gathered.reshape(-1, len(chunk), 3).transpose(1, 0, 2)
+    return result
+
+
+# move every node to the radius of the nearest target centerline edge
+# radius : one value per edge of the target centerline (radius file)
+def DeformRadius(points, centerlineFinalPoints, radius):
+    _, index = cKDTree(centerlineFinalPoints).query(points)
+    projection, vector, _ = centerline.EdgeProjection(points, centerlineFinalPoints, index)
+    # the last node has no edge of its own
+    r = radius[np.minimum(index, len(centerlineFinalPoints) - 2)]
+    length = np.linalg.norm(vector, axis=1)
+    return projection + (r / length)[:, None] * vector
+
+
+# deformed copy of the need part of the mesh
+# radius None (or all zero) skips the radius step, as without radius.txt in the C# tool
+def DeformMesh(mesh, centerlinePoints, centerlineFinalPoints, surfaceCorrespond, radius=None):
+    base = PrepareDeformation(mesh, centerlinePoints, surfaceCorrespond)
+    return DeformedMesh(base, DeformTargets(base, centerlineFinalPoints[None])[0], centerlineFinalPoints, radius)
+
+
+# copy of the base mesh with the deformed node positions
+def DeformedMesh(base, points, centerlineFinalPoints, radius=None):
+    if radius is not None and np.any(radius != 0):
+        points = DeformRadius(points, centerlineFinalPoints, radius)
+    return dict(base["mesh"], nodes=points)
+# ===============================================
+
+
+# ===============================================
+# node rows of the inner face (nodes 4, 5, 3) of the innermost prism of every WALL triangle
+def InnerSurfaceRows(mesh):
+    _, triangles = msh22.ElementsOfType(mesh, TRIANGLE, WALL)
+    _, prisms = msh22.ElementsOfType(mesh, PRISM, INTERNAL)
+    numberOfLayer = len(prisms) // len(triangles)
+    innermost = prisms[numberOfLayer - 1::numberOfLayer]
+    return innermost[:, [4, 5, 3]]
+
+
+# triangle soup of the inner face (IO.WriteSTLInnerSurfaceFromCellsMostInnerPrism)
+def InnerSurface(mesh):
+    return mesh["nodes"][InnerSurfaceRows(mesh)]
+# ===============================================
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="deform the prism layer mesh from the centerline pair")
+    parser.add_argument("centerline", help="centerline of the mesh (#pt3d)")
+    parser.add_argument("centerlineFinal", help="target centerline (#pt3d)")
+    parser.add_argument("ply", help="centerline node of every WALL triangle (test.ply)")
+    parser.add_argument("mesh", help="input mesh (MSH 2.2)")
+    parser.add_argument("output", help="deformed mesh (MSH 2.2), e.g. MeshNeed.msh")
+    parser.add_argument("--radius", default=None, help="radius of every target centerline edge")
+    parser.add_argument("--binary", action="store_true", help="write binary MSH 2.2")
+    parser.add_argument("--inner-stl", default=None, help="also write the innermost prism surface, e.g. MostInnerSurface.stl")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    mesh = msh22.ReadMsh22(args.mesh)
+    _, _, surfaceCorrespond = centerline.ReadCorrespondPly(args.ply)
+    radius = centerline.ReadRadius(args.radius) if args.radius else None
+    read = time.perf_counter()
+
+    deformed = DeformMesh(mesh, centerline.ReadCenterline(args.centerline),
+                          centerline.ReadCenterline(args.centerlineFinal), surfaceCorrespond, radius)
+    deform = time.perf_counter()
+
+    msh22.WriteMsh22(args.output, deformed, args.binary)
+    if args.inner_stl:
+        surfaceio.WriteStlAscii(args.inner_stl, InnerSurface(deformed))
+    print(f"{len(deformed['nodes'])} nodes: read {read - start:.2f} s, deform {deform - read:.3f} s, "
+          f"write {time.perf_counter() - deform:.2f} s")
@@ -0,0 +1,119 @@
+# *************************************************************
+# One base mesh, many target centerlines.
+# The base mesh and its centerline correspondence are read and analysed
+# once (meshdeform.PrepareDeformation), all targets are deformed together
+# as one (targets, nodes, 3) array computation, and one MeshNeed.msh and
+# MostInnerSurface.stl is written per target. With --mesh-inner the inner
+# tetra meshes of all targets are made in a pool of gmsh workers
+# (meshbatch.py). The job id of a target is its folder name and a hash of
+# the base input, the target, its radius and the options, so a target that
+# changed is meshed again instead of being skipped by the checkpoint.
+# input  : centerline.txt, test.ply, base mesh (MSH 2.2)
+#          target centerlines (#pt3d, same number of nodes as centerline.txt)
+#          radius files of the targets (optional, same order as the targets)
+# output : <output-dir>/<target name>/MeshNeed.msh, MostInnerSurface.stl
+#          (and MeshInner.msh, MeshInner.vtk with --mesh-inner)
+#
+# usage  : python meshdeformbatch.py centerline.txt test.ply MeshOriginal.msh targets/*.txt
+#          --output-dir cases --mesh-inner --workers 8
+# *************************************************************
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+import centerline
+import meshbatch
+import meshcache
+import meshdeform
+import meshoptions
+import meshoutput
+import msh22
+import surfaceio
+
+
+# ===============================================
+# folder of every target, named after its centerline file
+def TargetFolders(targetPaths, outputDir):
+    names = [os.path.splitext(os.path.basename(path))[0] for path in targetPaths]
+    if len(set(names)) != len(names):
+        raise ValueError("the target centerline files must have different names")
+    return [os.path.join(outputDir, name) for name in names]
+
+
+# folder name + hash of the files and options a target's inner mesh depends on
+def JobId(folder, paths, options):
+    description = {"files": [meshcache.FileHash(path) if path else None for path in paths], "options": options}
+    digest = hashlib.sha256(json.dumps(description, sort_keys=True).encode("utf-8")).hexdigest()
+    return f"{os.path.basename(folder)}_{digest[:12]}"
+
+
+# deform the base mesh for every target and write the results
+# returns the inner meshing jobs (see meshbatch.py)
+def DeformAll(base, targetPaths, folders, radiusPaths=None, chunkSize=32):
+    targets = np.stack([centerline.ReadCenterline(path) for path in targetPaths])
+    start = time.perf_counter()
+    points = meshdeform.DeformTargets(base, targets, chunkSize)
+    print(f"{len(targets)} targets x {points.shape[1]} nodes deformed in {time.perf_counter() - start:.2f} s")
+
+    jobs = []
+    for i, folder in enumerate(folders):
+        radius = centerline.ReadRadius(radiusPaths[i]) if radiusPaths else None
+        mesh = meshdeform.DeformedMesh(base, points[i], targets[i], radius)
+        os.makedirs(folder, exist_ok=True)
+        msh22.WriteMsh22(os.path.join(folder, "MeshNeed.msh"), mesh)
+        stl = os.path.join(folder, "MostInnerSurface.stl")
+        surfaceio.WriteStlAscii(stl, meshdeform.InnerSurface(mesh))
+        jobs.append({
+            "id": os.path.basename(folder),
+            "stl": os.path.abspath(stl),
+            "msh": os.path.abspath(os.path.join(folder, "MeshInner.msh")),
+            "vtk": os.path.abspath(os.path.join(folder, "MeshInner.vtk")),
+        })
+    return jobs
+# ===============================================
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="deform one base mesh toward many target centerlines")
+    parser.add_argument("centerline", help="centerline of the base mesh (#pt3d)")
+    parser.add_argument("ply", help="centerline node of every WALL triangle (test.ply)")
+    parser.add_argument("mesh", help="base mesh (MSH 2.2)")
+    parser.add_argument("targets", nargs="+", help="target centerlines (#pt3d)")
+    parser.add_argument("--radius", nargs="+", default=None, help="radius file of every target, in the order of the targets")
+    parser.add_argument("--output-dir", default=".", help="one folder per target is made here")
+    parser.add_argument("--chunk-size", type=int, default=32, help="targets deformed together (memory)")
+    parser.add_argument("--mesh-inner", action="store_true", help="also make MeshInner.msh of every target")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of gmsh worker processes")
+    meshoptions.AddMeshOptionArguments(parser)
+    meshcache.AddCacheArguments(parser)
+    meshoutput.AddOutputArguments(parser)
+    args = parser.parse_args()
+    if args.radius is not None and len(args.radius) != len(args.targets):
+        parser.error(f"{len(args.radius)} radius files for {len(args.targets)} targets")
+
+    start = time.perf_counter()
+    _, _, surfaceCorrespond = centerline.ReadCorrespondPly(args.ply)
+    base = meshdeform.PrepareDeformation(msh22.ReadMsh22(args.mesh), centerline.ReadCenterline(args.centerline), surfaceCorrespond)
+    print(f"base mesh analysed in {time.perf_counter() - start:.2f} s")
+
+    folders = TargetFolders(args.targets, args.output_dir)
+    jobs = DeformAll(base, args.targets, folders, args.radius, args.chunk_size)
+    if not args.mesh_inner:
+        sys.exit(0)
+
+    options = meshoptions.MeshOptionsFromArgs(args)
+    outputs = meshoutput.OutputOptionsFromArgs(args)
+    for i, (job, folder) in enumerate(zip(jobs, folders)):
+        job["meshOptions"] = dict(options)
+        job["outputOptions"] = dict(outputs)
+        paths = [args.centerline, args.ply, args.mesh, args.targets[i], args.radius[i] if args.radius else None]
+        job["id"] = JobId(folder, paths, {"meshOptions": options, "outputOptions": outputs})
+    checkpointPath = os.path.join(args.output_dir, "inner.checkpoint.jsonl")
+    failed = meshbatch.RunBatch(jobs, checkpointPath, args.workers, meshcache.MeshCacheFromArgs(args))
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,129 @@
+# *************************************************************
+# Export of the gmsh mesh as flat typed arrays, so that the merge step
+# and other consumers can map the mesh directly instead of parsing the
+# text of the *.msh file.
+#
+# layout "npz" : one uncompressed <name>.npz
+# layout "raw" : folder <name>.arrays/ with one <array>.npy per array and
+#                layout.json; every file can be opened with
+#                np.load(path, mmap_mode="r") without reading it
+#
+# arrays (n: nodes, the element kind is tetrahedra, prisms, triangles, ...):
+#   nodeTags            (n,)    uint64   gmsh node tags
+#   nodes               (n, 3)  float64  coordinates, row i belongs to nodeTags[i]
+#   <kind>              (m, k)  int64    connectivity as 0-based rows of nodes
+#   <kind>Tags          (m,)    uint64   gmsh element tags
+#   <kind>Physical      (m,)    int32    physical group tag of each element
+#   physicalDims        (p,)    int32    \
+#   physicalTags        (p,)    int32     } physical groups, e.g. (3, 100, "INTERNAL")
+#   physicalNames       (p,)    str      /
+# only the elements of physical groups are exported (same as the *.msh file)
+# *************************************************************
+
+import json
+import os
+
+import numpy as np
+
+# gmsh element type -> name of the arrays
+ELEMENT_KINDS = {
+    1: "lines",
+    2: "triangles",
+    3: "quadrangles",
+    4: "tetrahedra",
+    5: "hexahedra",
+    6: "prisms",
+    7: "pyramids",
+}
+
+
+# ===============================================
+# collect the arrays of the current gmsh model
+def MeshArrays():
+    import gmsh
+    nodeTags, coordinates, _ = gmsh.model.mesh.getNodes()
+    nodeTags = nodeTags.astype(np.uint64)
+    index = np.zeros(int(nodeTags.max()) + 1 if len(nodeTags) else 1, dtype=np.int64)
+    index[nodeTags.astype(np.int64)] = np.arange(len(nodeTags))
+    arrays = {
+        "nodeTags": nodeTags,
+        "nodes": coordinates.reshape(-1, 3).astype(np.float64),
+    }
+
+    blocks = {}
+    physicalDims = []
+    physicalTags = []
+    physicalNames = []
+    for dim, physicalTag in gmsh.model.getPhysicalGroups():
+        physicalDims.append(dim)
+        physicalTags.append(physicalTag)
+        physicalNames.append(gmsh.model.getPhysicalName(dim, physicalTag))
+        for entity in gmsh.model.getEntitiesForPhysicalGroup(dim, physicalTag):
+            elementTypes, elementTags, elementNodeTags = gmsh.model.mesh.getElements(dim, entity)
+            for elementType, tags, nodes in zip(elementTypes, elementTags, elementNodeTags):
+                if elementType not in ELEMENT_KINDS:
+                    continue
+                numNodes = gmsh.model.mesh.getElementProperties(elementType)[3]
+                kind = ELEMENT_KINDS[elementType]
+                blocks.setdefault(kind, []).append((
+                    index[nodes.astype(np.int64)].reshape(-1, numNodes),
+                    tags.astype(np.uint64),
+                    np.full(len(tags), physicalTag, dtype=np.int32),
+                ))
+
+    for kind, parts in blocks.items():
+        connectivity = np.concatenate([p[0] for p in parts])
+        tags = np.concatenate([p[1] for p in parts])
+        physical = np.concatenate([p[2] for p in parts])
+        # an element in several physical groups is exported once, with its first group
+        _, first = np.unique(tags, return_index=True)
+        first.sort()
+        arrays[kind] = connectivity[first]
+        arrays[kind + "Tags"] = tags[first]
+        arrays[kind + "Physical"] = physical[first]
+
+    arrays["physicalDims"] = np.array(physicalDims, dtype=np.int32)
+    arrays["physicalTags"] = np.array(physicalTags, dtype=np.int32)
+    arrays["physicalNames"] = np.array(physicalNames, dtype=str)
+    return arrays
+# ===============================================
+
+
+# ===============================================
+# path of the export for a given *.msh path
+def ArraysPath(mshPath, layout):
+    base = os.path.splitext(mshPath)[0]
+    return base + (".npz" if layout == "npz" else ".arrays")
+
+
+def WriteMeshArrays(path, arrays, layout):
+    if layout == "npz":
+        # not compressed, so that np.load does not have to inflate anything
+        np.savez(path, **arrays)
+        return path
+    os.makedirs(path, exist_ok=True)
+    description = {}
+    for name, array in arrays.items():
+        np.save(os.path.join(path, name + ".npy"), np.ascontiguousarray(array))
+        description[name] = {"dtype": array.dtype.str, "shape": list(array.shape)}
+    with open(os.path.join(path, "layout.json"), "w") as f:
+        json.dump(description, f, indent=2)
+    return path
+
+
+def ExportMeshArrays(mshPath, layout):
+    path = ArraysPath(mshPath, layout)
+    return WriteMeshArrays(path, MeshArrays(), layout)
+# ===============================================
+
+
+# ===============================================
+# read an export, the raw layout is memory-mapped
+def ReadMeshArrays(path):
+    if os.path.isdir(path):
+        with open(os.path.join(path, "layout.json")) as f:
+            names = json.load(f)
+        return {name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r") for name in names}
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files}
+# ===============================================
@@ -0,0 +1,235 @@
+# *************************************************************
+# Merge of the deformed prism layer mesh and the inner tetra mesh.
+# Python version of Model.MakeMergeMesh (button 4 of the C# tool).
+# 1. the caps of the inner mesh (SOMETHING 99) are rewritten to INLET/OUTLET
+#    (Model.OrganizeMeshDataInner, see boundary.py)
+# 2. the INNERWALL nodes of the inner mesh are welded to the inner face nodes
+#    of the innermost prisms with one KD-tree query (Algorithm.KDTree)
+# 3. the other inner nodes are appended, the tetra and cap connectivity is
+#    remapped with one array lookup
+# 4. the cells are sorted by (cell type, physical group, entity) and all
+#    nodes and cells are numbered 1, 2, 3, ... again (IO.WriteGMSH22)
+# the merge stops with an error if the two interfaces do not match
+# input  : MeshNeed.msh (WALL 10, INLET 11 / OUTLET 12 quadrangles, prisms)
+#          MeshInner.msh (INNERWALL 90, SOMETHING 99 caps, INTERNAL 100 tetra)
+#          centerlineFinal.txt (optional, the inlet/outlet are taken from the
+#          INLET/OUTLET quadrangles of MeshNeed.msh otherwise)
+# output : MeshMerged.msh, weld statistics (stdout, --report as JSON)
+#
+# usage  : python meshmerge.py MeshNeed.msh MeshInner.msh MeshMerged.msh --centerline centerlineFinal.txt
+# *************************************************************
+
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+import boundary
+import centerline
+import msh22
+
+# physical groups
+WALL = 10
+INLET = 11
+OUTLET = 12
+INNERWALL = 90
+SOMETHING = 99
+INTERNAL = 100
+# gmsh element types
+TRIANGLE = 2
+QUADRANGLE = 3
+TETRA = 4
+PRISM = 6
+# entities given to the merged cells, as in MakeMergeMesh
+PRISM_ENTITY = 1000
+INLET_ENTITY = 180
+OUTLET_ENTITY = 190
+TETRA_ENTITY = 190
+# default weld distance; MostInnerSurface.stl keeps 7 significant digits
+DEFAULT_TOLERANCE = 1e-4
+
+
+# the prism layer and the inner mesh do not meet node to node
+# (a ValueError, so callers that catch ValueError still see it)
+class InterfaceMismatch(ValueError):
+    pass
+
+
+# ===============================================
+# center of the INLET and OUTLET quadrangles of the prism layer mesh
+def InletOutletLocations(need):
+    locations = []
+    for tag in (INLET, OUTLET):
+        _, quads = msh22.ElementsOfType(need, QUADRANGLE, tag)
+        if len(quads) == 0:
+            raise ValueError(f"the prism layer mesh has no physical {tag} quadrangles, give --centerline")
+        locations.append(need["nodes"][quads].reshape(-1, 3).mean(axis=0))
+    return locations
+
+
+# node rows of the inner face of the innermost prisms (Model.MakeMergeMesh)
+def PrismInterfaceNodes(need):
+    _, triangles = msh22.ElementsOfType(need, TRIANGLE, WALL)
+    _, prisms = msh22.ElementsOfType(need, PRISM, INTERNAL)
+    if len(triangles) == 0 or len(prisms) % len(triangles) != 0:
+        raise ValueError(f"{len(prisms)} prisms for {len(triangles)} WALL triangles")
+    numberOfLayer = len(prisms) // len(triangles)
+    innermost = prisms[numberOfLayer - 1::numberOfLayer]
+    return np.unique(innermost[:, 3:6]), len(innermost)
+# ===============================================
+
+
+# ===============================================
+# inner node row -> need node row for every INNERWALL node
+# raises InterfaceMismatch if the interfaces do not match one to one within the tolerance
+def WeldInterface(need, inner, tolerance):
+    needNodes, numberOfInnermost = PrismInterfaceNodes(need)
+    _, innerWall = msh22.ElementsOfType(inner, TRIANGLE, INNERWALL)
+    if numberOfInnermost != len(innerWall):
+        raise InterfaceMismatch(f"{numberOfInnermost} innermost prisms but {len(innerWall)} INNERWALL triangles")
+    innerNodes = np.unique(innerWall)
+    if len(innerNodes) != len(needNodes):
+        raise InterfaceMismatch(f"{len(needNodes)} interface nodes in the prism layer but {len(innerNodes)} INNERWALL nodes")
+
+    distance, index = cKDTree(need["nodes"][needNodes]).query(
+        inner["nodes"][innerNodes], distance_upper_bound=tolerance)
+    unmatched = ~np.isfinite(distance)
+    if np.any(unmatched):
+        worst, _ = cKDTree(need["nodes"][needNodes]).query(inner["nodes"][innerNodes[unmatched]])
+        raise InterfaceMismatch(f"{np.count_nonzero(unmatched)} INNERWALL nodes have no prism node within {tolerance:g} "
+                         f"(largest distance {worst.max():.3g})")
+    if len(np.unique(index)) != len(index):
+        raise InterfaceMismatch(f"{len(index) - len(np.unique(index))} prism nodes are welded to more than one INNERWALL node, "
+                         f"use a smaller tolerance")
+
+    statistics = {
+        "interfaceNodes": int(len(innerNodes)),
+        "maxDistance": float(distance.max()),
+        "meanDistance": float(distance.mean()),
+    }
+    return innerNodes, needNodes[index], statistics
+# ===============================================
+
+
+# ===============================================
+# physical names of the prism layer mesh without SOMETHING (Mesh.RemoveSOMETHINGPhysicalInfo)
+def PhysicalNames(need):
+    names = [entry for entry in need["physicalNames"] if entry[1] not in (SOMETHING, INLET, OUTLET)]
+    names += [(2, INLET, "INLET"), (2, OUTLET, "OUTLET")]
+    return sorted(names)
+
+
+# connectivity (node rows) and tags of the selected elements
+def ElementBlock(mesh, elementType, physical, entity=None):
+    rows, connectivity = msh22.ElementsOfType(mesh, elementType, physical)
+    entities = mesh["elementEntity"][rows] if entity is None else np.full(len(rows), entity)
+    return elementType, physical, entities, connectivity
+
+
+def MergeMesh(need, inner, inletLocation, outletLocation, tolerance=DEFAULT_TOLERANCE):
+    if boundary.HasSomethingTriangles(inner):
+        inner = boundary.RewriteInletOutlet(inner, inletLocation, outletLocation)
+    innerNodes, needRows, statistics = WeldInterface(need, inner, tolerance)
+    merged, joinStatistics = JoinMesh(need, inner, innerNodes, needRows)
+    statistics.update(joinStatistics)
+    return merged, statistics
+
+
+# merged mesh from the interface node pairs (inner node rows -> need node rows)
+# the inner mesh must have its caps as INLET/OUTLET already
+def JoinMesh(need, inner, innerNodes, needRows):
+    # the cells are renumbered and the inner mesh is not partitioned, so the partition tags cannot be kept
+    if "elementExtraTags" in need or "elementExtraTags" in inner:
+        print("warning: the partition tags of the input meshes are not kept in the merged mesh, partition it again",
+              file=sys.stderr)
+    # node rows of the merged mesh: prism layer nodes, then the inner nodes that are not welded
+    numNeed = len(need["nodes"])
+    nodeMap = np.full(len(inner["nodes"]), -1, dtype=np.int64)
+    nodeMap[innerNodes] = needRows
+    added = nodeMap < 0
+    nodeMap[added] = numNeed + np.arange(np.count_nonzero(added))
+    nodes = np.concatenate([need["nodes"], inner["nodes"][added]])
+
+    # the prism layer cells as they are (prisms in one entity), the inner caps and tetra
+    needIndex = msh22.NodeIndex(need)
+    needEntity = np.where(need["elementTypes"] == PRISM, PRISM_ENTITY, need["elementEntity"])
+    blocks = [
+        ElementBlock(inner, TRIANGLE, INLET, INLET_ENTITY),
+        ElementBlock(inner, TRIANGLE, OUTLET, OUTLET_ENTITY),
+        ElementBlock(inner, TETRA, INTERNAL, TETRA_ENTITY),
+    ]
+    types = np.concatenate([need["elementTypes"]] + [np.full(len(b[3]), b[0]) for b in blocks]).astype(np.int32)
+    physical = np.concatenate([need["elementPhysical"]] + [np.full(len(b[3]), b[1]) for b in blocks]).astype(np.int32)
+    entity = np.concatenate([needEntity] + [b[2] for b in blocks]).astype(np.int32)
+    counts = np.concatenate([np.diff(need["elementOffsets"])] + [np.full(len(b[3]), b[3].shape[1]) for b in blocks])
+    elementNodes = np.concatenate([needIndex[need["elementNodes"]]] + [nodeMap[b[3]].ravel() for b in blocks])
+
+    # stable sort by (cell type, physical group, entity), as Cells.Sort() in MakeMergeMesh
+    order = np.lexsort((entity, physical, types))
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    newCounts = counts[order]
+    newOffsets = np.concatenate([[0], np.cumsum(newCounts)])
+    columns = np.repeat(offsets[order] - newOffsets[:-1], newCounts) + np.arange(newOffsets[-1])
+
+    merged = {
+        "physicalNames": PhysicalNames(need),
+        "nodeTags": np.arange(1, len(nodes) + 1, dtype=np.int64),
+        "nodes": nodes,
+        "elementTags": np.arange(1, len(order) + 1, dtype=np.int64),
+        "elementTypes": types[order],
+        "elementPhysical": physical[order],
+        "elementEntity": entity[order],
+        "elementOffsets": newOffsets.astype(np.int64),
+        "elementNodes": elementNodes[columns] + 1,
+    }
+    statistics = {
+        "addedNodes": int(np.count_nonzero(added)),
+        "nodes": int(len(nodes)),
+        "elements": int(len(order)),
+        "inletTriangles": int(len(blocks[0][3])),
+        "outletTriangles": int(len(blocks[1][3])),
+        "tetrahedra": int(len(blocks[2][3])),
+    }
+    return merged, statistics
+# ===============================================
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="merge the prism layer mesh and the inner tetra mesh")
+    parser.add_argument("need", help="prism layer mesh (MSH 2.2), e.g. MeshNeed.msh")
+    parser.add_argument("inner", help="inner tetra mesh (MSH 2.2), e.g. MeshInner.msh")
+    parser.add_argument("output", help="merged mesh (MSH 2.2), e.g. MeshMerged.msh")
+    parser.add_argument("--centerline", default=None, help="target centerline (#pt3d); inlet = first node, outlet = last node")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="largest distance of two welded nodes")
+    parser.add_argument("--binary", action="store_true", help="write binary MSH 2.2")
+    parser.add_argument("--report", default=None, help="also write the weld statistics as JSON")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    need = msh22.ReadMsh22(args.need)
+    inner = msh22.ReadMsh22(args.inner)
+    read = time.perf_counter()
+
+    if args.centerline:
+        points = centerline.ReadCenterline(args.centerline)
+        inletLocation, outletLocation = points[0], points[-1]
+    else:
+        inletLocation, outletLocation = InletOutletLocations(need)
+    try:
+        merged, statistics = MergeMesh(need, inner, inletLocation, outletLocation, args.tolerance)
+    except InterfaceMismatch as e:
+        sys.exit(f"interface mismatch: {e}")
+    merge = time.perf_counter()
+
+    msh22.WriteMsh22(args.output, merged, args.binary)
+    statistics["seconds"] = {"read": read - start, "merge": merge - read, "write": time.perf_counter() - merge}
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(statistics, f, indent=2)
+    print(f"{statistics['interfaceNodes']} interface nodes welded "
+          f"(max {statistics['maxDistance']:.3g}, mean {statistics['meanDistance']:.3g}), "
+          f"{statistics['addedNodes']} nodes added: {statistics['nodes']} nodes, {statistics['elements']} elements")
+    print(f"read {read - start:.2f} s, merge {merge - read:.3f} s, write {statistics['seconds']['write']:.2f} s")
@@ -0,0 +1,125 @@
+# *************************************************************
+# Meshing algorithm / thread settings shared by makemesh.py and
+# makemesh_inner.py.
+# The defaults reproduce the former hard-coded settings
+# (Mesh.Algorithm 1, default Mesh.Algorithm3D, 1 thread).
+# The options can be given as command line flags or as a JSON file
+#   {"algorithm": "meshadapt", "algorithm3d": "hxt", "threads": 0}
+# threads = 0 means all cores of the machine.
+# *************************************************************
+
+import json
+import os
+
+import gmsh
+
+# name -> gmsh number
+# Mesh.Algorithm (2D)
+ALGORITHMS_2D = {
+    "meshadapt": 1,
+    "automatic": 2,
+    "delaunay": 5,
+    "frontal": 6,
+    "bamg": 7,
+    "frontalquad": 8,
+    "packing": 9,
+    "quasistructured": 11,
+}
+# Mesh.Algorithm3D
+ALGORITHMS_3D = {
+    "delaunay": 1,
+    "frontal": 4,
+    "mmg3d": 7,
+    "rtree": 9,
+    "hxt": 10,
+}
+
+DEFAULT_MESH_OPTIONS = {
+    "algorithm": 1,
+    "algorithm3d": 1,
+    "threads": 1,
+    # 0: same as threads
+    "threads3d": 0,
+}
+
+
+# ===============================================
+# "hxt" / "10" / 10 -> 10
+def AlgorithmNumber(value, table):
+    if isinstance(value, str) and value.lower() in table:
+        return table[value.lower()]
+    number = int(value)
+    if number not in table.values():
+        raise ValueError(f"unknown meshing algorithm {value!r}, choose from {sorted(table)}")
+    return number
+
+
+def AlgorithmName(number, table):
+    for name, n in table.items():
+        if n == number:
+            return name
+    return str(number)
+# ===============================================
+
+
+# ===============================================
+# command line
+def AddMeshOptionArguments(parser):
+    group = parser.add_argument_group("meshing algorithm")
+    group.add_argument("--mesh-config", default=None, help="JSON file with meshing options (flags override it)")
+    group.add_argument("--algorithm", default=None, help=f"2D algorithm {sorted(ALGORITHMS_2D)} or gmsh number")
+    group.add_argument("--algorithm3d", default=None, help=f"3D algorithm {sorted(ALGORITHMS_3D)} or gmsh number")
+    group.add_argument("--threads", type=int, default=None, help="General.NumThreads (0: all cores)")
+    group.add_argument("--threads3d", type=int, default=None, help="Mesh.MaxNumThreads3D (0: same as --threads)")
+
+
+def MeshOptionsFromArgs(args):
+    options = dict(DEFAULT_MESH_OPTIONS)
+    if args.mesh_config:
+        with open(args.mesh_config) as f:
+            options.update(json.load(f))
+    for key in DEFAULT_MESH_OPTIONS:
+        value = getattr(args, key)
+        if value is not None:
+            options[key] = value
+    return ResolveMeshOptions(options)
+
+
+# check the values and turn names into gmsh numbers
+def ResolveMeshOptions(options):
+    resolved = dict(DEFAULT_MESH_OPTIONS)
+    resolved.update(options or {})
+    unknown = set(resolved) - set(DEFAULT_MESH_OPTIONS)
+    if unknown:
+        raise ValueError(f"unknown meshing options {sorted(unknown)}")
+    resolved["algorithm"] = AlgorithmNumber(resolved["algorithm"], ALGORITHMS_2D)
+    resolved["algorithm3d"] = AlgorithmNumber(resolved["algorithm3d"], ALGORITHMS_3D)
+    resolved["threads"] = int(resolved["threads"]) or os.cpu_count()
+    resolved["threads3d"] = int(resolved["threads3d"]) or resolved["threads"]
+    return resolved
+# ===============================================
+
+
+# ===============================================
+# set the options in gmsh and return the configuration actually used
+def ApplyMeshOptions(options):
+    options = ResolveMeshOptions(options)
+    gmsh.option.setNumber("Mesh.Algorithm", options["algorithm"])
+    gmsh.option.setNumber("Mesh.Algorithm3D", options["algorithm3d"])
+    gmsh.option.setNumber("General.NumThreads", options["threads"])
+    gmsh.option.setNumber("Mesh.MaxNumThreads3D", options["threads3d"])
+    return DescribeMeshOptions()
+
+
+# read back from gmsh so that the report shows what gmsh really uses
+def DescribeMeshOptions():
+    algorithm = int(gmsh.option.getNumber("Mesh.Algorithm"))
+    algorithm3d = int(gmsh.option.getNumber("Mesh.Algorithm3D"))
+    return {
+        "algorithm": AlgorithmName(algorithm, ALGORITHMS_2D),
+        "algorithm3d": AlgorithmName(algorithm3d, ALGORITHMS_3D),
+        "threads": int(gmsh.option.getNumber("General.NumThreads")),
+        "threads3d": int(gmsh.option.getNumber("Mesh.MaxNumThreads3D")),
+        "gmsh": gmsh.__version__,
+    }
+# ===============================================
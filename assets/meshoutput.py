@@ -0,0 +1,255 @@
+# *************************************************************
+# Output settings of the meshing scripts.
+#   msh      : "ascii" | "binary"  MSH 2.2, both can be read by OpenFOAM's gmshToFoam
+#   vtk      : "ascii" | "binary"  legacy VTK written by gmsh
+#              "vtu"               XML UnstructuredGrid, zlib-compressed (written here)
+#              "none"              no viewer file at all
+#   compress : "none" | "gzip" | "zstd"  compress the written files (*.gz / *.zst)
+#              zstd needs the zstandard package
+#   arrays   : "none" | "npz" | "raw"  also export the mesh as typed arrays
+#              (<name>.npz or memory-mappable <name>.arrays/, see meshexport.py)
+#              the arrays are never compressed
+#   foam     : "none" | "binary"  also write an OpenFOAM case <name>_openfoam/
+#              with constant/polyMesh in binary format (see foamexport.py),
+#              gmshToFoam is not needed then
+#   partitions / partitioner / partitionFiles : split the mesh into K parts
+#              for parallel runs (see meshpartition.py), 0 = one mesh
+# The defaults reproduce the former output (ASCII MSH 2.2 + ASCII VTK).
+# *************************************************************
+
+import base64
+import gzip
+import os
+import shutil
+import zlib
+
+import numpy as np
+
+import gmsh
+
+import foamexport
+import meshexport
+import meshpartition
+
+DEFAULT_OUTPUT_OPTIONS = {
+    "msh": "ascii",
+    "vtk": "ascii",
+    "compress": "none",
+    "arrays": "none",
+    "foam": "none",
+    "partitions": 0,
+    "partitioner": "metis",
+    "partitionFiles": "map",
+}
+CHOICES = {
+    "msh": ("ascii", "binary"),
+    "vtk": ("ascii", "binary", "vtu", "none"),
+    "compress": ("none", "gzip", "zstd"),
+    "arrays": ("none", "npz", "raw"),
+    "foam": ("none", "binary"),
+    "partitioner": ("metis", "simple"),
+    "partitionFiles": ("map", "split"),
+}
+COMPRESSED_EXTENSIONS = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+
+# gmsh element type -> VTK cell type
+VTK_CELL_TYPES = {
+    1: 3,    # line
+    2: 5,    # triangle
+    3: 9,    # quadrangle
+    4: 10,   # tetrahedron
+    5: 12,   # hexahedron
+    6: 13,   # prism (wedge)
+    7: 14,   # pyramid
+    15: 1,   # point
+}
+
+
+# ===============================================
+# command line
+def AddOutputArguments(parser):
+    group = parser.add_argument_group("output")
+    group.add_argument("--msh-format", choices=CHOICES["msh"], default=None, help="MSH 2.2 ascii or binary")
+    group.add_argument("--vtk-format", choices=CHOICES["vtk"], default=None, help="viewer file format, none to skip it")
+    group.add_argument("--compress", choices=CHOICES["compress"], default=None, help="compress the written files")
+    group.add_argument("--arrays", choices=CHOICES["arrays"], default=None, help="also export the mesh as NumPy arrays")
+    group.add_argument("--foam", choices=CHOICES["foam"], default=None, help="also write the OpenFOAM polyMesh")
+    group.add_argument("--partitions", type=int, default=None, help="split the mesh into this many parts (0 = no partition)")
+    group.add_argument("--partitioner", choices=CHOICES["partitioner"], default=None)
+    group.add_argument("--partition-files", choices=CHOICES["partitionFiles"], default=None,
+                       help="map: partitioned MSH + cell map, split: also one MSH per part")
+
+
+def OutputOptionsFromArgs(args):
+    return ResolveOutputOptions({
+        "msh": args.msh_format,
+        "vtk": args.vtk_format,
+        "compress": args.compress,
+        "arrays": args.arrays,
+        "foam": args.foam,
+        "partitions": args.partitions,
+        "partitioner": args.partitioner,
+        "partitionFiles": args.partition_files,
+    })
+
+
+def ResolveOutputOptions(options):
+    resolved = dict(DEFAULT_OUTPUT_OPTIONS)
+    resolved.update({key: value for key, value in (options or {}).items() if value is not None})
+    if not isinstance(resolved["partitions"], int) or resolved["partitions"] < 0:
+        raise ValueError(f"output option partitions={resolved['partitions']!r}, give a number >= 0")
+    for key, value in resolved.items():
+        if key == "partitions":
+            continue
+        if key not in CHOICES:
+            raise ValueError(f"unknown output option {key!r}")
+        if value not in CHOICES[key]:
+            raise ValueError(f"output option {key}={value!r}, choose from {CHOICES[key]}")
+    if resolved["compress"] == "zstd":
+        # check at once rather than after minutes of meshing
+        import zstandard  # noqa: F401
+    return resolved
+# ===============================================
+
+
+# ===============================================
+# files produced for the requested paths ({"msh": ..., "vtk": ...})
+# the vtk path gets the extension .vtu in vtu mode
+def OutputFiles(mshPath, vtkPath, options):
+    options = ResolveOutputOptions(options)
+    extension = COMPRESSED_EXTENSIONS[options["compress"]]
+    files = {"msh": mshPath + extension}
+    if options["vtk"] == "vtu":
+        files["vtk"] = os.path.splitext(vtkPath)[0] + ".vtu" + extension
+    elif options["vtk"] != "none":
+        files["vtk"] = vtkPath + extension
+    if options["arrays"] != "none":
+        files["arrays"] = meshexport.ArraysPath(mshPath, options["arrays"])
+    if options["foam"] != "none":
+        files["foam"] = foamexport.FoamCasePath(mshPath)
+    files.update(meshpartition.PartitionFiles(mshPath, options))
+    return files
+
+
+# write the current gmsh mesh and return the produced files
+# processor: partition of every cell from meshpartition.PartitionMesh, None if not partitioned
+def WriteOutputs(mshPath, vtkPath, options, processor=None):
+    options = ResolveOutputOptions(options)
+    gmsh.option.setNumber("Mesh.MshFileVersion", 2.2)
+    gmsh.option.setNumber("Mesh.Binary", 1 if options["msh"] == "binary" else 0)
+    gmsh.write(mshPath)
+    written = {"msh": mshPath}
+    if processor is not None:
+        partitionFiles = meshpartition.PartitionFiles(mshPath, options)
+        if options["partitionFiles"] == "split":
+            splitFiles = [path for name, path in partitionFiles.items() if name.startswith("partition")]
+            meshpartition.WriteSplitFiles(splitFiles, processor, options["msh"] == "binary")
+        # gmshToFoam numbers the cells in the order of the file, not of processor
+        meshpartition.WriteCellDecomposition(partitionFiles["decomposition"], meshpartition.FileProcessors(mshPath))
+        written.update(partitionFiles)
+
+    if options["vtk"] == "vtu":
+        written["vtk"] = os.path.splitext(vtkPath)[0] + ".vtu"
+        WriteVtu(written["vtk"])
+    elif options["vtk"] != "none":
+        gmsh.option.setNumber("Mesh.Binary", 1 if options["vtk"] == "binary" else 0)
+        gmsh.write(vtkPath)
+        written["vtk"] = vtkPath
+    gmsh.option.setNumber("Mesh.Binary", 0)
+
+    for name, path in written.items():
+        written[name] = CompressFile(path, options["compress"])
+    if options["arrays"] != "none":
+        written["arrays"] = meshexport.ExportMeshArrays(mshPath, options["arrays"])
+    if options["foam"] != "none":
+        written["foam"] = foamexport.ExportGmshPolyMesh(mshPath)
+        if processor is not None:
+            meshpartition.WriteFoamDecomposition(written["foam"], processor, options["partitions"])
+    return written
+# ===============================================
+
+
+# ===============================================
+# path -> path.gz / path.zst, the uncompressed file is removed
+def CompressFile(path, method):
+    if method == "none":
+        return path
+    compressedPath = path + COMPRESSED_EXTENSIONS[method]
+    with open(path, "rb") as source:
+        if method == "gzip":
+            with gzip.open(compressedPath, "wb", compresslevel=6) as target:
+                shutil.copyfileobj(source, target, 1 << 20)
+        else:
+            import zstandard
+            with open(compressedPath, "wb") as target:
+                zstandard.ZstdCompressor(level=3, threads=-1).copy_stream(source, target)
+    os.remove(path)
+    return compressedPath
+# ===============================================
+
+
+# ===============================================
+# XML UnstructuredGrid with zlib-compressed inline binary data
+# elements of the physical groups are written (same as gmsh with Mesh.SaveAll 0),
+# the physical tag of each cell is stored as cell data "physical"
+def WriteVtu(path):
+    nodeTags, coordinates, _ = gmsh.model.mesh.getNodes()
+    # gmsh node tag -> row of the point array
+    index = np.zeros(int(nodeTags.max()) + 1 if len(nodeTags) else 1, dtype=np.int64)
+    index[nodeTags.astype(np.int64)] = np.arange(len(nodeTags))
+    points = coordinates.reshape(-1, 3)
+
+    connectivity = []
+    offsets = []
+    cellTypes = []
+    physical = []
+    for dim, physicalTag in gmsh.model.getPhysicalGroups():
+        for entity in gmsh.model.getEntitiesForPhysicalGroup(dim, physicalTag):
+            elementTypes, _, elementNodeTags = gmsh.model.mesh.getElements(dim, entity)
+            for elementType, nodes in zip(elementTypes, elementNodeTags):
+                if elementType not in VTK_CELL_TYPES:
+                    continue
+                numNodes = gmsh.model.mesh.getElementProperties(elementType)[3]
+                cells = index[nodes.astype(np.int64)].reshape(-1, numNodes)
+                connectivity.append(cells.ravel())
+                offsets.append(np.full(len(cells), numNodes, dtype=np.int64))
+                cellTypes.append(np.full(len(cells), VTK_CELL_TYPES[elementType], dtype=np.uint8))
+                physical.append(np.full(len(cells), physicalTag, dtype=np.int32))
+
+    connectivity = np.concatenate(connectivity) if connectivity else np.zeros(0, dtype=np.int64)
+    offsets = np.cumsum(np.concatenate(offsets)) if offsets else np.zeros(0, dtype=np.int64)
+    cellTypes = np.concatenate(cellTypes) if cellTypes else np.zeros(0, dtype=np.uint8)
+    physical = np.concatenate(physical) if physical else np.zeros(0, dtype=np.int32)
+
+    with open(path, "w") as f:
+        f.write('<?xml version="1.0"?>\n')
+        f.write('<VTKFile type="UnstructuredGrid" version="1.0" byte_order="LittleEndian" '
+                'header_type="UInt64" compressor="vtkZLibDataCompressor">\n')
+        f.write("<UnstructuredGrid>\n")
+        f.write(f'<Piece NumberOfPoints="{len(points)}" NumberOfCells="{len(cellTypes)}">\n')
+        f.write("<Points>\n")
+        WriteDataArray(f, points.astype("<f8"), "Points", 3)
+        f.write("</Points>\n<Cells>\n")
+        WriteDataArray(f, connectivity.astype("<i8"), "connectivity")
+        WriteDataArray(f, offsets.astype("<i8"), "offsets")
+        WriteDataArray(f, cellTypes.astype("u1"), "types")
+        f.write("</Cells>\n<CellData Scalars=\"physical\">\n")
+        WriteDataArray(f, physical.astype("<i4"), "physical")
+        f.write("</CellData>\n</Piece>\n</UnstructuredGrid>\n</VTKFile>\n")
+
+
+VTK_TYPE_NAMES = {"f8": "Float64", "i8": "Int64", "i4": "Int32", "u1": "UInt8"}
+
+
+# one compressed block: header (number of blocks, block size, last block size, compressed size)
+# and data are base64-encoded separately
+def WriteDataArray(f, array, name, components=1):
+    raw = np.ascontiguousarray(array).tobytes()
+    compressed = zlib.compress(raw, 6)
+    header = np.array([1, len(raw), len(raw), len(compressed)], dtype="<u8").tobytes()
+    typeName = VTK_TYPE_NAMES[array.dtype.str[1:]]
+    f.write(f'<DataArray type="{typeName}" Name="{name}" NumberOfComponents="{components}" format="binary">\n')
+    f.write(base64.b64encode(header).decode("ascii"))
+    f.write(base64.b64encode(compressed).decode("ascii"))
+    f.write("\n</DataArray>\n")
+# ===============================================
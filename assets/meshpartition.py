@@ -0,0 +1,215 @@
+# *************************************************************
+# Partition of the finished mesh into K subdomains for parallel CFD.
+# The partition is made by gmsh, with the physical groups kept:
+#   "metis"  : gmsh.model.mesh.partition (METIS, few interface faces)
+#   "simple" : K slabs with the same number of cells along the longest
+#              axis of the mesh, given to gmsh as an explicit partition
+# The partition of every cell is written as an OpenFOAM labelList
+# (<name>.cellDecomposition) in the cell order of the written *.msh, which
+# is read again for it: gmsh's MSH 2.2 writer groups the elements by type
+# (all tetrahedra, then all prisms) and numbers the nodes and elements
+# anew, not entity by entity like foamexport.MeshFromGmsh, and gmshToFoam
+# numbers the cells in file order.
+# With --foam the polyMesh of foamexport.py (entity order) gets its own
+# constant/cellDecomposition and system/decomposeParDict (method manual),
+# so decomposePar only splits.
+# The quality (cells per partition, imbalance, interface faces) goes into
+# the run record.
+# options (part of the output options, see meshoutput.py):
+#   partitions     : 0 / 1 = no partition
+#   partitioner    : "metis" | "simple"
+#   partitionFiles : "map"   one partitioned MSH (partition tags on the elements with
+#                            metis only, physical groups and entities unchanged)
+#                    "split" also one <name>_<k>.msh per partition
+# *************************************************************
+
+import os
+
+import numpy as np
+
+import gmsh
+
+import foamexport
+import msh22
+
+
+# ===============================================
+# explicit partition: slabs of the same number of volume elements along the
+# longest axis; all lower-dimensional elements get the slab of their center
+def SlabPartition(numPartitions):
+    nodeTags, coordinates, _ = gmsh.model.mesh.getNodes()
+    index = np.zeros(int(nodeTags.max()) + 1, dtype=np.int64)
+    index[nodeTags.astype(np.int64)] = np.arange(len(nodeTags))
+    points = coordinates.reshape(-1, 3)
+
+    centers = {}
+    for dim in range(4):
+        elementTypes, elementTags, elementNodeTags = gmsh.model.mesh.getElements(dim)
+        for elementType, tags, nodes in zip(elementTypes, elementTags, elementNodeTags):
+            numNodes = gmsh.model.mesh.getElementProperties(elementType)[3]
+            center = points[index[nodes.astype(np.int64)].reshape(-1, numNodes)].mean(axis=1)
+            centers.setdefault(dim, []).append((tags, center))
+    volumeCenters = np.concatenate([center for _, center in centers[3]])
+    axis = int(np.argmax(np.ptp(volumeCenters, axis=0)))
+    # slab k holds the cells between the k-th and (k+1)-th quantile
+    bounds = np.quantile(volumeCenters[:, axis], np.arange(1, numPartitions) / numPartitions)
+
+    elementTags = np.concatenate([tags for parts in centers.values() for tags, _ in parts])
+    position = np.concatenate([center[:, axis] for parts in centers.values() for _, center in parts])
+    return elementTags, np.searchsorted(bounds, position) + 1
+
+
+# partition (0-based processor) of every volume element tag, -1 for no partition
+def ElementPartitions():
+    tags, partitions = [], []
+    for dim, tag in gmsh.model.getEntities(3):
+        entityPartitions = gmsh.model.getPartitions(dim, tag)
+        # the entities of the model before partitioning have no elements left
+        if len(entityPartitions) != 1:
+            continue
+        _, elementTags, _ = gmsh.model.mesh.getElements(dim, tag)
+        for elementTag in elementTags:
+            tags.append(elementTag.astype(np.int64))
+            partitions.append(np.full(len(elementTag), int(entityPartitions[0]) - 1, dtype=np.int64))
+    tags = np.concatenate(tags)
+    result = np.full(int(tags.max()) + 1, -1, dtype=np.int64)
+    result[tags] = np.concatenate(partitions)
+    return result
+# ===============================================
+
+
+# partition of the volume elements of mesh (msh22 layout), in its order
+def CellProcessors(mesh):
+    tags = mesh["elementTags"][foamexport.VolumeRows(mesh)]
+    partitionByTag = ElementPartitions()
+    processor = np.full(len(tags), -1, dtype=np.int64)
+    known = tags < len(partitionByTag)
+    processor[known] = partitionByTag[tags[known]]
+    if np.any(processor < 0):
+        raise RuntimeError(f"{np.count_nonzero(processor < 0)} cells are in no partition")
+    return processor
+
+
+# sorted node keys of every cell (padded with -1)
+def CellKeys(mesh, nodeKeys):
+    rows = foamexport.VolumeRows(mesh)
+    index = msh22.NodeIndex(mesh)
+    numNodes = np.diff(mesh["elementOffsets"])[rows]
+    keys = np.full((len(rows), 8), -1, dtype=np.int64)
+    for n in np.unique(numNodes):
+        selected = numNodes == n
+        columns = mesh["elementOffsets"][rows[selected]][:, None] + np.arange(n)
+        keys[selected, :n] = np.sort(nodeKeys[index[mesh["elementNodes"][columns]]], axis=1)
+    return keys
+
+
+# partition of every cell in the order of the *.msh file just written from the current model
+# the MSH 2.2 writer numbers the nodes and elements anew, so the cells are found by the
+# coordinates of their nodes, both rounded to the 16 digits of gmsh's ASCII output
+def FileProcessors(mshPath):
+    mesh = foamexport.MeshFromGmsh()
+    fileMesh = msh22.ReadMsh22(mshPath)
+    coordinates = np.char.mod("%.16g", np.concatenate([mesh["nodes"], fileMesh["nodes"]])).astype(np.float64)
+    _, nodeKeys = np.unique(coordinates, axis=0, return_inverse=True)
+    nodeKeys = nodeKeys.ravel()
+    modelKeys = CellKeys(mesh, nodeKeys[:len(mesh["nodes"])])
+    fileKeys = CellKeys(fileMesh, nodeKeys[len(mesh["nodes"]):])
+
+    _, cellKeys = np.unique(np.concatenate([modelKeys, fileKeys]), axis=0, return_inverse=True)
+    cellKeys = cellKeys.ravel()
+    cellOfKey = np.full(cellKeys.max() + 1, -1, dtype=np.int64)
+    cellOfKey[cellKeys[:len(modelKeys)]] = np.arange(len(modelKeys))
+    cells = cellOfKey[cellKeys[len(modelKeys):]]
+    if len(fileKeys) != len(modelKeys) or np.any(cells < 0):
+        raise RuntimeError(f"the cells of {mshPath} are not the cells of the model")
+    return CellProcessors(mesh)[cells]
+# ===============================================
+
+
+# ===============================================
+# cells per partition, imbalance (largest / mean) and faces between partitions
+def PartitionQuality(mesh, processor, numPartitions):
+    faces, faceCells, _ = foamexport.CellFaces(mesh)
+    first, second = foamexport.SharedFaces(faces, len(mesh["nodes"]))
+    cells = np.bincount(processor, minlength=numPartitions)
+    return {
+        "cells": [int(c) for c in cells],
+        "imbalance": float(cells.max() / cells.mean()),
+        "interfaceFaces": int(np.count_nonzero(processor[faceCells[first]] != processor[faceCells[second]])),
+    }
+
+
+# partition the current model
+# returns (summary for the run record, processor of every cell in foamexport order,
+# for the polyMesh and the split files; the *.msh file has its own order, see FileProcessors)
+# ({}, None) without partitioning
+def PartitionMesh(options):
+    numPartitions = int(options["partitions"])
+    if numPartitions < 2:
+        return {}, None
+    gmsh.option.setNumber("Mesh.PartitionCreatePhysicals", 1)
+    gmsh.option.setNumber("Mesh.PartitionCreateTopology", 1)
+    # MSH 2.2 keeps the elementary entities and stores the partition as extra tags
+    gmsh.option.setNumber("Mesh.PartitionOldStyleMsh2", 1)
+    if options["partitioner"] == "simple":
+        elementTags, partitions = SlabPartition(numPartitions)
+        gmsh.model.mesh.partition(numPartitions, elementTags, partitions)
+    else:
+        gmsh.model.mesh.partition(numPartitions)
+
+    mesh = foamexport.MeshFromGmsh()
+    processor = CellProcessors(mesh)
+    summary = {"partitions": numPartitions, "partitioner": options["partitioner"]}
+    summary.update(PartitionQuality(mesh, processor, numPartitions))
+    print(f"partition = {summary['partitions']} ({summary['partitioner']}), imbalance {summary['imbalance']:.3f}, "
+          f"{summary['interfaceFaces']} interface faces")
+    return summary, processor
+# ===============================================
+
+
+# ===============================================
+# files of the partitioning for the requested *.msh path
+def PartitionFiles(mshPath, options):
+    numPartitions = int(options["partitions"])
+    if numPartitions < 2:
+        return {}
+    base = os.path.splitext(mshPath)[0]
+    files = {"decomposition": base + ".cellDecomposition"}
+    if options["partitionFiles"] == "split":
+        for k in range(1, numPartitions + 1):
+            files[f"partition{k}"] = f"{base}_{k}.msh"
+    return files
+
+
+# one MSH 2.2 per partition: its cells and the triangles / quadrangles on
+# them, nodes and elements numbered from 1 in every file
+# (the split files of gmsh itself are empty for MSH 2.2 with the old style)
+def WriteSplitFiles(files, processor, binary=False):
+    mesh = foamexport.MeshFromGmsh()
+    volumeRows = foamexport.VolumeRows(mesh)
+    elementProcessor = np.full(len(mesh["elementTags"]), -1, dtype=np.int64)
+    elementProcessor[volumeRows] = processor
+    faceRows, faceCells = foamexport.FaceElementCells(mesh)
+    elementProcessor[faceRows] = np.where(faceCells >= 0, processor[np.maximum(faceCells, 0)], -1)
+    for k in range(len(files)):
+        msh22.WriteMsh22(files[k], msh22.SubMesh(mesh, elementProcessor == k), binary)
+
+
+def WriteCellDecomposition(path, processor, location="constant"):
+    with open(path, "wb") as f:
+        f.write(foamexport.Header("labelList", "cellDecomposition", fileFormat="ascii", location=location))
+        f.write(f"{len(processor)}\n(\n".encode("ascii"))
+        np.savetxt(f, processor, fmt="%d")
+        f.write(b")\n")
+
+
+# manual decomposition of an OpenFOAM case
+def WriteFoamDecomposition(caseDir, processor, numPartitions):
+    WriteCellDecomposition(os.path.join(caseDir, "constant", "cellDecomposition"), processor)
+    os.makedirs(os.path.join(caseDir, "system"), exist_ok=True)
+    with open(os.path.join(caseDir, "system", "decomposeParDict"), "wb") as f:
+        f.write(foamexport.Header("dictionary", "decomposeParDict", fileFormat="ascii", location="system"))
+        f.write((f"numberOfSubdomains {numPartitions};\n\n"
+                 "method          manual;\n\n"
+                 "manualCoeffs\n{\n    dataFile        \"cellDecomposition\";\n}\n").encode("ascii"))
+# ===============================================
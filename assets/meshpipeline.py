@@ -0,0 +1,249 @@
+# *************************************************************
+# Outer and inner mesh in one process, without MeshOriginal.msh,
+# MostInnerSurface.stl and the node welding of the merge.
+# 1. prism layers from the STL with the phases of makemesh.py, without the
+#    tetra inside (makemesh.innerVolume = False), taken from gmsh as arrays
+# 2. caps -> INLET/OUTLET and the need part (boundary.py, meshdeform.py);
+#    with a target centerline the need part is deformed, the centerline node
+#    of every WALL triangle is found in memory (surfacecorrespond.py)
+# 3. the inner faces of the innermost prisms go back to gmsh as a discrete
+#    surface and the enclosed volume is meshed with the phases of
+#    makemesh_inner.py in the same gmsh session
+# 4. gmsh keeps the surface nodes where they are, so the INNERWALL nodes are
+#    found by their exact coordinates; the interface is checked triangle by
+#    triangle and the tetra are joined to the prisms (meshmerge.JoinMesh)
+# 5. the conforming mesh goes back to gmsh and is written with the output
+#    options of the meshing scripts (MSH 2.2 / VTK / OpenFOAM / partitions)
+# input  : WALL.stl, centerline.txt (#pt3d)
+#          centerlineFinal.txt and radius.txt (optional, deformation)
+# output : MeshMerged.msh, MeshMerged.vtk (physical groups WALL 10,
+#          INLET 11, OUTLET 12, INTERNAL 100, as meshmerge.py)
+#
+# usage  : python meshpipeline.py WALL.stl centerline.txt MeshMerged.msh MeshMerged.vtk
+#          --centerline-final centerlineFinal.txt -nopopup
+# *************************************************************
+
+import argparse
+import json
+import sys
+
+import numpy as np
+
+import gmsh
+
+import boundary
+import centerline
+import foamexport
+import makemesh
+import makemesh_inner
+import meshdeform
+import meshmerge
+import meshoptions
+import meshoutput
+import meshpartition
+import meshprofile
+import meshquality
+import msh22
+import surfacecorrespond
+
+# physical groups
+WALL = 10
+INNERWALL = 90
+# gmsh element types
+TRIANGLE = 2
+# dimension of every element type of msh22.py
+ELEMENT_DIMENSION = {1: 1, 2: 2, 3: 2, 4: 3, 5: 3, 6: 3, 7: 3, 8: 1, 9: 2, 10: 2, 11: 3, 15: 0}
+
+
+# ===============================================
+# prism layers of the STL as arrays (msh22 layout)
+def OuterMesh(stl, options):
+    gmsh.clear()
+    for entities in (makemesh.surface_real_wall, makemesh.surface_fake_wall, makemesh.surface_inlet_outlet):
+        entities.clear()
+    makemesh.stlPath = stl
+    makemesh.innerVolume = False
+    makemesh.meshSize = options["meshSize"]
+    makemesh.meshOptions = options["meshOptions"]
+    makemesh.qualityOptions = options["qualityOptions"]
+    for phase in (makemesh.OptionSetting, makemesh.ImportStl, makemesh.ShapeCreation, makemesh.NamingBoundary, makemesh.Meshing):
+        phase()
+    return foamexport.MeshFromGmsh()
+
+
+# need part with INLET/OUTLET, deformed toward centerlineFinal if given
+def NeedMesh(mesh, centerlinePoints, centerlineFinalPoints=None, radius=None):
+    if centerlineFinalPoints is None:
+        mesh = boundary.RewriteInletOutlet(mesh, centerlinePoints[0], centerlinePoints[-1])
+        return meshdeform.NeedPart(mesh)
+    # test.ply of button 3, from the WALL triangles of the mesh itself
+    _, triangles = msh22.ElementsOfType(mesh, TRIANGLE, WALL)
+    surfaceCorrespond, _ = surfacecorrespond.TriangleCorrespondence(mesh["nodes"], triangles, centerlinePoints)
+    return meshdeform.DeformMesh(mesh, centerlinePoints, centerlineFinalPoints, surfaceCorrespond, radius)
+
+
+# tetra inside the innermost prisms, in the current gmsh session
+# returns the inner mesh (msh22 layout) and the node rows of the surface in the need part
+def InnerMesh(need, options):
+    surfaceRows, triangles = np.unique(meshdeform.InnerSurfaceRows(need), return_inverse=True)
+    makemesh_inner.surfaceArrays = (need["nodes"][surfaceRows], triangles.reshape(-1, 3))
+    makemesh_inner.stlPath = None
+    makemesh_inner.meshSize = options["innerMeshSize"]
+    makemesh_inner.meshOptions = options["meshOptions"]
+    makemesh_inner.qualityOptions = options["qualityOptions"]
+    makemesh_inner.volumeOnly = True
+    makemesh_inner.ResetModel()
+    try:
+        for phase in (makemesh_inner.OptionSetting, makemesh_inner.ImportStl, makemesh_inner.ShapeCreation,
+                      makemesh_inner.NamingBoundary, makemesh_inner.Meshing):
+            phase()
+    finally:
+        makemesh_inner.surfaceArrays = None
+    return foamexport.MeshFromGmsh(), surfaceRows
+# ===============================================
+
+
+# ===============================================
+# inner node row -> need node row for every INNERWALL node, by exact coordinates
+# raises meshmerge.InterfaceMismatch if a node was moved or the triangles are not the inner prism faces
+def InterfaceRows(need, inner, surfaceRows):
+    _, innerWall = msh22.ElementsOfType(inner, TRIANGLE, INNERWALL)
+    innerNodes = np.unique(innerWall)
+    if len(innerNodes) != len(surfaceRows):
+        raise meshmerge.InterfaceMismatch(f"{len(surfaceRows)} inner prism nodes but {len(innerNodes)} INNERWALL nodes")
+    points = np.concatenate([need["nodes"][surfaceRows], inner["nodes"][innerNodes]])
+    _, first, inverse = np.unique(points, axis=0, return_index=True, return_inverse=True)
+    match = first[inverse.ravel()[len(surfaceRows):]]
+    if np.any(match >= len(surfaceRows)):
+        raise meshmerge.InterfaceMismatch(f"{np.count_nonzero(match >= len(surfaceRows))} INNERWALL nodes are not on an inner prism node")
+    needRows = surfaceRows[match]
+
+    # the same triangles on both sides
+    nodeMap = np.full(len(inner["nodes"]), -1, dtype=np.int64)
+    nodeMap[innerNodes] = needRows
+    innerFaces = np.sort(nodeMap[innerWall], axis=1)
+    prismFaces = np.sort(meshdeform.InnerSurfaceRows(need), axis=1)
+    if not np.array_equal(np.unique(innerFaces, axis=0), np.unique(prismFaces, axis=0)) or len(innerFaces) != len(prismFaces):
+        raise meshmerge.InterfaceMismatch(f"the {len(innerFaces)} INNERWALL triangles are not the {len(prismFaces)} inner prism faces")
+    return innerNodes, needRows, {"interfaceNodes": int(len(innerNodes)), "interfaceTriangles": int(len(innerFaces))}
+# ===============================================
+
+
+# ===============================================
+# mesh (msh22 layout) -> current gmsh model, one discrete entity for every
+# (dimension, physical group, entity) in the order of the elements
+# gmsh's MSH 2.2 writer still groups the elements by type (all tetrahedra
+# before the prisms), so the written file does not keep the order of mesh;
+# the cell map of the partitioning is taken from the written file (meshpartition.FileProcessors)
+def MeshToGmsh(mesh):
+    gmsh.clear()
+    dims = np.array([ELEMENT_DIMENSION[int(t)] for t in mesh["elementTypes"]])
+    keys = np.column_stack([dims, mesh["elementPhysical"], mesh["elementEntity"]])
+    _, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.ravel()
+    groups = np.argsort(first)
+    groupDims = keys[first[groups], 0]
+    if not np.any(groupDims == 3):
+        raise ValueError("the mesh has no volume elements")
+    entities = [gmsh.model.addDiscreteEntity(int(dim)) for dim in groupDims]
+    # all nodes on the first volume entity
+    gmsh.model.mesh.addNodes(3, entities[int(np.argmax(groupDims == 3))], mesh["nodeTags"], mesh["nodes"].ravel())
+
+    physicals = {}
+    for group, entity in zip(groups, entities):
+        dim, physical, _ = (int(k) for k in keys[first[group]])
+        physicals.setdefault((dim, physical), []).append(entity)
+        rows = inverse == group
+        for elementType in np.unique(mesh["elementTypes"][rows]):
+            typeRows = np.flatnonzero(rows & (mesh["elementTypes"] == elementType))
+            _, connectivity = msh22.ElementsOfType(mesh, int(elementType))
+            columns = np.searchsorted(np.flatnonzero(mesh["elementTypes"] == elementType), typeRows)
+            gmsh.model.mesh.addElementsByType(entity, int(elementType), mesh["elementTags"][typeRows],
+                                              mesh["nodeTags"][connectivity[columns]].ravel())
+
+    names = {(dim, tag): name for dim, tag, name in mesh["physicalNames"]}
+    for (dim, physical), tags in physicals.items():
+        gmsh.model.addPhysicalGroup(dim, tags, physical)
+        if (dim, physical) in names:
+            gmsh.model.setPhysicalName(dim, physical, names[(dim, physical)])
+# ===============================================
+
+
+# ===============================================
+# WALL.stl -> merged mesh in one process
+# options: meshSize, innerMeshSize, meshOptions, outputOptions, qualityOptions
+# returns the record of the run (see meshprofile.py)
+def MakePipelineMesh(stl, centerlinePath, mshPath, vtkPath, options, centerlineFinalPath=None, radiusPath=None):
+    centerlinePoints = centerline.ReadCenterline(centerlinePath)
+    centerlineFinalPoints = centerline.ReadCenterline(centerlineFinalPath) if centerlineFinalPath else None
+    radius = centerline.ReadRadius(radiusPath) if radiusPath else None
+    # the caps of the inner mesh are at the ends of the centerline the mesh is made for
+    target = centerlinePoints if centerlineFinalPoints is None else centerlineFinalPoints
+    outputFiles = meshoutput.OutputFiles(mshPath, vtkPath, options["outputOptions"])
+
+    profiler = meshprofile.PhaseProfiler()
+    profiler.Start()
+    try:
+        with profiler.Phase("OuterMesh"):
+            outer = OuterMesh(stl, options)
+        with profiler.Phase("NeedMesh"):
+            need = NeedMesh(outer, centerlinePoints, centerlineFinalPoints, radius)
+        with profiler.Phase("InnerMesh"):
+            inner, surfaceRows = InnerMesh(need, options)
+        with profiler.Phase("JoinMesh"):
+            inner = boundary.RewriteInletOutlet(inner, target[0], target[-1])
+            innerNodes, needRows, interface = InterfaceRows(need, inner, surfaceRows)
+            merged, statistics = meshmerge.JoinMesh(need, inner, innerNodes, needRows)
+            interface.update(statistics)
+            print(f"interface = {json.dumps(interface)}")
+        with profiler.Phase("OutputMshVtk"):
+            MeshToGmsh(merged)
+            partition, processor = meshpartition.PartitionMesh(options["outputOptions"])
+            written = meshoutput.WriteOutputs(mshPath, vtkPath, options["outputOptions"], processor)
+            print(f"output = {written}")
+    finally:
+        profiler.Stop()
+
+    record = {"script": "meshpipeline", "stl": stl, "centerline": centerlinePath, "centerlineFinal": centerlineFinalPath,
+              "meshSize": options["meshSize"], "innerMeshSize": options["innerMeshSize"],
+              "N": makemesh.N, "r": makemesh.r, "h": makemesh.h,
+              "meshOptions": dict(makemesh_inner.usedMeshOptions), "quality": {"outer": dict(makemesh.usedQuality), "inner": dict(makemesh_inner.usedQuality)},
+              "interface": interface, "partition": partition,
+              "outputs": outputFiles}
+    record.update(profiler.Finish())
+    return record
+# ===============================================
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="make the prism layers and the inner tetra mesh in one process")
+    parser.add_argument("stl", help="WALL surface (relative paths are from the folder of makemesh.py)")
+    parser.add_argument("centerline", help="centerline of the STL (#pt3d)")
+    parser.add_argument("msh", help="merged mesh, e.g. MeshMerged.msh")
+    parser.add_argument("vtk", help="viewer file, e.g. MeshMerged.vtk")
+    parser.add_argument("--centerline-final", default=None, help="target centerline (#pt3d), deform the prism layers toward it")
+    parser.add_argument("--radius", default=None, help="radius of every target centerline edge")
+    parser.add_argument("--mesh-size", type=float, default=makemesh.meshSize, help="mesh size of the prism layers")
+    parser.add_argument("--inner-mesh-size", type=float, default=makemesh_inner.meshSize, help="mesh size of the inner tetra")
+    meshoptions.AddMeshOptionArguments(parser)
+    meshprofile.AddReportArgument(parser)
+    meshoutput.AddOutputArguments(parser)
+    meshquality.AddQualityArguments(parser)
+    # gmsh options such as -nopopup are passed to gmsh as they are
+    args, gmshArgs = parser.parse_known_args()
+    options = {
+        "meshSize": args.mesh_size,
+        "innerMeshSize": args.inner_mesh_size,
+        "meshOptions": meshoptions.MeshOptionsFromArgs(args),
+        "outputOptions": meshoutput.OutputOptionsFromArgs(args),
+        "qualityOptions": meshquality.QualityOptionsFromArgs(args),
+    }
+
+    gmsh.initialize([sys.argv[0]] + gmshArgs)
+    try:
+        record = MakePipelineMesh(args.stl, args.centerline, args.msh, args.vtk, options, args.centerline_final, args.radius)
+    except meshmerge.InterfaceMismatch as e:
+        sys.exit(f"interface mismatch: {e}")
+    finally:
+        gmsh.finalize()
+    meshprofile.WriteReport(record, args.report)
@@ -0,0 +1,217 @@
+# *************************************************************
+# Per-phase timing and memory measurement for the meshing scripts.
+# Every phase (OptionSetting, ImportStl, ..., OutputMshVtk) is measured
+# for wall time, CPU time and peak RSS, and the gmsh logger output is
+# parsed into the sub-phases of gmsh itself (meshing 1D/2D/3D,
+# Netgen optimization, ...) and the final node/element counts.
+# The result is one JSON record per run.
+#   --report run.json : write the record to a sidecar file
+#   --report -        : print the record as one line "#meshreport {...}" on stdout
+# the start and end of every phase are printed as "#meshphase {...}" lines,
+# so a process that reads stdout can follow the run (see meshrunner.py)
+# *************************************************************
+
+import json
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import gmsh
+import psutil
+
+# the line with the record on stdout starts with this
+REPORT_PREFIX = "#meshreport "
+# the lines with the start / end of a phase start with this
+PHASE_PREFIX = "#meshphase "
+
+# interval of the RSS sampling [s]
+RSS_SAMPLING_INTERVAL = 0.05
+
+# "Done meshing 3D (Wall 1.23s, CPU 1.1s)"
+DONE_PATTERN = re.compile(r"Done (.+?) \(Wall ([0-9.eE+-]+)s, CPU ([0-9.eE+-]+)s\)")
+# "Optimizing mesh (Netgen)..." / "Meshing 3D..."
+START_PATTERN = re.compile(r"(Meshing \d?D|Optimizing mesh(?: \(.+?\))?|Classifying surfaces|Creating geometry|Creating topology)\.\.\.")
+# "Info: 12345 nodes 67890 elements"
+COUNT_PATTERN = re.compile(r"(\d+) nodes (\d+) elements")
+
+
+# ===============================================
+# peak RSS of the process over its whole life [byte]
+def ProcessPeakRss(process):
+    info = process.memory_info()
+    # Windows
+    if hasattr(info, "peak_wset"):
+        return info.peak_wset
+    try:
+        import resource
+        # kilobytes on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    except ImportError:
+        return info.rss
+# ===============================================
+
+
+# ===============================================
+# background thread that keeps the highest RSS seen since the last Reset()
+# the OS counter only knows the peak of the whole process, not of one phase
+class RssSampler:
+    def __init__(self, process):
+        self.process = process
+        self.peak = 0
+        self.lock = threading.Lock()
+        self.stopEvent = threading.Event()
+        self.thread = threading.Thread(target=self.Run, daemon=True)
+
+    def Run(self):
+        while not self.stopEvent.wait(RSS_SAMPLING_INTERVAL):
+            self.Sample()
+
+    def Sample(self):
+        rss = self.process.memory_info().rss
+        with self.lock:
+            self.peak = max(self.peak, rss)
+
+    def Reset(self):
+        with self.lock:
+            self.peak = 0
+        self.Sample()
+
+    def Start(self):
+        self.Sample()
+        self.thread.start()
+
+    def Stop(self):
+        self.stopEvent.set()
+        self.thread.join()
+# ===============================================
+
+
+# ===============================================
+# measure the phases of one run
+# usage:
+#   profiler = PhaseProfiler()
+#   profiler.Start()
+#   try:
+#       with profiler.Phase("ImportStl"):
+#           ImportStl()
+#   finally:
+#       profiler.Stop()
+#   record = profiler.Finish()
+class PhaseProfiler:
+    def __init__(self):
+        self.process = psutil.Process()
+        self.sampler = RssSampler(self.process)
+        self.phases = []
+        self.gmshMessages = []
+        self.running = False
+
+    def Start(self):
+        self.startWall = time.perf_counter()
+        self.startCpu = time.process_time()
+        self.sampler.Start()
+        gmsh.logger.start()
+        self.running = True
+
+    @contextmanager
+    def Phase(self, name):
+        self.sampler.Reset()
+        print(PHASE_PREFIX + json.dumps({"phase": name, "state": "start"}), flush=True)
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            self.sampler.Sample()
+            self.phases.append({
+                "name": name,
+                "wall": time.perf_counter() - wall,
+                "cpu": time.process_time() - cpu,
+                "peakRss": self.sampler.peak,
+            })
+            print(PHASE_PREFIX + json.dumps({"phase": name, "state": "done", "wall": self.phases[-1]["wall"]}), flush=True)
+
+    # stop the sampler thread and the gmsh logger, also when a phase failed
+    # (a server or batch worker goes on with the next job); safe to call twice
+    def Stop(self):
+        if not self.running:
+            return
+        self.running = False
+        self.endWall = time.perf_counter()
+        self.endCpu = time.process_time()
+        self.sampler.Stop()
+        self.gmshMessages = gmsh.logger.get()
+        gmsh.logger.stop()
+
+    def Finish(self):
+        self.Stop()
+        record = {
+            "phases": self.phases,
+            "total": {
+                "wall": self.endWall - self.startWall,
+                "cpu": self.endCpu - self.startCpu,
+                "peakRss": ProcessPeakRss(self.process),
+            },
+        }
+        record.update(ParseGmshLog(self.gmshMessages))
+        return record
+# ===============================================
+
+
+# ===============================================
+# gmsh logger -> sub-phase timings and element counts
+def ParseGmshLog(messages):
+    subPhases = []
+    started = []
+    nodes = None
+    elements = None
+    for message in messages:
+        start = START_PATTERN.search(message)
+        if start:
+            started.append(start.group(1))
+            continue
+        done = DONE_PATTERN.search(message)
+        if done:
+            name = done.group(1)
+            # "Done optimizing mesh" does not say which optimizer ran, so take the name of the start line
+            key = name.split()[0].lower()
+            for i in range(len(started) - 1, -1, -1):
+                if started[i].lower().startswith(key):
+                    name = started.pop(i)
+                    break
+            subPhases.append({"name": name, "wall": float(done.group(2)), "cpu": float(done.group(3))})
+            continue
+        count = COUNT_PATTERN.search(message)
+        if count:
+            nodes = int(count.group(1))
+            elements = int(count.group(2))
+    return {"gmshPhases": subPhases, "gmshNodes": nodes, "gmshElements": elements}
+# ===============================================
+
+
+# ===============================================
+# output of the record
+def AddReportArgument(parser):
+    parser.add_argument("--report", default=None, help="write the timing/memory record as JSON to this file ('-' for stdout)")
+
+
+def WriteReport(record, reportPath):
+    if reportPath is None:
+        return
+    if reportPath == "-":
+        sys.stdout.flush()
+        print(REPORT_PREFIX + json.dumps(record), flush=True)
+    else:
+        with open(reportPath, "w") as f:
+            json.dump(record, f, indent=2)
+
+
+# the record printed by another process (e.g. a benchmark running the scripts)
+def FindReport(stdout):
+    for line in reversed(stdout.splitlines()):
+        if line.startswith(REPORT_PREFIX):
+            return json.loads(line[len(REPORT_PREFIX):])
+    return None
+# ===============================================
@@ -0,0 +1,190 @@
+# *************************************************************
+# Quality-gated optimization of the tetrahedra.
+# Meshing() used to run the gmsh and Netgen optimizers inside generate(3)
+# (Mesh.Optimize, Mesh.OptimizeNetgen, threshold 0.9) and optimize() once
+# more after it, whatever the quality of the mesh.
+#   "always" : as before, the quality is only measured and reported
+#   "gated"  : generate(3) without optimization, the quality of all
+#              tetrahedra is measured in one getElementQualities call and
+#              the optimizers of the chain run one by one only while the
+#              minimum or the percentile is below its target; the chain stops
+#              when a pass improves both by less than the tolerance or
+#              the next pass would not fit in the time budget
+# the quality histogram before/after and the time of every pass go into
+# the run record; the gmsh options turned off for "gated" are restored
+# afterwards, as a server or batch worker keeps them for the next job
+# *************************************************************
+
+import time
+
+import numpy as np
+
+import gmsh
+
+DEFAULT_QUALITY_OPTIONS = {
+    "optimize": "always",
+    # gmsh quality measure (gamma is the measure of Mesh.OptimizeThreshold)
+    "measure": "gamma",
+    # targets of the gate: the worst tetrahedron and the given percentile
+    "minimum": 0.3,
+    "percentile": 5.0,
+    "percentileMinimum": 0.6,
+    # optimizers of gmsh.model.mesh.optimize, "gmsh" is the default one ("")
+    "chain": "netgen,gmsh,netgen,gmsh",
+    # seconds for all passes, 0 = no limit
+    "budget": 60.0,
+    # a pass that improves the minimum and the percentile by less stops the chain
+    "tolerance": 0.005,
+}
+CHOICES = {
+    "optimize": ("always", "gated"),
+    "measure": ("gamma", "minSICN", "minSIGE", "minSJ"),
+}
+OPTIMIZERS = {"gmsh": "", "netgen": "Netgen", "relocate3d": "Relocate3D", "unfold": "UntangleMeshGeometry"}
+HISTOGRAM_BINS = np.linspace(0.0, 1.0, 11)
+# turned off during generate(3) in "gated" mode
+GATED_OFF = ("Mesh.Optimize", "Mesh.OptimizeNetgen")
+# gmsh element type of the tetrahedron
+TETRA = 4
+
+
+# ===============================================
+# command line
+def AddQualityArguments(parser):
+    group = parser.add_argument_group("mesh optimization")
+    group.add_argument("--optimize", choices=CHOICES["optimize"], default=None,
+                       help="always: optimize as before, gated: only while the quality is below the targets")
+    group.add_argument("--quality-measure", choices=CHOICES["measure"], default=None)
+    group.add_argument("--quality-min", type=float, default=None, help="target of the worst tetrahedron")
+    group.add_argument("--quality-percentile", type=float, default=None, help="percentile checked with --quality-percentile-min")
+    group.add_argument("--quality-percentile-min", type=float, default=None, help="target of the percentile")
+    group.add_argument("--optimize-chain", default=None, help=f"comma separated optimizers {sorted(OPTIMIZERS)}")
+    group.add_argument("--optimize-budget", type=float, default=None, help="seconds for all optimizer passes (0: no limit)")
+    group.add_argument("--optimize-tolerance", type=float, default=None, help="a pass that improves the quality by less stops the chain")
+
+
+def QualityOptionsFromArgs(args):
+    return ResolveQualityOptions({
+        "optimize": args.optimize,
+        "measure": args.quality_measure,
+        "minimum": args.quality_min,
+        "percentile": args.quality_percentile,
+        "percentileMinimum": args.quality_percentile_min,
+        "chain": args.optimize_chain,
+        "budget": args.optimize_budget,
+        "tolerance": args.optimize_tolerance,
+    })
+
+
+def ResolveQualityOptions(options):
+    resolved = dict(DEFAULT_QUALITY_OPTIONS)
+    resolved.update({key: value for key, value in (options or {}).items() if value is not None})
+    unknown = set(resolved) - set(DEFAULT_QUALITY_OPTIONS)
+    if unknown:
+        raise ValueError(f"unknown quality options {sorted(unknown)}")
+    for key, choices in CHOICES.items():
+        if resolved[key] not in choices:
+            raise ValueError(f"quality option {key}={resolved[key]!r}, choose from {choices}")
+    for name in Chain(resolved):
+        if name not in OPTIMIZERS:
+            raise ValueError(f"unknown optimizer {name!r}, choose from {sorted(OPTIMIZERS)}")
+    if not 0.0 <= float(resolved["percentile"]) <= 100.0:
+        raise ValueError(f"quality option percentile={resolved['percentile']!r}, give a value in [0, 100]")
+    return resolved
+
+
+def Chain(options):
+    return [name.strip().lower() for name in options["chain"].split(",") if name.strip()]
+# ===============================================
+
+
+# ===============================================
+# quality of all tetrahedra: minimum, percentile, mean and histogram
+def Quality(options):
+    elementTags, _ = gmsh.model.mesh.getElementsByType(TETRA)
+    if len(elementTags) == 0:
+        return {"tetrahedra": 0}
+    values = gmsh.model.mesh.getElementQualities(elementTags, options["measure"])
+    histogram, _ = np.histogram(np.clip(values, 0.0, 1.0), bins=HISTOGRAM_BINS)
+    return {
+        "tetrahedra": int(len(values)),
+        "min": float(values.min()),
+        "percentile": float(np.percentile(values, options["percentile"])),
+        "mean": float(values.mean()),
+        "histogram": [int(c) for c in histogram],
+    }
+
+
+def MeetsTargets(quality, options):
+    return (quality["tetrahedra"] == 0
+            or (quality["min"] >= options["minimum"] and quality["percentile"] >= options["percentileMinimum"]))
+# ===============================================
+
+
+# ===============================================
+# generate(3) and the optimization of the options
+# Mesh.Optimize / Mesh.OptimizeNetgen / Mesh.OptimizeThreshold are the ones
+# set by the caller and are only used in "always" mode
+# returns the summary for the run record
+def GenerateAndOptimize(options):
+    options = ResolveQualityOptions(options)
+    summary = {"optimize": options["optimize"], "measure": options["measure"],
+               "targets": {"min": options["minimum"], "percentile": options["percentile"],
+                           "percentileMin": options["percentileMinimum"]}}
+    if options["optimize"] == "always":
+        gmsh.model.mesh.generate(3)
+        start = time.perf_counter()
+        gmsh.model.mesh.optimize()
+        summary["passes"] = [{"optimizer": "gmsh", "wall": time.perf_counter() - start}]
+        summary["after"] = Quality(options)
+        return summary
+
+    saved = {name: gmsh.option.getNumber(name) for name in GATED_OFF}
+    try:
+        for name in saved:
+            gmsh.option.setNumber(name, 0)
+        return GatedOptimize(options, summary)
+    finally:
+        for name, value in saved.items():
+            gmsh.option.setNumber(name, value)
+
+
+# generate(3) without the optimizers, then the chain while the targets are not met
+def GatedOptimize(options, summary):
+    gmsh.model.mesh.generate(3)
+    quality = Quality(options)
+    summary["before"] = quality
+    summary["passes"] = []
+    summary["stop"] = "targets met"
+    start = time.perf_counter()
+    lastWall = {}
+    for name in Chain(options):
+        if MeetsTargets(quality, options):
+            break
+        # the length of the last pass of the same optimizer is the estimate of the next one
+        used = time.perf_counter() - start
+        if options["budget"] > 0 and used + lastWall.get(name, 0.0) > options["budget"]:
+            summary["stop"] = "budget"
+            break
+        passStart = time.perf_counter()
+        gmsh.model.mesh.optimize(OPTIMIZERS[name])
+        lastWall[name] = time.perf_counter() - passStart
+        previous = quality
+        quality = Quality(options)
+        summary["passes"].append({"optimizer": name, "wall": lastWall[name], "min": quality.get("min"),
+                                  "percentile": quality.get("percentile")})
+        print(f"optimize {name}: {lastWall[name]:.2f} s, min {quality['min']:.3f}, "
+              f"p{options['percentile']:g} {quality['percentile']:.3f}")
+        if (quality["min"] - previous["min"] < options["tolerance"]
+                and quality["percentile"] - previous["percentile"] < options["tolerance"]):
+            summary["stop"] = "no improvement"
+            break
+    else:
+        if not MeetsTargets(quality, options):
+            summary["stop"] = "chain finished"
+    if not summary["passes"] and MeetsTargets(quality, options):
+        summary["stop"] = "skipped, targets met"
+    summary["after"] = quality
+    summary["targetsMet"] = MeetsTargets(quality, options)
+    return summary
+# ===============================================
@@ -0,0 +1,361 @@
+# *************************************************************
+# Asynchronous runner for the meshing scripts.
+# Every job is one subprocess (makemesh.py, makemesh_inner.py,
+# meshpipeline.py, ...), at most --slots of them at the same time. The
+# output of every job is read while it runs and turned into events, one
+# JSON object per line:
+#   {"id": "p001", "event": "queued" | "started" | "phase" | "progress" | "finished"
+#                           | "failed" | "timeout" | "memory" | "cancelled", "time": ...}
+#   phase    : start / done of the phases of meshprofile.py ("#meshphase" lines)
+#              and of the gmsh steps ("Meshing 3D...", "Optimizing mesh...")
+#   progress : the percentage of gmsh ("[ 40%] Meshing surface 2")
+#   finished : exit code 0, with the record of --report -
+# a job that runs longer than "timeout" seconds or uses more than
+# "memoryLimit" GB (RSS of the process and its children) is killed, and a
+# job can be cancelled while it waits or runs
+# input  : one JSON object per line (stdin, or a local TCP socket), or a manifest
+#          {"id": "p001", "script": "makemesh_inner.py", "args": ["a.stl", "a.msh", "a.vtk"],
+#           "timeout": 600, "memoryLimit": 16}
+#          {"command": "cancel", "id": "p001"}
+#          {"command": "shutdown"} waits for the jobs and stops (also at the end of stdin)
+# output : the events on stdout, or to every client of the socket
+#
+# usage  : python meshrunner.py --slots 4 < jobs.jsonl
+#          python meshrunner.py --port 50008 --slots 4  (127.0.0.1 only)
+#          python meshrunner.py jobs.json --slots 4 --timeout 3600
+# *************************************************************
+
+import argparse
+import asyncio
+import collections
+import json
+import os
+import re
+import sys
+import time
+
+import psutil
+
+import meshprofile
+
+ASSETS_DIR = os.path.dirname(os.path.abspath(__file__))
+# scripts that know -nopopup and --report -
+REPORT_SCRIPTS = ("makemesh.py", "makemesh_inner.py", "meshpipeline.py")
+# interval of the memory check [s]
+MEMORY_INTERVAL = 0.5
+# seconds between terminate and kill
+KILL_GRACE = 3.0
+# lines of output kept for the failed event
+TAIL_LINES = 20
+# gmsh "Info    : [ 40%] Meshing surface 2 (Plane, MeshAdapt)"
+PROGRESS_PATTERN = re.compile(r"\[\s*(\d+)%\]\s*(.*)")
+
+
+# ===============================================
+# command line of a job
+def JobCommand(job):
+    script = job["script"]
+    if not os.path.isabs(script) and not os.path.exists(script):
+        script = os.path.join(ASSETS_DIR, script)
+    args = [str(a) for a in job.get("args", [])]
+    if os.path.basename(script) in REPORT_SCRIPTS:
+        if "-nopopup" not in args:
+            args.append("-nopopup")
+        if "--report" not in args:
+            args += ["--report", "-"]
+    return [sys.executable, script] + args
+
+
+# terminate the process and its children, kill what is left after KILL_GRACE
+# the process itself is waited for by asyncio, psutil only handles the children
+async def KillTree(process):
+    try:
+        children = psutil.Process(process.pid).children(recursive=True)
+    except psutil.NoSuchProcess:
+        children = []
+    for child in children:
+        try:
+            child.terminate()
+        except psutil.NoSuchProcess:
+            pass
+    try:
+        process.terminate()
+        await asyncio.wait_for(process.wait(), KILL_GRACE)
+    except ProcessLookupError:
+        pass
+    except asyncio.TimeoutError:
+        process.kill()
+    for child in children:
+        try:
+            child.kill()
+        except psutil.NoSuchProcess:
+            pass
+    await process.wait()
+
+
+# RSS of the process and its children [byte]
+def TreeRss(pid):
+    parent = psutil.Process(pid)
+    total = parent.memory_info().rss
+    for child in parent.children(recursive=True):
+        try:
+            total += child.memory_info().rss
+        except psutil.NoSuchProcess:
+            pass
+    return total
+# ===============================================
+
+
+# ===============================================
+# output line of a job -> event (None for lines that are not followed)
+def ParseLine(line):
+    if line.startswith(meshprofile.PHASE_PREFIX):
+        phase = ParseJson(line[len(meshprofile.PHASE_PREFIX):])
+        return None if phase is None else dict(phase, event="phase", source="script")
+    progress = PROGRESS_PATTERN.search(line)
+    if progress:
+        return {"event": "progress", "percent": int(progress.group(1)), "message": progress.group(2).strip()}
+    done = meshprofile.DONE_PATTERN.search(line)
+    if done:
+        return {"event": "phase", "source": "gmsh", "phase": done.group(1), "state": "done", "wall": float(done.group(2))}
+    start = meshprofile.START_PATTERN.search(line)
+    if start:
+        return {"event": "phase", "source": "gmsh", "phase": start.group(1), "state": "start"}
+    return None
+
+
+# JSON object after a #meshphase / #meshreport prefix, None if the line is broken
+# (e.g. cut by a crash), the line is then plain output
+def ParseJson(text):
+    try:
+        value = json.loads(text)
+    except ValueError:
+        return None
+    return value if isinstance(value, dict) else None
+# ===============================================
+
+
+# ===============================================
+class MeshRunner:
+    # emit(event) sends one event to the caller
+    def __init__(self, slots, emit, timeout=None, memoryLimit=None):
+        self.slots = asyncio.Semaphore(slots)
+        self.emit = emit
+        self.timeout = timeout
+        self.memoryLimit = memoryLimit
+        self.tasks = {}
+
+    def Emit(self, jobId, event, **values):
+        self.emit(dict({"id": jobId, "event": event, "time": time.time()}, **values))
+
+    def Submit(self, job):
+        jobId = str(job.get("id", len(self.tasks)))
+        if jobId in self.tasks and not self.tasks[jobId].done():
+            self.Emit(jobId, "failed", error="a job with this id is still running")
+            return
+        if "script" not in job:
+            self.Emit(jobId, "failed", error="the job has no script")
+            return
+        self.tasks[jobId] = asyncio.ensure_future(self.RunJob(jobId, job))
+
+    def Cancel(self, jobId):
+        task = self.tasks.get(str(jobId))
+        if task is None or task.done():
+            self.Emit(str(jobId), "failed", error="no such job waiting or running")
+            return
+        task.cancel()
+
+    def CancelAll(self):
+        for task in self.tasks.values():
+            task.cancel()
+
+    async def Wait(self):
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+
+    async def RunJob(self, jobId, job):
+        self.Emit(jobId, "queued")
+        try:
+            async with self.slots:
+                await self.Execute(jobId, job)
+        except asyncio.CancelledError:
+            self.Emit(jobId, "cancelled")
+
+    async def Execute(self, jobId, job):
+        timeout = job.get("timeout", self.timeout)
+        memoryLimit = job.get("memoryLimit", self.memoryLimit)
+        command = JobCommand(job)
+        start = time.perf_counter()
+        # unbuffered, so that the phases arrive while they happen
+        environment = dict(os.environ, PYTHONUNBUFFERED="1")
+        process = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+                                                       cwd=job.get("cwd"), env=environment, limit=2 ** 24)
+        self.Emit(jobId, "started", pid=process.pid, command=command)
+        state = {"record": None, "tail": collections.deque(maxlen=TAIL_LINES), "peakRss": 0}
+        reader = asyncio.ensure_future(self.ReadOutput(jobId, process.stdout, state))
+        waiter = asyncio.ensure_future(process.wait())
+        watcher = asyncio.ensure_future(self.WatchMemory(process, memoryLimit, state))
+        try:
+            done, _ = await asyncio.wait({waiter, watcher}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if watcher in done and watcher.result() is None:
+                # the process ended before the memory check saw it
+                await waiter
+                done = {waiter}
+        finally:
+            if process.returncode is None:
+                await KillTree(process)
+            watcher.cancel()
+            try:
+                await reader
+            except Exception as e:
+                # the end event must still be sent
+                state["tail"].append(f"output not read: {e!r}")
+
+        values = {"elapsed": time.perf_counter() - start, "peakRss": state["peakRss"]}
+        if waiter in done and process.returncode == 0:
+            self.Emit(jobId, "finished", returncode=0, record=state["record"], **values)
+        elif waiter in done:
+            self.Emit(jobId, "failed", returncode=process.returncode, tail=list(state["tail"]), **values)
+        elif watcher in done:
+            self.Emit(jobId, "memory", limit=memoryLimit, rss=watcher.result(), tail=list(state["tail"]), **values)
+        else:
+            self.Emit(jobId, "timeout", limit=timeout, tail=list(state["tail"]), **values)
+
+    async def ReadOutput(self, jobId, stream, state):
+        lastPercent = None
+        while True:
+            try:
+                raw = await stream.readline()
+            except (ValueError, asyncio.LimitOverrunError):
+                # a line longer than the stream limit, its part in the buffer is dropped
+                state["tail"].append("(line too long)")
+                continue
+            if not raw:
+                break
+            line = raw.decode("utf-8", errors="replace").rstrip()
+            state["tail"].append(line)
+            if line.startswith(meshprofile.REPORT_PREFIX):
+                record = ParseJson(line[len(meshprofile.REPORT_PREFIX):])
+                if record is not None:
+                    state["record"] = record
+                continue
+            event = ParseLine(line)
+            if event is None:
+                continue
+            # gmsh prints the same percentage for many entities
+            if event["event"] == "progress":
+                if event["percent"] == lastPercent:
+                    continue
+                lastPercent = event["percent"]
+            self.Emit(jobId, event.pop("event"), **event)
+
+    # returns the RSS when it is above the limit [GB], None when the process has ended
+    async def WatchMemory(self, process, memoryLimit, state):
+        while process.returncode is None:
+            try:
+                rss = TreeRss(process.pid)
+            except psutil.NoSuchProcess:
+                return None
+            state["peakRss"] = max(state["peakRss"], rss)
+            if memoryLimit and rss > memoryLimit * 1e9:
+                return rss
+            await asyncio.sleep(MEMORY_INTERVAL)
+        return None
+# ===============================================
+
+
+# ===============================================
+# one line of the protocol, returns False to stop
+def HandleLine(runner, line):
+    line = line.strip()
+    if not line:
+        return True
+    try:
+        request = json.loads(line)
+    except json.JSONDecodeError as e:
+        runner.Emit(None, "failed", error=f"invalid request: {e}")
+        return True
+    if request.get("command") == "shutdown":
+        return False
+    if request.get("command") == "cancel":
+        runner.Cancel(request.get("id"))
+        return True
+    runner.Submit(request)
+    return True
+
+
+# stdin/stdout mode, stdin is read in a thread (works with every event loop)
+async def ServeStdio(runner):
+    loop = asyncio.get_running_loop()
+    while True:
+        line = await loop.run_in_executor(None, sys.stdin.readline)
+        if not line or not HandleLine(runner, line):
+            break
+    await runner.Wait()
+
+
+# local TCP mode, the events go to every connected client
+async def ServeTcp(runner, port, clients):
+    stopped = asyncio.Event()
+
+    async def Handle(reader, writer):
+        clients.add(writer)
+        try:
+            async for raw in reader:
+                if not HandleLine(runner, raw.decode("utf-8")):
+                    stopped.set()
+                    break
+        finally:
+            clients.discard(writer)
+            writer.close()
+
+    server = await asyncio.start_server(Handle, "127.0.0.1", port)
+    print(f"meshrunner listening on 127.0.0.1:{server.sockets[0].getsockname()[1]}", file=sys.stderr, flush=True)
+    async with server:
+        await stopped.wait()
+    await runner.Wait()
+
+
+async def Main(args):
+    clients = set()
+
+    def Emit(event):
+        line = json.dumps(event) + "\n"
+        if args.port is None:
+            sys.stdout.write(line)
+            sys.stdout.flush()
+        for writer in list(clients):
+            writer.write(line.encode("utf-8"))
+
+    runner = MeshRunner(args.slots, Emit, args.timeout, args.memory_limit)
+    try:
+        if args.manifest:
+            with open(args.manifest) as f:
+                jobs = json.load(f)
+            for job in jobs["jobs"] if isinstance(jobs, dict) else jobs:
+                runner.Submit(job)
+            await runner.Wait()
+        elif args.port is None:
+            await ServeStdio(runner)
+        else:
+            await ServeTcp(runner, args.port, clients)
+    except asyncio.CancelledError:
+        # Ctrl+C: no mesh keeps running after the runner
+        runner.CancelAll()
+        await runner.Wait()
+        raise
+    runner.Emit(None, "shutdown", jobs=len(runner.tasks))
+# ===============================================
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="run meshing jobs as subprocesses with progress events, limits and cancellation")
+    parser.add_argument("manifest", nargs="?", default=None, help="job list (*.json), run it and stop")
+    parser.add_argument("--slots", type=int, default=max(1, (os.cpu_count() or 1) // 4), help="jobs running at the same time")
+    parser.add_argument("--port", type=int, default=None, help="listen on 127.0.0.1:PORT instead of stdin/stdout")
+    parser.add_argument("--timeout", type=float, default=None, help="default wall time limit of a job [s]")
+    parser.add_argument("--memory-limit", type=float, default=None, help="default RSS limit of a job [GB]")
+    args = parser.parse_args()
+    try:
+        asyncio.run(Main(args))
+    except KeyboardInterrupt:
+        sys.exit(130)
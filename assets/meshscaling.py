@@ -0,0 +1,348 @@
+# *************************************************************
+# Scaling benchmark of the meshing scripts on synthetic vessels.
+# benchmark.py only meshes the shipped data/ geometries. This script
+# generates the vessel of vesselgen.py (--shape or --spec) and meshes it
+# with makemesh.py (outer) and makemesh_inner.py (inner), for every
+# target element count of --elements and every thread count of --threads.
+# The meshSize of a target is estimated from the volume of the vessel,
+# elements ~ constant * volume / meshSize^3. The constant is measured
+# again after every run of a case, so the larger targets are hit closely.
+# The STL is generated with edges of --surface-factor * meshSize,
+# so the surface grows with the mesh like a finer patient model.
+# Every run is its own process. A run is killed at --timeout or when the
+# RSS of the process and its children passes --memory-limit, and the
+# larger targets of that case and thread count are then skipped.
+# Printed for every case and thread count:
+#   the exponent of time and memory between two sizes (1 = linear)
+#   the first size where the time exponent passes --max-exponent or a run fails
+#   the speed-up over the smallest thread count
+# output : <out>/scaling.csv, <out>/scaling.checkpoint.jsonl (the same command again only runs what is missing)
+#          --plot scaling.png: run time and peak RSS against the element count
+#
+# usage  : python meshscaling.py --shape mixed --elements 1e4,1e5,1e6,1e7 --threads 1,4,16
+#                 --timeout 7200 --memory-limit 32 --plot scaling.png
+#          other flags (--algorithm3d hxt, --optimize gated, ...) are passed to the meshing scripts
+# *************************************************************
+
+import argparse
+import csv
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+
+import psutil
+
+import benchmark
+import meshbatch
+import meshrunner
+import meshsweep
+import surfaceio
+import vesselgen
+
+# case -> meshing script
+CASES = {"outer": "makemesh.py", "inner": "makemesh_inner.py"}
+# first estimate of elements * meshSize^3 / volume (measured on the "mixed" vessel at meshSize 0.8)
+ELEMENTS_CONSTANT = {"outer": 17.0, "inner": 22.0}
+# rows of these states are results, the others are run again
+FINAL_STATES = ("ok", "timeout", "memory")
+COLUMNS = ["id", "case", "target", "threads", "meshSize", "surfaceTriangles", "status", "nodes", "elements",
+           "wall", "importWall", "meshingWall", "peakRss", "elementsPerSecond", "bytesPerElement", "error"]
+
+
+# ===============================================
+# geometry
+def RunId(case, target, threads):
+    return f"{case}_e{target:g}_t{threads}"
+
+
+def MeshSizeFor(constant, volume, target):
+    return (constant * volume / target) ** (1.0 / 3.0)
+
+
+# the vessel for one meshSize, generated once and reused by every case and thread count
+def VesselFor(spec, meshSize, surfaceFactor, outDir):
+    stl = os.path.join(outDir, f"vessel_h{meshSize:.4g}.stl")
+    if os.path.exists(stl):
+        return stl, len(surfaceio.ReadStl(stl))
+    vessel = vesselgen.GenerateVessel(spec, edgeLength=surfaceFactor * meshSize)
+    vesselgen.WriteVessel(vessel, stl)
+    return stl, len(vessel["triangles"])
+# ===============================================
+
+
+# ===============================================
+# one run, with the limits of time and memory
+# returns (status, peak RSS of the process tree [byte], wall [s])
+def RunLimited(command, cwd, logPath, timeout=None, memoryLimit=None):
+    start = time.perf_counter()
+    peakRss = 0
+    with open(logPath, "w") as log:
+        process = subprocess.Popen(command, cwd=cwd, stdout=log, stderr=subprocess.STDOUT)
+        status = None
+        while process.poll() is None:
+            try:
+                rss = meshrunner.TreeRss(process.pid)
+            except psutil.NoSuchProcess:
+                rss = 0
+            peakRss = max(peakRss, rss)
+            if memoryLimit and rss > memoryLimit * 1e9:
+                status = "memory"
+            elif timeout and time.perf_counter() - start > timeout:
+                status = "timeout"
+            if status:
+                KillProcessTree(process)
+                break
+            time.sleep(meshrunner.MEMORY_INTERVAL)
+    wall = time.perf_counter() - start
+    if status is None:
+        status = "ok" if process.returncode == 0 else "error"
+    return status, peakRss, wall
+
+
+def KillProcessTree(process):
+    try:
+        children = psutil.Process(process.pid).children(recursive=True)
+    except psutil.NoSuchProcess:
+        children = []
+    for child in children:
+        try:
+            child.kill()
+        except psutil.NoSuchProcess:
+            pass
+    process.kill()
+    process.wait()
+
+
+def RunCase(case, target, threads, meshSize, stl, surfaceTriangles, outDir, extraArgs, timeout, memoryLimit):
+    runId = RunId(case, target, threads)
+    row = {"id": runId, "case": case, "target": target, "threads": threads, "meshSize": meshSize,
+           "surfaceTriangles": surfaceTriangles}
+    msh = os.path.join(outDir, runId + ".msh")
+    vtk = os.path.join(outDir, runId + ".vtk")
+    reportPath = os.path.join(outDir, runId + ".json")
+    command = benchmark.CaseCommand(CASES[case], stl, msh, vtk, meshSize, reportPath, extraArgs + ["--threads", str(threads)])
+    status, peakRss, wall = RunLimited(command, outDir, os.path.join(outDir, runId + ".log"), timeout, memoryLimit)
+    row.update(status=status, wall=wall, peakRss=peakRss)
+    if status != "ok":
+        row["error"] = {"timeout": f"killed after {timeout} s", "memory": f"killed above {memoryLimit} GB"}.get(
+            status, f"exit code != 0, see {runId}.log")
+        return row
+
+    with open(reportPath) as f:
+        record = json.load(f)
+    phases = {phase["name"]: phase["wall"] for phase in record.get("phases", [])}
+    elements = record.get("gmshElements") or 0
+    row.update(
+        nodes=record.get("gmshNodes"),
+        elements=elements,
+        wall=record["total"]["wall"],
+        importWall=phases.get("ImportStl"),
+        meshingWall=phases.get("Meshing"),
+        peakRss=max(peakRss, record["total"]["peakRss"]),
+    )
+    row["elementsPerSecond"] = elements / row["wall"] if row["wall"] > 0 else 0.0
+    row["bytesPerElement"] = row["peakRss"] / elements if elements else None
+    # the mesh files of the large targets fill the disk, the record is kept
+    for path in (record.get("outputs") or {"msh": msh, "vtk": vtk}).values():
+        if path and os.path.exists(path):
+            os.remove(path)
+    return row
+# ===============================================
+
+
+# ===============================================
+# rows of the runs already finished, also the ones killed at a limit
+# (see meshsweep.ReadResults)
+def ReadResults(checkpointPath):
+    rows = {}
+    if not os.path.exists(checkpointPath):
+        return rows
+    with open(checkpointPath) as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if row.get("status") in FINAL_STATES:
+                rows[row["id"]] = row
+    return rows
+
+
+# all cases, targets and thread counts
+# the targets of a case run from small to large, a run that hits a limit
+# skips the larger targets of its case and thread count
+def RunScaling(spec, cases, targets, threadCounts, outDir, extraArgs, surfaceFactor=1.0, timeout=None, memoryLimit=None):
+    os.makedirs(outDir, exist_ok=True)
+    checkpointPath = os.path.join(outDir, "scaling.checkpoint.jsonl")
+    done = ReadResults(checkpointPath)
+    # the volume converges long before the resolution of the benchmark
+    volume = vesselgen.GenerateVessel(spec, triangles=20000)["volume"]
+    print(f"vessel volume {volume:.4g}, {len(cases) * len(targets) * len(threadCounts)} runs, {len(done)} already done")
+
+    rows = []
+    with open(checkpointPath, "a") as checkpointFile:
+        for case in cases:
+            constant = ELEMENTS_CONSTANT[case]
+            stopped = {}
+            for target in sorted(targets):
+                previous = [done[RunId(case, target, t)] for t in threadCounts if RunId(case, target, t) in done]
+                # every thread count of a target meshes the same vessel with the same meshSize
+                meshSize = previous[0]["meshSize"] if previous else MeshSizeFor(constant, volume, target)
+                stl = None
+                for threads in threadCounts:
+                    runId = RunId(case, target, threads)
+                    if runId in done:
+                        row = done[runId]
+                    elif threads in stopped:
+                        row = {"id": runId, "case": case, "target": target, "threads": threads, "meshSize": meshSize,
+                               "status": "skipped", "error": f"{stopped[threads]} at a smaller target"}
+                    else:
+                        if stl is None:
+                            stl, surfaceTriangles = VesselFor(spec, meshSize, surfaceFactor, outDir)
+                        row = RunCase(case, target, threads, meshSize, stl, surfaceTriangles, outDir, extraArgs,
+                                      timeout, memoryLimit)
+                        meshbatch.AppendCheckpoint(checkpointFile, row)
+                    PrintRow(row)
+                    if row["status"] != "ok":
+                        stopped.setdefault(threads, row["status"])
+                    elif row["elements"]:
+                        constant = row["elements"] * row["meshSize"] ** 3 / volume
+                    rows.append(row)
+    return rows
+
+
+def PrintRow(row):
+    if row["status"] == "ok":
+        print(f"{row['id']}: meshSize {row['meshSize']:.4g}, {row['surfaceTriangles']} surface triangles, "
+              f"{row['elements']} elements, {row['wall']:.1f} s, {row['peakRss'] / 2**30:.2f} GiB peak")
+    else:
+        print(f"{row['id']}: {row['status']} ({row.get('error')})", file=sys.stderr)
+# ===============================================
+
+
+# ===============================================
+# exponents between neighbouring sizes: time ~ elements^a, memory ~ elements^b
+def ScalingSummary(rows, maxExponent):
+    lines = []
+    groups = sorted({(row["case"], row["threads"]) for row in rows})
+    for case, threads in groups:
+        group = sorted((row for row in rows if row["case"] == case and row["threads"] == threads),
+                       key=lambda row: row["target"])
+        ok = [row for row in group if row["status"] == "ok" and row["elements"]]
+        lines.append(f"{case}, {threads} threads")
+        limit = None
+        for small, large in zip(ok, ok[1:]):
+            ratio = math.log(large["elements"] / small["elements"])
+            if ratio <= 0:
+                continue
+            timeExponent = math.log(large["wall"] / small["wall"]) / ratio
+            memoryExponent = math.log(large["peakRss"] / small["peakRss"]) / ratio
+            lines.append(f"    {small['elements']:>10} -> {large['elements']:>10} elements: "
+                         f"time ^{timeExponent:.2f}, memory ^{memoryExponent:.2f}")
+            if limit is None and timeExponent > maxExponent:
+                limit = f"time grows faster than elements^{maxExponent:g} above {small['elements']} elements"
+        failed = [row for row in group if row["status"] not in ("ok", "skipped")]
+        if failed:
+            limit = limit or f"{failed[0]['status']} at target {failed[0]['target']:g} (meshSize {failed[0]['meshSize']:.4g})"
+        lines.append(f"    {limit or 'scales up to the largest target'}")
+
+    # speed-up of every thread count over the smallest one, same case and target
+    for case in sorted({row["case"] for row in rows}):
+        for target in sorted({row["target"] for row in rows}):
+            same = {row["threads"]: row for row in rows
+                    if row["case"] == case and row["target"] == target and row["status"] == "ok"}
+            if len(same) < 2:
+                continue
+            base = min(same)
+            speedups = ", ".join(f"{threads}: x{same[base]['wall'] / same[threads]['wall']:.2f}"
+                                 for threads in sorted(same) if threads != base)
+            lines.append(f"{case} {target:g}: speed-up over {base} threads {speedups}")
+    return lines
+
+
+def WriteTable(rows, path):
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+# run time and peak RSS against the element count, one line per case and thread count
+# the runs killed at a limit are marked with x at their target
+def PlotScaling(rows, path):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    figure, (timeAxis, memoryAxis) = plt.subplots(1, 2, figsize=(12, 5))
+    for case, threads in sorted({(row["case"], row["threads"]) for row in rows}):
+        group = sorted((row for row in rows if row["case"] == case and row["threads"] == threads),
+                       key=lambda row: row["target"])
+        ok = [row for row in group if row["status"] == "ok" and row["elements"]]
+        label = f"{case}, {threads} threads"
+        if ok:
+            line, = timeAxis.loglog([row["elements"] for row in ok], [row["wall"] for row in ok], "o-", label=label)
+            memoryAxis.loglog([row["elements"] for row in ok], [row["peakRss"] / 2**30 for row in ok], "o-",
+                              color=line.get_color(), label=label)
+            # linear growth from the smallest run
+            first = ok[0]
+            largest = max(row["target"] for row in group)
+            x = [first["elements"], max(largest, ok[-1]["elements"])]
+            timeAxis.loglog(x, [first["wall"] * v / x[0] for v in x], ":", color=line.get_color(), linewidth=0.8)
+            color = line.get_color()
+        else:
+            color = None
+        for row in group:
+            if row["status"] in ("timeout", "memory", "error"):
+                timeAxis.loglog([row["target"]], [row["wall"]], "x", color=color, markersize=10)
+                memoryAxis.loglog([row["target"]], [row["peakRss"] / 2**30], "x", color=color, markersize=10)
+    timeAxis.set_xlabel("elements")
+    timeAxis.set_ylabel("wall time [s]")
+    timeAxis.set_title("run time (dotted: linear)")
+    memoryAxis.set_xlabel("elements")
+    memoryAxis.set_ylabel("peak RSS [GiB]")
+    memoryAxis.set_title("peak memory")
+    for axis in (timeAxis, memoryAxis):
+        axis.grid(True, which="both", linewidth=0.3)
+        axis.legend(fontsize=8)
+    figure.tight_layout()
+    figure.savefig(path, dpi=150)
+    plt.close(figure)
+# ===============================================
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="mesh synthetic vessels of growing size and measure time and memory")
+    parser.add_argument("--shape", choices=sorted(vesselgen.SHAPES), default="mixed")
+    parser.add_argument("--spec", default=None, help="vessel as JSON (see vesselgen.py), overrides --shape")
+    parser.add_argument("--elements", default="1e4,1e5,1e6", help="comma separated target element counts")
+    parser.add_argument("--threads", default="1", help="comma separated thread counts (--threads of the scripts)")
+    parser.add_argument("--cases", nargs="+", choices=sorted(CASES), default=sorted(CASES))
+    parser.add_argument("--surface-factor", type=float, default=1.0, help="STL edge length / meshSize")
+    parser.add_argument("--out", default="scaling", help="folder of the vessels, records and checkpoint")
+    parser.add_argument("--timeout", type=float, default=None, help="wall time limit of one run [s]")
+    parser.add_argument("--memory-limit", type=float, default=None, help="RSS limit of one run [GB]")
+    parser.add_argument("--max-exponent", type=float, default=1.25, help="time ~ elements^a above this counts as not scaling")
+    parser.add_argument("--plot", default=None, help="write the plot to this image (needs matplotlib)")
+    args, extraArgs = parser.parse_known_args()
+    if "-nopopup" not in extraArgs:
+        extraArgs.append("-nopopup")
+
+    spec = vesselgen.LoadSpec(args.shape, args.spec)
+    targets = [int(float(value)) for value in args.elements.split(",") if value.strip()]
+    threadCounts = meshsweep.ParseValues(args.threads, int)
+    outDir = os.path.abspath(args.out)
+    rows = RunScaling(spec, args.cases, targets, threadCounts, outDir, extraArgs, args.surface_factor,
+                      args.timeout, args.memory_limit)
+    tablePath = os.path.join(outDir, "scaling.csv")
+    WriteTable(rows, tablePath)
+    print(f"table written to {tablePath}")
+    print()
+    for line in ScalingSummary(rows, args.max_exponent):
+        print(line)
+    if args.plot:
+        PlotScaling(rows, args.plot)
+        print(f"plot written to {args.plot}")
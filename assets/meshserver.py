@@ -0,0 +1,151 @@
+# *************************************************************
+# Long-lived meshing service for makemesh_inner.py.
+# gmsh is initialized only once and the inner tetra mesh is made
+# for every job that arrives, with gmsh.clear() between jobs.
+# input  : one JSON object per line (stdin, or a local TCP socket)
+#          {"id": 1, "stl": "...", "msh": "...", "vtk": "...", "meshSize": 0.9,
+#           "meshOptions": {"algorithm3d": "hxt", "threads": 8},
+#           "outputOptions": {"msh": "binary", "vtk": "none"},
+#           "sizeField": {"centerline": "...", "factor": 0.3}, "volumeOnly": true,
+#           "qualityOptions": {"optimize": "gated"}, "surfacePrep": {"mode": "repair"}}
+#          {"command": "shutdown"} stops the service
+# output : one JSON object per line for every job
+#          {"id": 1, "status": "ok", "msh": "...", "nodes": ..., "elapsed": ...}
+#
+# usage  : python meshserver.py            (stdin/stdout line protocol)
+#          python meshserver.py --port 50007  (127.0.0.1 only)
+#          the flags of meshoptions.py / meshoutput.py set the defaults of all jobs
+#          --cache-dir DIR reuses the meshes of identical jobs (see meshcache.py)
+# *************************************************************
+
+import argparse
+import json
+import os
+import socketserver
+import sys
+import time
+import traceback
+
+import gmsh
+
+import makemesh_inner
+import meshcache
+import meshoptions
+import meshoutput
+
+# meshSize / meshOptionsが指定されていないジョブで使う値
+DEFAULT_MESH_SIZE = makemesh_inner.meshSize
+defaultMeshOptions = dict(meshoptions.DEFAULT_MESH_OPTIONS)
+defaultOutputOptions = dict(meshoutput.DEFAULT_OUTPUT_OPTIONS)
+# --cache-dir が指定されたときのmeshcache.MeshCache
+meshCache = None
+
+
+# ===============================================
+# handle one job and return the result as a dict
+# a failed job is reported as status "error", the service keeps running
+def RunJob(job):
+    result = {"id": job.get("id")}
+    start = time.perf_counter()
+    try:
+        meshSize = float(job.get("meshSize", DEFAULT_MESH_SIZE))
+        options = dict(defaultMeshOptions)
+        options.update(job.get("meshOptions") or {})
+        outputs = dict(defaultOutputOptions)
+        outputs.update(job.get("outputOptions") or {})
+        # ジョブごとに指定、前のジョブのサイズ場は引き継がない
+        sizeField = job.get("sizeField") or {}
+        quality = job.get("qualityOptions") or {}
+        prep = job.get("surfacePrep") or {}
+        statistics = makemesh_inner.MakeInnerMesh(job["stl"], job["msh"], job["vtk"], meshSize, options, meshCache, outputs, sizeField,
+                                                  bool(job.get("volumeOnly", False)), quality, prep)
+        result.update(status="ok", msh=job["msh"], vtk=job["vtk"], meshSize=meshSize)
+        result.update(statistics)
+    except Exception as e:
+        result.update(status="error", error=f"{type(e).__name__}: {e}", traceback=traceback.format_exc())
+    result["elapsed"] = time.perf_counter() - start
+    return result
+# ===============================================
+
+
+# ===============================================
+# handle one line of the protocol
+# returns (reply, keepRunning)
+def HandleLine(line):
+    line = line.strip()
+    if not line:
+        return None, True
+    try:
+        job = json.loads(line)
+    except json.JSONDecodeError as e:
+        return {"status": "error", "error": f"invalid request: {e}"}, True
+    if job.get("command") == "shutdown":
+        return {"id": job.get("id"), "status": "shutdown"}, False
+    if job.get("command") == "ping":
+        return {"id": job.get("id"), "status": "ok", "gmsh": gmsh.__version__}, True
+    return RunJob(job), True
+# ===============================================
+
+
+# ===============================================
+# stdin/stdout mode
+# gmsh and print() write their log to stdout, so the real stdout is kept only for
+# the protocol and everything else is sent to stderr
+def ServeStdio():
+    protocolOut = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+    sys.stdout.flush()
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    for line in sys.stdin:
+        reply, keepRunning = HandleLine(line)
+        if reply is not None:
+            protocolOut.write(json.dumps(reply) + "\n")
+            protocolOut.flush()
+        if not keepRunning:
+            break
+# ===============================================
+
+
+# ===============================================
+# local TCP mode
+# connections are handled one after another because the gmsh API is process-global
+class MeshJobHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for raw in self.rfile:
+            reply, keepRunning = HandleLine(raw.decode("utf-8"))
+            if reply is not None:
+                self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+                self.wfile.flush()
+            if not keepRunning:
+                self.server.keepRunning = False
+                break
+
+
+def ServeTcp(port):
+    with socketserver.TCPServer(("127.0.0.1", port), MeshJobHandler) as server:
+        server.keepRunning = True
+        print(f"meshserver listening on 127.0.0.1:{server.server_address[1]}", file=sys.stderr, flush=True)
+        while server.keepRunning:
+            server.handle_request()
+# ===============================================
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="long-lived gmsh meshing service for makemesh_inner.py")
+    parser.add_argument("--port", type=int, default=None, help="listen on 127.0.0.1:PORT instead of stdin/stdout")
+    meshoptions.AddMeshOptionArguments(parser)
+    meshcache.AddCacheArguments(parser)
+    meshoutput.AddOutputArguments(parser)
+    args, gmshArgs = parser.parse_known_args()
+    defaultMeshOptions = meshoptions.MeshOptionsFromArgs(args)
+    defaultOutputOptions = meshoutput.OutputOptionsFromArgs(args)
+    meshCache = meshcache.MeshCacheFromArgs(args)
+
+    gmsh.initialize([sys.argv[0]] + gmshArgs)
+    try:
+        if args.port is None:
+            ServeStdio()
+        else:
+            ServeTcp(args.port)
+    finally:
+        gmsh.finalize()
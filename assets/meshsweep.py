@@ -0,0 +1,277 @@
+# *************************************************************
+# Parameter sweep of makemesh.py for mesh-independence studies.
+# Every combination of the meshSize, N, r and h values is meshed by
+# makemesh.py in its own process, --workers of them at the same time.
+# The element counts, the tetra quality, the total thickness of the
+# boundary layers and the run time of every combination go into one
+# table, and the cheapest combination that meets the quality targets
+# (--quality-min, --quality-percentile-min, see meshquality.py) is
+# printed.
+# input  : WALL.stl and the values of every parameter (comma separated)
+# output : <out>/<id>.msh, <id>.vtk, <id>.json (run record) of every combination
+#          <out>/sweep.checkpoint.jsonl with one row per finished combination
+#          the table (*.csv, or *.parquet with pandas)
+#
+# usage  : python meshsweep.py WALL.stl --mesh-size 0.4,0.5,0.7 --layers 3,5 --growth-ratio 1.2
+#                 --first-layer 0.05,0.08 --workers 8 --table sweep.csv
+#          other flags (--algorithm3d, --optimize, -nopopup, ...) are passed to makemesh.py
+#          running the same command again skips the combinations already done
+#          the classified surfaces are shared by all runs through <out>/cache (see meshcache.py)
+# *************************************************************
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import meshbatch
+import meshcache
+import meshquality
+
+ASSETS_DIR = os.path.dirname(os.path.abspath(__file__))
+# parameter -> (flag of makemesh.py, type)
+PARAMETERS = {
+    "meshSize": ("--mesh-size", float),
+    "N": ("--layers", int),
+    "r": ("--growth-ratio", float),
+    "h": ("--first-layer", float),
+}
+# quality option -> flag of meshquality.py, given to every run
+QUALITY_FLAGS = {
+    "optimize": "--optimize",
+    "measure": "--quality-measure",
+    "minimum": "--quality-min",
+    "percentile": "--quality-percentile",
+    "percentileMinimum": "--quality-percentile-min",
+    "chain": "--optimize-chain",
+    "budget": "--optimize-budget",
+    "tolerance": "--optimize-tolerance",
+}
+COLUMNS = ["id", "meshSize", "N", "r", "h", "blThickness", "status", "nodes", "elements", "tetrahedra",
+           "qualityMin", "qualityPercentile", "qualityMean", "meetsTargets", "wall", "meshingWall", "peakRss",
+           "cache", "geometryCache", "msh", "error"]
+
+
+# ===============================================
+# combinations
+# "0.5,0.7" -> [0.5, 0.7]
+def ParseValues(text, kind):
+    return [kind(value) for value in str(text).split(",") if value.strip()]
+
+
+# total thickness of the N layers, h * (1 + r + ... + r^(N-1)) (see ShapeCreation() of makemesh.py)
+def BoundaryLayerThickness(N, r, h):
+    return sum(h * r ** i for i in range(N))
+
+
+def ConfigurationId(configuration):
+    return "ms{meshSize:g}_N{N}_r{r:g}_h{h:g}".format(**configuration)
+
+
+# every combination of the grid ({parameter: [values]})
+def Configurations(grid):
+    configurations = []
+    for values in itertools.product(*(grid[name] for name in PARAMETERS)):
+        configuration = dict(zip(PARAMETERS, values))
+        configuration["id"] = ConfigurationId(configuration)
+        configuration["blThickness"] = BoundaryLayerThickness(configuration["N"], configuration["r"], configuration["h"])
+        configurations.append(configuration)
+    return configurations
+
+
+def QualityArguments(options):
+    arguments = []
+    for key, flag in QUALITY_FLAGS.items():
+        arguments += [flag, str(options[key])]
+    return arguments
+# ===============================================
+
+
+# ===============================================
+# one combination
+# makemesh.py runs in its own process, a crash of gmsh only fails this row
+def RunConfiguration(configuration, stl, outDir, extraArgs, timeout=None):
+    row = dict(configuration)
+    msh = os.path.join(outDir, configuration["id"] + ".msh")
+    vtk = os.path.join(outDir, configuration["id"] + ".vtk")
+    reportPath = os.path.join(outDir, configuration["id"] + ".json")
+    command = [sys.executable, os.path.join(ASSETS_DIR, "makemesh.py"), "--stl", stl, "--msh", msh, "--vtk", vtk,
+               "--report", reportPath]
+    for name, (flag, _) in PARAMETERS.items():
+        command += [flag, str(configuration[name])]
+    command += extraArgs
+    start = time.perf_counter()
+    try:
+        completed = subprocess.run(command, cwd=outDir, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                   text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        row.update(status="error", error=f"timeout after {timeout} s", wall=time.perf_counter() - start)
+        return row
+    if completed.returncode != 0:
+        row.update(status="error", error=completed.stderr.strip()[-2000:], wall=time.perf_counter() - start)
+        return row
+
+    with open(reportPath) as f:
+        record = json.load(f)
+    after = (record.get("quality") or {}).get("after") or {}
+    phases = {phase["name"]: phase["wall"] for phase in record.get("phases", [])}
+    row.update(
+        status="ok",
+        nodes=record.get("gmshNodes"),
+        elements=record.get("gmshElements"),
+        tetrahedra=after.get("tetrahedra"),
+        qualityMin=after.get("min"),
+        qualityPercentile=after.get("percentile"),
+        qualityMean=after.get("mean"),
+        # the time of the run that made the mesh, also when it came from the cache
+        wall=record["total"]["wall"],
+        meshingWall=phases.get("Meshing"),
+        peakRss=record["total"]["peakRss"],
+        cache=record.get("cache"),
+        geometryCache=(record.get("geometry") or {}).get("cache"),
+        msh=(record.get("outputs") or {}).get("msh", msh),
+    )
+    return row
+
+
+# a row meets the targets if the tetra quality after the optimization reaches them
+def MeetsTargets(row, qualityOptions):
+    if row.get("status") != "ok" or row.get("qualityMin") is None:
+        return False
+    quality = {"tetrahedra": row["tetrahedra"], "min": row["qualityMin"], "percentile": row["qualityPercentile"]}
+    return meshquality.MeetsTargets(quality, qualityOptions)
+# ===============================================
+
+
+# ===============================================
+# rows of the combinations already finished successfully
+# a line cut off by an interrupted run is ignored
+def ReadResults(checkpointPath):
+    rows = {}
+    if not os.path.exists(checkpointPath):
+        return rows
+    with open(checkpointPath) as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if row.get("status") == "ok":
+                rows[row["id"]] = row
+    return rows
+
+
+# makemesh.py classifies the STL once per classify angle and surface preparation, which the
+# extra flags set for all runs; only the decimation target follows meshSize
+def ClassifyKey(configuration, extraArgs):
+    decimate = "decimate" in extraArgs or "--surface-prep=decimate" in extraArgs
+    return configuration["meshSize"] if decimate else None
+
+
+# run all combinations not yet in the checkpoint
+# the workers are threads that only wait for their makemesh.py process
+# one combination per classify key runs first and fills the geometry cache in <out>/cache,
+# otherwise all workers would start together, miss the cache and classify the same STL
+# returns the rows of all combinations in the order of the grid
+def RunSweep(configurations, stl, outDir, workers, extraArgs, timeout=None):
+    os.makedirs(outDir, exist_ok=True)
+    checkpointPath = os.path.join(outDir, "sweep.checkpoint.jsonl")
+    rows = ReadResults(checkpointPath)
+    pending = [configuration for configuration in configurations if configuration["id"] not in rows]
+    print(f"{len(configurations)} combinations, {len(configurations) - len(pending)} already done, "
+          f"{len(pending)} to run with {workers} workers")
+    first = {}
+    for configuration in pending:
+        first.setdefault(ClassifyKey(configuration, extraArgs), configuration)
+    warm = list(first.values())
+    rest = [configuration for configuration in pending if configuration not in warm]
+
+    finished = 0
+    with open(checkpointPath, "a") as checkpointFile:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for stage in (warm, rest):
+                futures = [pool.submit(RunConfiguration, configuration, stl, outDir, extraArgs, timeout)
+                           for configuration in stage]
+                for future in as_completed(futures):
+                    finished += 1
+                    row = future.result()
+                    rows[row["id"]] = row
+                    meshbatch.AppendCheckpoint(checkpointFile, row)
+                    if row["status"] == "ok":
+                        print(f"[{finished}/{len(pending)}] {row['id']}: {row['elements']} elements, "
+                              f"min quality {row['qualityMin']:.3f}, {row['wall']:.1f} s")
+                    else:
+                        print(f"[{finished}/{len(pending)}] {row['id']} failed: {row['error']}", file=sys.stderr)
+    return [rows[configuration["id"]] for configuration in configurations]
+
+
+# the cheapest row that meets the targets, None if no row does
+# cost "elements" is the size of the CFD problem, "wall" the meshing time
+def Cheapest(rows, cost="elements"):
+    candidates = [row for row in rows if row.get("meetsTargets")]
+    if not candidates:
+        return None
+    if cost == "wall":
+        return min(candidates, key=lambda row: (row["wall"], row["elements"]))
+    return min(candidates, key=lambda row: (row["elements"], row["wall"]))
+
+
+def WriteTable(rows, path):
+    if path.lower().endswith(".parquet"):
+        # pandas (and pyarrow) are only needed for Parquet
+        import pandas
+        pandas.DataFrame(rows, columns=COLUMNS).to_parquet(path, index=False)
+        return
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+# ===============================================
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="mesh every combination of meshSize, N, r, h with makemesh.py")
+    parser.add_argument("stl", help="input surface (WALL.stl)")
+    parser.add_argument("--mesh-size", default="0.5", help="comma separated values of meshSize")
+    parser.add_argument("--layers", default="5", help="comma separated values of N")
+    parser.add_argument("--growth-ratio", default="1.2", help="comma separated values of r")
+    parser.add_argument("--first-layer", default="0.08", help="comma separated values of h")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="combinations meshed at the same time")
+    parser.add_argument("--out", default="sweep", help="folder of the meshes, records and checkpoint")
+    parser.add_argument("--table", default=None, help="result table, *.csv or *.parquet (default: <out>/sweep.csv)")
+    parser.add_argument("--cost", choices=("elements", "wall"), default="elements", help="what 'cheapest' minimizes")
+    parser.add_argument("--timeout", type=float, default=None, help="wall time limit of one run [s]")
+    meshquality.AddQualityArguments(parser)
+    meshcache.AddCacheArguments(parser)
+    args, extraArgs = parser.parse_known_args()
+
+    grid = {}
+    for name, text in (("meshSize", args.mesh_size), ("N", args.layers), ("r", args.growth_ratio), ("h", args.first_layer)):
+        grid[name] = ParseValues(text, PARAMETERS[name][1])
+    qualityOptions = meshquality.QualityOptionsFromArgs(args)
+    outDir = os.path.abspath(args.out)
+    cacheDir = os.path.abspath(args.cache_dir) if args.cache_dir else os.path.join(outDir, "cache")
+    extraArgs = QualityArguments(qualityOptions) + ["--cache-dir", cacheDir, "--cache-budget", str(args.cache_budget)] + extraArgs
+    if "-nopopup" not in extraArgs:
+        extraArgs.append("-nopopup")
+
+    rows = RunSweep(Configurations(grid), os.path.abspath(args.stl), outDir, args.workers, extraArgs, args.timeout)
+    for row in rows:
+        row["meetsTargets"] = MeetsTargets(row, qualityOptions)
+    tablePath = args.table or os.path.join(outDir, "sweep.csv")
+    WriteTable(rows, tablePath)
+    print(f"table written to {tablePath}")
+
+    best = Cheapest(rows, args.cost)
+    if best is None:
+        print(f"no combination meets min >= {qualityOptions['minimum']} and "
+              f"p{qualityOptions['percentile']:g} >= {qualityOptions['percentileMinimum']}")
+        sys.exit(1)
+    print(f"cheapest combination meeting the targets: {best['id']} "
+          f"(meshSize {best['meshSize']:g}, N {best['N']}, r {best['r']:g}, h {best['h']:g}, "
+          f"BL thickness {best['blThickness']:.3f}), {best['elements']} elements, {best['wall']:.1f} s")
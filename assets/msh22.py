@@ -0,0 +1,393 @@
+# *************************************************************
+# MSH 2.2 meshes (ASCII and binary) as NumPy arrays, for the tools that
+# work on the *.msh files without gmsh (deformation, merge, ...).
+# The sections are parsed in bulk: the ASCII numbers with one np.fromstring
+# call per section, the binary blocks with np.frombuffer, so no Python
+# loop runs over the nodes or elements. Writing is done in chunks of
+# formatted text (ASCII) or raw blocks (binary).
+# mesh (dict):
+#   physicalNames    list of (dim, tag, name)
+#   nodeTags         (n,)    int64    node numbers of the file
+#   nodes            (n, 3)  float64  coordinates, row i belongs to nodeTags[i]
+#   elementTags      (m,)    int64    element numbers of the file
+#   elementTypes     (m,)    int32    gmsh element type (2 triangle, 3 quadrangle, 4 tetra, 6 prism, ...)
+#   elementPhysical  (m,)    int32    first tag  (physical group)
+#   elementEntity    (m,)    int32    second tag (elementary entity)
+#   elementOffsets   (m + 1,) int64   elementNodes[elementOffsets[i]:elementOffsets[i + 1]]
+#   elementNodes     (k,)    int64    node tags of all elements, one after another
+# only if an element has more than 2 tags (partitions of PartitionOldStyleMsh2):
+#   elementExtraOffsets (m + 1,) int64  elementExtraTags[elementExtraOffsets[i]:elementExtraOffsets[i + 1]]
+#   elementExtraTags    (j,)    int64   the tags after the second one
+# the order of the nodes and elements of the file is kept
+# write -> read gives the same arrays again (coordinates are written with
+# repr in ASCII, as raw doubles in binary)
+# *.msh.gz files are read and written through gzip
+# *************************************************************
+
+import gzip
+
+import numpy as np
+
+# gmsh element type -> number of nodes
+NODES_PER_TYPE = {
+    1: 2,    # line
+    2: 3,    # triangle
+    3: 4,    # quadrangle
+    4: 4,    # tetrahedron
+    5: 8,    # hexahedron
+    6: 6,    # prism
+    7: 5,    # pyramid
+    8: 3,    # second order line
+    9: 6,    # second order triangle
+    10: 9,   # second order quadrangle
+    11: 10,  # second order tetrahedron
+    12: 27,  # second order hexahedron
+    13: 18,  # second order prism
+    14: 14,  # second order pyramid
+    15: 1,   # point
+    16: 8,   # second order quadrangle (8 nodes)
+    17: 20,  # second order hexahedron (20 nodes)
+    18: 15,  # second order prism (15 nodes)
+    19: 13,  # second order pyramid (13 nodes)
+}
+
+# rows formatted / written at a time
+CHUNK_ROWS = 200_000
+
+
+# ===============================================
+def OpenMsh(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+# the next line starting at position: (text without the line end, position after it)
+def NextLine(data, position):
+    end = data.find(b"\n", position)
+    if end < 0:
+        end = len(data)
+    return data[position:end].decode("ascii").strip(), end + 1
+
+
+# position after "$End<name>" and its line end
+def SkipEnd(data, position, name):
+    end = data.find(b"$End" + name.encode("ascii"), position)
+    if end < 0:
+        raise ValueError(f"section ${name} is not closed")
+    return NextLine(data, end)[1]
+# ===============================================
+
+
+# ===============================================
+# ASCII $Nodes: one float parse of the whole section
+def ParseAsciiNodes(data, position, count):
+    end = data.find(b"$EndNodes", position)
+    table = np.fromstring(data[position:end].decode("ascii"), dtype=np.float64, sep=" ")
+    if len(table) != 4 * count:
+        raise ValueError(f"$Nodes has {len(table) / 4:g} rows, {count} expected")
+    table = table.reshape(-1, 4)
+    return table[:, 0].astype(np.int64), np.ascontiguousarray(table[:, 1:]), end
+
+
+# ASCII $Elements: one integer parse of the whole section
+# the first number of every line is found from the token starts, so lines
+# of different length (element types, number of tags) need no Python loop
+def ParseAsciiElements(data, position, count):
+    end = data.find(b"$EndElements", position)
+    text = data[position:end]
+    values = np.fromstring(text.decode("ascii"), dtype=np.int64, sep=" ")
+
+    raw = np.frombuffer(text, dtype=np.uint8)
+    space = raw <= 32
+    tokenStart = np.flatnonzero(~space & np.concatenate([[True], space[:-1]]))
+    lineStart = np.concatenate([[0], np.flatnonzero(raw == 10) + 1])
+    # token index of the first token of every line, empty lines removed
+    first = np.searchsorted(tokenStart, lineStart)
+    first = first[(np.diff(first, append=-1) != 0) & (first < len(tokenStart))]
+    if len(first) != count or len(values) != len(tokenStart):
+        raise ValueError(f"$Elements has {len(first)} lines, {count} expected")
+    last = np.append(first[1:], len(values))
+
+    numTags = values[first + 2]
+    nodeStart = first + 3 + numTags
+    counts = last - nodeStart
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    elements = {
+        "elementTags": values[first],
+        "elementTypes": values[first + 1].astype(np.int32),
+        "elementPhysical": np.where(numTags > 0, values[np.minimum(first + 3, len(values) - 1)], 0).astype(np.int32),
+        "elementEntity": np.where(numTags > 1, values[np.minimum(first + 4, len(values) - 1)], 0).astype(np.int32),
+        "elementOffsets": offsets.astype(np.int64),
+        "elementNodes": values[Gather(nodeStart, counts)],
+    }
+    extraCounts = np.maximum(numTags - 2, 0)
+    if np.any(extraCounts):
+        elements["elementExtraOffsets"] = np.concatenate([[0], np.cumsum(extraCounts)]).astype(np.int64)
+        elements["elementExtraTags"] = values[Gather(first + 5, extraCounts)]
+    return elements, end
+
+
+# indices start[i], ..., start[i] + counts[i] - 1 of all rows, one after another
+def Gather(start, counts):
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    return np.repeat(start - offsets[:-1], counts) + np.arange(offsets[-1])
+# ===============================================
+
+
+# ===============================================
+# binary $Nodes: (int tag, 3 doubles) per node
+def ParseBinaryNodes(data, position, count, endian):
+    rowType = np.dtype([("tag", endian + "i4"), ("xyz", endian + "f8", 3)])
+    table = np.frombuffer(data, dtype=rowType, count=count, offset=position)
+    return table["tag"].astype(np.int64), table["xyz"].astype(np.float64), position + count * rowType.itemsize
+
+
+# binary $Elements: blocks of (type, number of elements, number of tags)
+# followed by (tag, tags..., nodes...) int rows
+def ParseBinaryElements(data, position, count, endian):
+    intType = np.dtype(endian + "i4")
+    tags, types, physical, entity, nodes, counts, extra, extraCounts = [], [], [], [], [], [], [], []
+    done = 0
+    while done < count:
+        elementType, numElements, numTags = np.frombuffer(data, dtype=intType, count=3, offset=position)
+        position += 3 * intType.itemsize
+        numNodes = NODES_PER_TYPE[int(elementType)]
+        width = 1 + numTags + numNodes
+        block = np.frombuffer(data, dtype=intType, count=numElements * width, offset=position).reshape(-1, width)
+        position += block.nbytes
+        tags.append(block[:, 0])
+        types.append(np.full(numElements, elementType, dtype=np.int32))
+        physical.append(block[:, 1] if numTags > 0 else np.zeros(numElements, dtype=np.int32))
+        entity.append(block[:, 2] if numTags > 1 else np.zeros(numElements, dtype=np.int32))
+        nodes.append(block[:, 1 + numTags:].ravel())
+        counts.append(np.full(numElements, numNodes, dtype=np.int64))
+        extra.append(block[:, 3:1 + numTags].ravel())
+        extraCounts.append(np.full(numElements, max(int(numTags) - 2, 0), dtype=np.int64))
+        done += int(numElements)
+    counts = np.concatenate(counts) if counts else np.zeros(0, dtype=np.int64)
+    elements = {
+        "elementTags": np.concatenate(tags).astype(np.int64) if tags else np.zeros(0, dtype=np.int64),
+        "elementTypes": np.concatenate(types) if types else np.zeros(0, dtype=np.int32),
+        "elementPhysical": np.concatenate(physical).astype(np.int32) if tags else np.zeros(0, dtype=np.int32),
+        "elementEntity": np.concatenate(entity).astype(np.int32) if tags else np.zeros(0, dtype=np.int32),
+        "elementOffsets": np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+        "elementNodes": np.concatenate(nodes).astype(np.int64) if nodes else np.zeros(0, dtype=np.int64),
+    }
+    if any(len(tags) for tags in extra):
+        elements["elementExtraOffsets"] = np.concatenate([[0], np.cumsum(np.concatenate(extraCounts))]).astype(np.int64)
+        elements["elementExtraTags"] = np.concatenate(extra).astype(np.int64)
+    return elements, position
+# ===============================================
+
+
+# ===============================================
+def ReadMsh22(path):
+    with OpenMsh(path, "rb") as f:
+        data = f.read()
+    mesh = {"physicalNames": []}
+    binary = False
+    endian = "<"
+    position = 0
+    while True:
+        line, position = NextLine(data, position)
+        if position > len(data) and not line:
+            break
+        if not line.startswith("$"):
+            continue
+        name = line[1:]
+        if name == "MeshFormat":
+            version, position = NextLine(data, position)
+            version = version.split()
+            if not version[0].startswith("2"):
+                raise ValueError(f"{path} is MSH {version[0]}, not MSH 2.2")
+            binary = version[1] == "1"
+            if binary:
+                # the number 1 written as int shows the byte order
+                one = np.frombuffer(data, dtype="<i4", count=1, offset=position)[0]
+                endian = "<" if one == 1 else ">"
+                position += 4
+            position = SkipEnd(data, position, name)
+        elif name == "PhysicalNames":
+            count, position = NextLine(data, position)
+            for _ in range(int(count)):
+                line, position = NextLine(data, position)
+                dim, tag, physicalName = line.split(maxsplit=2)
+                mesh["physicalNames"].append((int(dim), int(tag), physicalName.strip('"')))
+            position = SkipEnd(data, position, name)
+        elif name == "Nodes":
+            count, position = NextLine(data, position)
+            parse = ParseBinaryNodes if binary else ParseAsciiNodes
+            arguments = (endian,) if binary else ()
+            mesh["nodeTags"], mesh["nodes"], position = parse(data, position, int(count), *arguments)
+            position = SkipEnd(data, position, name)
+        elif name == "Elements":
+            count, position = NextLine(data, position)
+            parse = ParseBinaryElements if binary else ParseAsciiElements
+            arguments = (endian,) if binary else ()
+            elements, position = parse(data, position, int(count), *arguments)
+            mesh.update(elements)
+            position = SkipEnd(data, position, name)
+        else:
+            # $NodeData, $Periodic, ... are not used
+            position = SkipEnd(data, position, name)
+    if "nodes" not in mesh or "elementTags" not in mesh:
+        raise ValueError(f"{path} has no $Nodes or $Elements")
+    return mesh
+# ===============================================
+
+
+# ===============================================
+# runs of consecutive elements with the same type and number of tags: (first, last + 1, type, number of extra tags)
+def TypeRuns(mesh):
+    elementTypes = mesh["elementTypes"]
+    if len(elementTypes) == 0:
+        return []
+    extraCounts = ExtraCounts(mesh)
+    change = np.flatnonzero((elementTypes[1:] != elementTypes[:-1]) | (extraCounts[1:] != extraCounts[:-1])) + 1
+    starts = np.concatenate([[0], change])
+    ends = np.append(change, len(elementTypes))
+    return list(zip(starts.tolist(), ends.tolist(), elementTypes[starts].tolist(), extraCounts[starts].tolist()))
+
+
+# number of tags after the second one of every element
+def ExtraCounts(mesh):
+    if "elementExtraOffsets" not in mesh:
+        return np.zeros(len(mesh["elementTypes"]), dtype=np.int64)
+    return np.diff(mesh["elementExtraOffsets"])
+
+
+# (tag, physical, entity, extra tags..., nodes...) rows of the elements first:last of one run
+def ElementRows(mesh, first, last, numNodes, numExtra=0):
+    columns = mesh["elementOffsets"][first:last, None] + np.arange(numNodes)
+    extraColumns = mesh["elementExtraOffsets"][first:last, None] + np.arange(numExtra) if numExtra else None
+    return np.column_stack([mesh["elementTags"][first:last], mesh["elementPhysical"][first:last],
+                            mesh["elementEntity"][first:last]]
+                           + ([mesh["elementExtraTags"][extraColumns]] if numExtra else [])
+                           + [mesh["elementNodes"][columns]])
+
+
+def CheckElementSizes(mesh):
+    counts = np.diff(mesh["elementOffsets"])
+    expected = np.array([NODES_PER_TYPE.get(t, -1) for t in range(max(NODES_PER_TYPE) + 1)])
+    types = mesh["elementTypes"]
+    if np.any(types > max(NODES_PER_TYPE)) or np.any(expected[np.minimum(types, max(NODES_PER_TYPE))] != counts):
+        raise ValueError("element types and numbers of nodes do not match")
+
+
+def WriteAscii(f, mesh):
+    f.write(f"$Nodes\n{len(mesh['nodeTags'])}\n".encode("ascii"))
+    for first in range(0, len(mesh["nodeTags"]), CHUNK_ROWS):
+        tags = mesh["nodeTags"][first:first + CHUNK_ROWS].tolist()
+        nodes = mesh["nodes"][first:first + CHUNK_ROWS]
+        values = [v for row in zip(tags, *nodes.T.tolist()) for v in row]
+        f.write((("%d %r %r %r\n" * len(tags)) % tuple(values)).encode("ascii"))
+    f.write(b"$EndNodes\n")
+
+    f.write(f"$Elements\n{len(mesh['elementTags'])}\n".encode("ascii"))
+    for start, end, elementType, numExtra in TypeRuns(mesh):
+        numNodes = NODES_PER_TYPE[elementType]
+        line = f"%d {elementType} {2 + numExtra} " + " ".join(["%d"] * (numNodes + 2 + numExtra)) + "\n"
+        for first in range(start, end, CHUNK_ROWS):
+            last = min(first + CHUNK_ROWS, end)
+            rows = ElementRows(mesh, first, last, numNodes, numExtra)
+            f.write(((line * len(rows)) % tuple(rows.ravel().tolist())).encode("ascii"))
+    f.write(b"$EndElements\n")
+
+
+def WriteBinary(f, mesh):
+    rowType = np.dtype([("tag", "<i4"), ("xyz", "<f8", 3)])
+    table = np.empty(len(mesh["nodeTags"]), dtype=rowType)
+    table["tag"] = mesh["nodeTags"]
+    table["xyz"] = mesh["nodes"]
+    f.write(f"$Nodes\n{len(table)}\n".encode("ascii"))
+    f.write(table.tobytes())
+    f.write(b"\n$EndNodes\n")
+
+    f.write(f"$Elements\n{len(mesh['elementTags'])}\n".encode("ascii"))
+    for start, end, elementType, numExtra in TypeRuns(mesh):
+        numNodes = NODES_PER_TYPE[elementType]
+        for first in range(start, end, CHUNK_ROWS):
+            last = min(first + CHUNK_ROWS, end)
+            f.write(np.array([elementType, last - first, 2 + numExtra], dtype="<i4").tobytes())
+            f.write(ElementRows(mesh, first, last, numNodes, numExtra).astype("<i4").tobytes())
+    f.write(b"\n$EndElements\n")
+
+
+def WriteMsh22(path, mesh, binary=False):
+    CheckElementSizes(mesh)
+    with OpenMsh(path, "wb") as f:
+        if binary:
+            f.write(b"$MeshFormat\n2.2 1 8\n" + np.array([1], dtype="<i4").tobytes() + b"\n$EndMeshFormat\n")
+        else:
+            f.write(b"$MeshFormat\n2.2 0 8\n$EndMeshFormat\n")
+        if mesh["physicalNames"]:
+            f.write(f"$PhysicalNames\n{len(mesh['physicalNames'])}\n".encode("ascii"))
+            for dim, tag, name in mesh["physicalNames"]:
+                f.write(f'{dim} {tag} "{name}"\n'.encode("ascii"))
+            f.write(b"$EndPhysicalNames\n")
+        if binary:
+            WriteBinary(f, mesh)
+        else:
+            WriteAscii(f, mesh)
+# ===============================================
+
+
+# ===============================================
+# row of every node tag (-1 for tags that are not used)
+def NodeIndex(mesh):
+    tags = mesh["nodeTags"]
+    index = np.full(int(tags.max()) + 1 if len(tags) else 1, -1, dtype=np.int64)
+    index[tags] = np.arange(len(tags))
+    return index
+
+
+# elements of one type (and physical group)
+# returns the element rows (k,) and the connectivity as node rows (k, number of nodes)
+def ElementsOfType(mesh, elementType, physical=None):
+    mask = mesh["elementTypes"] == elementType
+    if physical is not None:
+        mask &= mesh["elementPhysical"] == physical
+    rows = np.flatnonzero(mask)
+    numNodes = NODES_PER_TYPE[elementType]
+    columns = mesh["elementOffsets"][rows][:, None] + np.arange(numNodes)
+    return rows, NodeIndex(mesh)[mesh["elementNodes"][columns]]
+
+
+# connectivity of every element type in the mesh
+# returns {element type: (element rows, connectivity as node rows)}
+def ElementBlocks(mesh):
+    return {int(t): ElementsOfType(mesh, int(t)) for t in np.unique(mesh["elementTypes"])}
+
+
+# mesh with the selected elements only
+# unused nodes are removed, nodes and elements are numbered 1, 2, 3, ... again
+def SubMesh(mesh, elementMask):
+    rows = np.flatnonzero(elementMask)
+    offsets = mesh["elementOffsets"]
+    counts = offsets[rows + 1] - offsets[rows]
+    newOffsets = np.concatenate([[0], np.cumsum(counts)])
+    elementNodes = mesh["elementNodes"][Gather(offsets[rows], counts)]
+
+    nodeRows = NodeIndex(mesh)[elementNodes]
+    used = np.zeros(len(mesh["nodeTags"]), dtype=bool)
+    used[nodeRows] = True
+    renumber = np.cumsum(used)
+    subMesh = {
+        "physicalNames": list(mesh["physicalNames"]),
+        "nodeTags": np.arange(1, int(used.sum()) + 1, dtype=np.int64),
+        "nodes": mesh["nodes"][used],
+        "elementTags": np.arange(1, len(rows) + 1, dtype=np.int64),
+        "elementTypes": mesh["elementTypes"][rows],
+        "elementPhysical": mesh["elementPhysical"][rows],
+        "elementEntity": mesh["elementEntity"][rows],
+        "elementOffsets": newOffsets.astype(np.int64),
+        "elementNodes": renumber[nodeRows].astype(np.int64),
+    }
+    if "elementExtraOffsets" in mesh:
+        extraOffsets = mesh["elementExtraOffsets"]
+        extraCounts = extraOffsets[rows + 1] - extraOffsets[rows]
+        subMesh["elementExtraOffsets"] = np.concatenate([[0], np.cumsum(extraCounts)]).astype(np.int64)
+        subMesh["elementExtraTags"] = mesh["elementExtraTags"][Gather(extraOffsets[rows], extraCounts)]
+    return subMesh
+# ===============================================
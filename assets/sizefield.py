@@ -0,0 +1,162 @@
+# *************************************************************
+# Centerline-radius driven mesh size field.
+# Instead of one global meshSize, the element size follows the local
+# lumen radius: size = factor * radius, bounded by [sizeMin, sizeMax].
+# 1. the surface nodes are assigned to their nearest centerline node
+#    (one vectorized KD-tree query) and the mean distance is the radius
+#    of that centerline node (smoothed like MovingAverage7)
+# 2. the size is sampled on a regular grid around the surface
+#    (second KD-tree query) and given to gmsh as a "Structured"
+#    background field
+# input  : centerline file (#pt3d format, data/centerline.txt)
+# *************************************************************
+
+import os
+import tempfile
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+import gmsh
+
+import centerline
+
+# upper limit of the number of grid points of the structured field
+MAX_GRID_POINTS = 2_000_000
+
+DEFAULT_SIZE_FIELD_OPTIONS = {
+    # centerline file, None = uniform meshSize (former behaviour)
+    "centerline": None,
+    # element size / local radius
+    "factor": 0.3,
+    # bounds of the size, None = meshSize / 2 and meshSize * 2
+    "sizeMin": None,
+    "sizeMax": None,
+}
+
+
+# ===============================================
+# command line
+def AddSizeFieldArguments(parser):
+    group = parser.add_argument_group("adaptive size field")
+    group.add_argument("--size-centerline", default=None, help="centerline file (#pt3d) for a radius-driven size field")
+    group.add_argument("--size-factor", type=float, default=None, help="element size / local lumen radius")
+    group.add_argument("--size-min", type=float, default=None)
+    group.add_argument("--size-max", type=float, default=None)
+
+
+def SizeFieldOptionsFromArgs(args):
+    options = dict(DEFAULT_SIZE_FIELD_OPTIONS)
+    values = {
+        "centerline": args.size_centerline,
+        "factor": args.size_factor,
+        "sizeMin": args.size_min,
+        "sizeMax": args.size_max,
+    }
+    options.update({key: value for key, value in values.items() if value is not None})
+    return options
+
+
+def ResolveSizeFieldOptions(options, meshSize):
+    resolved = dict(DEFAULT_SIZE_FIELD_OPTIONS)
+    resolved.update(options or {})
+    if resolved["sizeMin"] is None:
+        resolved["sizeMin"] = meshSize / 2
+    if resolved["sizeMax"] is None:
+        resolved["sizeMax"] = meshSize * 2
+    return resolved
+# ===============================================
+
+
+# ===============================================
+# mean distance from each centerline node to the surface nodes closest to it
+# centerline nodes without any surface node take the value of their neighbours
+def LumenRadius(centerlinePoints, surfacePoints):
+    distance, index = cKDTree(centerlinePoints).query(surfacePoints)
+    count = np.bincount(index, minlength=len(centerlinePoints))
+    total = np.bincount(index, weights=distance, minlength=len(centerlinePoints))
+    hasValue = count > 0
+    position = np.arange(len(centerlinePoints))
+    radius = np.interp(position, position[hasValue], total[hasValue] / count[hasValue])
+    return centerline.MovingAverage7(radius)
+# ===============================================
+
+
+# ===============================================
+# regular grid around the surface with the size at every grid point
+# returns origin, spacing, shape, values (C order, x slowest)
+def SizeGrid(centerlinePoints, radius, surfacePoints, factor, sizeMin, sizeMax):
+    lower = surfacePoints.min(axis=0) - sizeMax
+    upper = surfacePoints.max(axis=0) + sizeMax
+    extent = upper - lower
+    # spacing of about sizeMin, coarser if the grid would get too large
+    spacing = max(sizeMin, (np.prod(extent) / MAX_GRID_POINTS) ** (1.0 / 3.0))
+    shape = np.ceil(extent / spacing).astype(np.int64) + 1
+
+    axes = [lower[i] + spacing * np.arange(shape[i]) for i in range(3)]
+    grid = np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1).reshape(-1, 3)
+    _, index = cKDTree(centerlinePoints).query(grid)
+    values = np.clip(factor * radius[index], sizeMin, sizeMax)
+    return lower, np.full(3, spacing), shape, values
+
+
+# text format of the gmsh "Structured" field
+# ox oy oz / dx dy dz / nx ny nz / values
+def WriteStructuredField(path, origin, spacing, shape, values):
+    with open(path, "w") as f:
+        f.write(" ".join(f"{v:.17g}" for v in origin) + "\n")
+        f.write(" ".join(f"{v:.17g}" for v in spacing) + "\n")
+        f.write(" ".join(str(int(v)) for v in shape) + "\n")
+        np.savetxt(f, values, fmt="%.6g")
+# ===============================================
+
+
+# ===============================================
+# set the background size field of the current model
+# the surface nodes already in gmsh are used for the radius estimate
+# returns a summary of the field for the run record
+def ApplySizeField(options, meshSize):
+    options = ResolveSizeFieldOptions(options, meshSize)
+    centerlinePoints = centerline.ReadCenterline(options["centerline"])
+    _, coordinates, _ = gmsh.model.mesh.getNodes(2, -1, includeBoundary=True)
+    surfacePoints = coordinates.reshape(-1, 3)
+
+    radius = LumenRadius(centerlinePoints, surfacePoints)
+    origin, spacing, shape, values = SizeGrid(
+        centerlinePoints, radius, surfacePoints, options["factor"], options["sizeMin"], options["sizeMax"])
+
+    # gmsh reads the file when the field is first evaluated, so it is kept until the end of the run
+    fieldFile = tempfile.NamedTemporaryFile("w", suffix=".txt", prefix="sizefield-", delete=False)
+    fieldFile.close()
+    WriteStructuredField(fieldFile.name, origin, spacing, shape, values)
+
+    field = gmsh.model.mesh.field.add("Structured")
+    gmsh.model.mesh.field.setString(field, "FileName", fieldFile.name)
+    gmsh.model.mesh.field.setNumber(field, "TextFormat", 1)
+    gmsh.model.mesh.field.setNumber(field, "SetOutsideValue", 1)
+    gmsh.model.mesh.field.setNumber(field, "OutsideValue", options["sizeMax"])
+    gmsh.model.mesh.field.setAsBackgroundMesh(field)
+
+    # only the field decides the size
+    gmsh.option.setNumber("Mesh.MeshSizeFromPoints", 0)
+    gmsh.option.setNumber("Mesh.MeshSizeFromCurvature", 0)
+    gmsh.option.setNumber("Mesh.MeshSizeExtendFromBoundary", 0)
+    gmsh.option.setNumber("Mesh.MeshSizeMin", options["sizeMin"])
+    gmsh.option.setNumber("Mesh.MeshSizeMax", options["sizeMax"])
+
+    return {
+        "centerline": options["centerline"],
+        "factor": options["factor"],
+        "sizeMin": options["sizeMin"],
+        "sizeMax": options["sizeMax"],
+        "radiusMin": float(radius.min()),
+        "radiusMax": float(radius.max()),
+        "gridShape": [int(v) for v in shape],
+        "fieldFile": fieldFile.name,
+    }
+
+
+def RemoveSizeFieldFile(summary):
+    if summary and os.path.exists(summary["fieldFile"]):
+        os.remove(summary["fieldFile"])
+# ===============================================
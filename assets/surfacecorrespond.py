@@ -0,0 +1,69 @@
+# *************************************************************
+# Correspondence between the lumen surface and the centerline, and the
+# mean radius around every centerline edge.
+# Python version of button3 / button5 of the C# tool
+# (Algorithm.CorrespondenceBetweenCenterlineNodeAndLumenalSurfaceTriangle,
+#  Algorithm.CorrespondenceBetweenCenterlineNodeAndLumenalSurfaceNode_and_calculateRadius).
+# The nearest centerline node of all triangles / vertices is found with one
+# KD-tree query instead of comparing every pair.
+# input  : WALL surface (ASCII STL, e.g. written by button2), centerline.txt (#pt3d)
+# output : test.ply (centerline node of every triangle, read by meshdeform.py and button4)
+#          radius.txt (mean radius of every centerline edge, smoothed like MovingAverage7)
+#
+# usage  : python surfacecorrespond.py WALL.stl centerline.txt --ply test.ply --radius radius.txt
+# *************************************************************
+
+import argparse
+import time
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+import centerline
+import surfaceio
+
+
+# ===============================================
+# nearest centerline node of every triangle center
+# returns index (m,) and the vector from the center to the centerline node (m, 3)
+def TriangleCorrespondence(vertices, triangles, centerlinePoints):
+    center = vertices[triangles].mean(axis=1)
+    _, index = cKDTree(centerlinePoints).query(center)
+    return index, centerlinePoints[index] - center
+# ===============================================
+
+
+# ===============================================
+# mean distance of the vertices to the centerline edge they are projected on
+# one value per edge (number of centerline nodes - 1), 0 for edges without vertices
+def EdgeRadius(vertices, centerlinePoints):
+    _, index = cKDTree(centerlinePoints).query(vertices)
+    _, vector, sameEdge = centerline.EdgeProjection(vertices, centerlinePoints, index)
+    # edge index, or index - 1 for the edge before the node
+    edge = np.clip(np.where(sameEdge, index, index - 1), 0, len(centerlinePoints) - 2)
+    numEdges = len(centerlinePoints) - 1
+    total = np.bincount(edge, weights=np.linalg.norm(vector, axis=1), minlength=numEdges)
+    count = np.bincount(edge, minlength=numEdges)
+    return np.where(count > 0, total / np.maximum(count, 1), 0.0)
+# ===============================================
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="centerline node of every surface triangle and radius of every centerline edge")
+    parser.add_argument("stl", help="lumen surface (STL)")
+    parser.add_argument("centerline", help="centerline (#pt3d)")
+    parser.add_argument("--ply", default="test.ply", help="correspondence output (PLY)")
+    parser.add_argument("--radius", default=None, help="also write the smoothed radius of every centerline edge")
+    parser.add_argument("--vectors", default=None, help="also write the triangle center -> centerline node vectors (*.npy)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    vertices, triangles = surfaceio.ReadSurface(args.stl)
+    centerlinePoints = centerline.ReadCenterline(args.centerline)
+    index, vector = TriangleCorrespondence(vertices, triangles, centerlinePoints)
+    centerline.WriteCorrespondPly(args.ply, vertices, triangles, index)
+    if args.vectors:
+        np.save(args.vectors, vector)
+    if args.radius:
+        centerline.WriteRadius(args.radius, centerline.MovingAverage7(EdgeRadius(vertices, centerlinePoints)))
+    print(f"{len(triangles)} triangles, {len(centerlinePoints)} centerline nodes: {time.perf_counter() - start:.2f} s")
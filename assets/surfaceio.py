@@ -0,0 +1,148 @@
+# *************************************************************
+# Surface input as NumPy arrays instead of an ASCII STL round-trip.
+# The triangles are read from a binary file, the duplicate vertices are
+# welded once with vectorized code and the surface is given to gmsh
+# directly with addNodes/addElementsByType, so gmsh.merge does not have
+# to parse text.
+# input  : *.npz  vertices (n, 3) float, triangles (m, 3) int (0-based)
+#          *.npy  triangle soup (m, 3, 3) float
+#          *.bin  raw little-endian float32 triangle soup, 9 values per triangle
+#                 (memory-mapped, nothing is parsed)
+#          *.stl  ASCII or binary STL (vectorized reader)
+#
+# usage  : python surfaceio.py MostInnerSurface.stl MostInnerSurface.npz
+#          (convert an existing STL once)
+# *************************************************************
+
+import argparse
+import os
+
+import numpy as np
+
+# extensions handled by this module instead of gmsh.merge
+SURFACE_ARRAY_EXTENSIONS = (".npz", ".npy", ".bin")
+
+
+# ===============================================
+# STL -> triangle soup (m, 3, 3)
+def ReadStl(path):
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        header = f.read(84)
+    # binary STL: 80 byte header, uint32 number of triangles, 50 bytes per triangle
+    if size >= 84:
+        count = int(np.frombuffer(header[80:84], dtype="<u4")[0])
+        if size == 84 + 50 * count:
+            return ReadStlBinary(path, count)
+    return ReadStlAscii(path)
+
+
+def ReadStlBinary(path, count):
+    dtype = np.dtype([("normal", "<f4", (3,)), ("vertices", "<f4", (3, 3)), ("attribute", "<u2")])
+    data = np.fromfile(path, dtype=dtype, count=count, offset=84)
+    return data["vertices"].astype(np.float64)
+
+
+# the coordinates are the three tokens after every "vertex"
+def ReadStlAscii(path):
+    with open(path, "rb") as f:
+        tokens = np.array(f.read().split())
+    vertexIndex = np.flatnonzero(tokens == b"vertex")
+    coordinates = tokens[vertexIndex[:, None] + np.arange(1, 4)].astype(np.float64)
+    return coordinates.reshape(-1, 3, 3)
+# ===============================================
+
+
+# ===============================================
+# triangle soup (m, 3, 3) -> vertices (n, 3), triangles (m, 3)
+# vertices closer than tolerance are merged (0: only identical coordinates)
+def WeldVertices(soup, tolerance=0.0):
+    points = soup.reshape(-1, 3)
+    if tolerance > 0.0:
+        keys = np.round(points / tolerance).astype(np.int64)
+    else:
+        keys = points
+    _, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    # keep the vertices in the order they first appear in the file
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    vertices = points[first[order]]
+    triangles = rank[inverse.reshape(-1)].reshape(-1, 3)
+    return vertices, triangles
+# ===============================================
+
+
+# ===============================================
+# read any supported file as welded vertices/triangles
+def ReadSurface(path, tolerance=0.0):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".npz":
+        with np.load(path) as data:
+            return np.asarray(data["vertices"], dtype=np.float64), np.asarray(data["triangles"], dtype=np.int64)
+    if extension == ".npy":
+        soup = np.load(path, mmap_mode="r")
+    elif extension == ".bin":
+        soup = np.memmap(path, dtype="<f4", mode="r")
+    else:
+        soup = ReadStl(path)
+    soup = np.asarray(soup, dtype=np.float64).reshape(-1, 3, 3)
+    return WeldVertices(soup, tolerance)
+
+
+def WriteSurface(path, vertices, triangles):
+    if path.lower().endswith(".stl"):
+        WriteStlAscii(path, np.asarray(vertices)[np.asarray(triangles)])
+    else:
+        np.savez(path, vertices=vertices, triangles=triangles)
+
+
+# triangle soup (m, 3, 3) -> ASCII STL, formatted in one call instead of per vertex
+def WriteStlAscii(path, soup, name="surface"):
+    normal = np.cross(soup[:, 1] - soup[:, 0], soup[:, 2] - soup[:, 0])
+    length = np.linalg.norm(normal, axis=1, keepdims=True)
+    normal = normal / np.where(length > 0.0, length, 1.0)
+    facet = ("facet normal %.7g %.7g %.7g\n  outer loop\n"
+             + "    vertex %.7g %.7g %.7g\n" * 3
+             + "  endloop\nendfacet")
+    with open(path, "w") as f:
+        f.write(f"solid {name}\n")
+        np.savetxt(f, np.concatenate([normal, soup.reshape(-1, 9)], axis=1), fmt=facet)
+        f.write(f"endsolid {name}\n")
+# ===============================================
+
+
+# ===============================================
+# give the surface to gmsh as one discrete surface entity
+# same state as after gmsh.merge of an STL: call createTopology() or classifySurfaces() next
+def AddSurfaceToGmsh(vertices, triangles):
+    import gmsh
+    tag = gmsh.model.addDiscreteEntity(2)
+    nodeTags = np.arange(1, len(vertices) + 1, dtype=np.uint64)
+    gmsh.model.mesh.addNodes(2, tag, nodeTags, np.ascontiguousarray(vertices, dtype=np.float64).ravel())
+    # element type 2 = 3-node triangle, gmsh numbers the elements itself
+    gmsh.model.mesh.addElementsByType(tag, 2, [], (np.asarray(triangles, dtype=np.uint64) + 1).ravel())
+    return tag
+
+
+def ImportSurface(path, tolerance=0.0):
+    vertices, triangles = ReadSurface(path, tolerance)
+    print(f"surface {os.path.basename(path)}: {len(vertices)} vertices, {len(triangles)} triangles")
+    return AddSurfaceToGmsh(vertices, triangles)
+
+
+def IsSurfaceArrayFile(path):
+    return os.path.splitext(path)[1].lower() in SURFACE_ARRAY_EXTENSIONS
+# ===============================================
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="convert a surface (stl/npy/bin) to welded vertex/triangle arrays (*.npz)")
+    parser.add_argument("input")
+    parser.add_argument("output")
+    parser.add_argument("--tolerance", type=float, default=0.0, help="merge vertices closer than this")
+    args = parser.parse_args()
+
+    vertices, triangles = ReadSurface(args.input, args.tolerance)
+    WriteSurface(args.output, vertices, triangles)
+    print(f"{len(vertices)} vertices, {len(triangles)} triangles -> {args.output}")
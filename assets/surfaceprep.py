@@ -0,0 +1,310 @@
+# *************************************************************
+# Repair and decimation of the input surface before gmsh.
+# Surfaces from segmentation or from WriteSTLWALLSurface of the C# side
+# often have duplicate vertices, degenerate or duplicate triangles and
+# far more triangles than the mesh needs, which makes classifySurfaces /
+# createTopology slow. The surface is read as arrays (surfaceio.py),
+# cleaned with vectorized NumPy code and given to gmsh with
+# addNodes/addElementsByType instead of gmsh.merge.
+#   "off"      : gmsh.merge as before
+#   "repair"   : weld the vertices (closer than the tolerance), drop the
+#                triangles with a repeated vertex or zero area and the
+#                duplicate triangles, remove unused vertices
+#   "decimate" : repair, then collapse the edges shorter than
+#                decimateFactor * meshSize (see CollapseShortEdges); the
+#                open ends are kept, and the result is only used if it has
+#                the same open edges and no new non-manifold edges
+# the open edges / loops, non-manifold edges and inconsistently oriented
+# edges are checked before and after; the counts and the time of every
+# step go into the run record
+# *************************************************************
+
+import time
+
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+import surfaceio
+
+DEFAULT_PREP_OPTIONS = {
+    "mode": "off",
+    # vertices closer than this are merged (0: only identical coordinates)
+    "tolerance": 0.0,
+    # target edge length of the decimation as a fraction of meshSize
+    "decimateFactor": 0.5,
+}
+CHOICES = {
+    "mode": ("off", "repair", "decimate"),
+}
+# a triangle is degenerate if its area is below this times its longest edge squared
+AREA_TOLERANCE = 1e-12
+
+
+# ===============================================
+# command line
+def AddPrepArguments(parser):
+    group = parser.add_argument_group("surface preparation")
+    group.add_argument("--surface-prep", choices=CHOICES["mode"], default=None,
+                       help="off: gmsh.merge as before, repair: weld and clean, decimate: also coarsen to --decimate-factor * meshSize")
+    group.add_argument("--weld-tolerance", type=float, default=None, help="merge vertices closer than this (0: identical only)")
+    group.add_argument("--decimate-factor", type=float, default=None, help="target edge length of the decimation / meshSize")
+
+
+def PrepOptionsFromArgs(args):
+    return ResolvePrepOptions({
+        "mode": args.surface_prep,
+        "tolerance": args.weld_tolerance,
+        "decimateFactor": args.decimate_factor,
+    })
+
+
+def ResolvePrepOptions(options):
+    resolved = dict(DEFAULT_PREP_OPTIONS)
+    resolved.update({key: value for key, value in (options or {}).items() if value is not None})
+    unknown = set(resolved) - set(DEFAULT_PREP_OPTIONS)
+    if unknown:
+        raise ValueError(f"unknown surface preparation options {sorted(unknown)}")
+    for key, choices in CHOICES.items():
+        if resolved[key] not in choices:
+            raise ValueError(f"surface preparation option {key}={resolved[key]!r}, choose from {choices}")
+    if float(resolved["tolerance"]) < 0.0:
+        raise ValueError(f"surface preparation option tolerance={resolved['tolerance']!r}, give a value >= 0")
+    if float(resolved["decimateFactor"]) <= 0.0:
+        raise ValueError(f"surface preparation option decimateFactor={resolved['decimateFactor']!r}, give a value > 0")
+    return resolved
+# ===============================================
+
+
+# ===============================================
+# unique undirected edges of the directed edges (k, 2)
+# returns edges (e, 2) with the smaller vertex first, the edge of every directed edge and
+# the number of directed edges of every edge; one int64 key per edge is much faster to
+# sort than the rows
+def Edges(directed, count):
+    low = np.minimum(directed[:, 0], directed[:, 1]).astype(np.int64)
+    high = np.maximum(directed[:, 0], directed[:, 1]).astype(np.int64)
+    keys, inverse, counts = np.unique(low * count + high, return_inverse=True, return_counts=True)
+    return np.stack([keys // count, keys % count], axis=1), inverse.ravel(), counts
+
+
+# repair
+# drop the triangles with a repeated vertex or (almost) zero area and the duplicate ones
+# (the same three vertices in any order), then remove the vertices no triangle uses
+def CleanTriangles(vertices, triangles):
+    corners = vertices[triangles]
+    repeated = ((triangles[:, 0] == triangles[:, 1]) | (triangles[:, 1] == triangles[:, 2])
+                | (triangles[:, 0] == triangles[:, 2]))
+    area = 0.5 * np.linalg.norm(np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0]), axis=1)
+    longest = np.max(np.linalg.norm(corners[:, [1, 2, 0]] - corners, axis=2), axis=1)
+    degenerate = repeated | (area <= AREA_TOLERANCE * longest ** 2)
+    kept = triangles[~degenerate]
+    # keep the first of the duplicates, in the order of the file (lexsort is stable)
+    ordered = np.sort(kept, axis=1)
+    order = np.lexsort(ordered.T[::-1])
+    duplicate = np.zeros(len(kept), dtype=bool)
+    duplicate[order[1:]] = (ordered[order[1:]] == ordered[order[:-1]]).all(axis=1)
+    kept = kept[~duplicate]
+
+    used, compact = np.unique(kept, return_inverse=True)
+    counts = {"degenerateTriangles": int(degenerate.sum()),
+              "duplicateTriangles": int(len(triangles) - degenerate.sum() - len(kept)),
+              "unusedVertices": int(len(vertices) - len(used))}
+    return vertices[used], compact.reshape(-1, 3), counts
+
+
+# open edges, open loops, non-manifold edges and edges whose two triangles disagree on the orientation
+# a tube (the vessel wall) is not watertight, it has one open loop per inlet/outlet
+def CheckSurface(vertices, triangles):
+    directed = np.concatenate([triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]]])
+    edges, inverse, counts = Edges(directed, len(vertices))
+    # two triangles with the same orientation walk along their common edge in the same direction
+    forward = np.bincount(inverse, weights=directed[:, 0] < directed[:, 1], minlength=len(edges))
+    inconsistent = (counts == 2) & (forward != 1)
+
+    openEdges = edges[counts == 1]
+    loops = 0
+    if len(openEdges):
+        graph = coo_matrix((np.ones(len(openEdges)), (openEdges[:, 0], openEdges[:, 1])), shape=(len(vertices),) * 2)
+        _, labels = connected_components(graph, directed=False)
+        loops = len(np.unique(labels[openEdges[:, 0]]))
+    return {
+        "vertices": int(len(vertices)),
+        "triangles": int(len(triangles)),
+        "openEdges": int(len(openEdges)),
+        "openLoops": int(loops),
+        "nonManifoldEdges": int((counts > 2).sum()),
+        "inconsistentEdges": int(inconsistent.sum()),
+        "watertight": bool(len(openEdges) == 0 and (counts <= 2).all()),
+        "meanEdgeLength": float(np.linalg.norm(vertices[edges[:, 0]] - vertices[edges[:, 1]], axis=1).mean()) if len(edges) else 0.0,
+    }
+# ===============================================
+
+
+# ===============================================
+# decimation by short edge collapses
+# in every round the edges shorter than the target are collapsed to their midpoint, as many as
+# possible at once: an edge is taken only if it is the shortest candidate within the neighbours
+# of both its vertices, so no two collapses of a round touch the same triangle and each can be
+# checked on its own. A collapse is refused if
+#   - a vertex of the edge is on an open edge (the inlet/outlet rims stay as they are)
+#   - the two vertices have other common neighbours than the two opposite vertices
+#     (link condition, the surface would become non-manifold)
+#   - a remaining triangle around it turns by more than MAX_NORMAL_CHANGE degrees
+#     (folds and features sharper than that are kept)
+#   - a remaining triangle around it gets an edge longer than MAX_EDGE_FACTOR * target
+MAX_NORMAL_CHANGE = 20.0
+MAX_EDGE_FACTOR = 1.6
+MAX_ROUNDS = 100
+
+
+def Normals(vertices, triangles):
+    corners = vertices[triangles]
+    normal = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    return normal / np.maximum(np.linalg.norm(normal, axis=1, keepdims=True), 1e-300)
+
+
+# the edges of one round (rows of edges), see above
+def SelectCollapses(vertices, edges, counts, target):
+    count = len(vertices)
+    onOpenEdge = np.zeros(count, dtype=bool)
+    onOpenEdge[edges[counts == 1].ravel()] = True
+    lengths = np.linalg.norm(vertices[edges[:, 0]] - vertices[edges[:, 1]], axis=1)
+    candidate = np.flatnonzero((lengths < target) & (counts == 2) & ~onOpenEdge[edges].any(axis=1))
+    if len(candidate) == 0:
+        return candidate
+
+    rows = np.concatenate([edges[:, 0], edges[:, 1]])
+    columns = np.concatenate([edges[:, 1], edges[:, 0]])
+    adjacency = coo_matrix((np.ones(len(rows)), (rows, columns)), shape=(count, count)).tocsr()
+    common = np.asarray(adjacency[edges[candidate, 0]].multiply(adjacency[edges[candidate, 1]]).sum(axis=1)).ravel()
+    candidate = candidate[common == 2]
+
+    # rank of every candidate by length
+    key = np.full(len(edges), np.inf)
+    key[candidate[np.argsort(lengths[candidate], kind="stable")]] = np.arange(len(candidate))
+    # the shortest candidates within their neighbourhood are taken, the candidates next to
+    # them are dropped, and the rest is searched again until no candidate is left
+    selected = []
+    while len(candidate):
+        vertexKey = np.full(count, np.inf)
+        np.minimum.at(vertexKey, edges[candidate, 0], key[candidate])
+        np.minimum.at(vertexKey, edges[candidate, 1], key[candidate])
+        ringKey = vertexKey.copy()
+        np.minimum.at(ringKey, edges[:, 0], vertexKey[edges[:, 1]])
+        np.minimum.at(ringKey, edges[:, 1], vertexKey[edges[:, 0]])
+        taken = candidate[(key[candidate] == ringKey[edges[candidate, 0]]) & (key[candidate] == ringKey[edges[candidate, 1]])]
+        selected.append(taken)
+        near = np.zeros(count, dtype=bool)
+        near[edges[taken].ravel()] = True
+        near[np.concatenate([edges[near[edges[:, 0]], 1], edges[near[edges[:, 1]], 0]])] = True
+        candidate = candidate[~near[edges[candidate]].any(axis=1)]
+    return edges[np.concatenate(selected)]
+
+
+# merge the second vertex of every pair into the first one, at the midpoint
+def ApplyCollapses(vertices, triangles, pairs):
+    mapping = np.arange(len(vertices))
+    mapping[pairs[:, 1]] = pairs[:, 0]
+    moved = vertices.copy()
+    moved[pairs[:, 0]] = 0.5 * (vertices[pairs[:, 0]] + vertices[pairs[:, 1]])
+    return moved, mapping[triangles]
+
+
+def CollapseShortEdges(vertices, triangles, target):
+    cosLimit = np.cos(np.radians(MAX_NORMAL_CHANGE))
+    collapsed = 0
+    rounds = 0
+    for rounds in range(1, MAX_ROUNDS + 1):
+        directed = np.concatenate([triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]]])
+        edges, _, counts = Edges(directed, len(vertices))
+        pairs = SelectCollapses(vertices, edges, counts, target)
+        if len(pairs) == 0:
+            break
+        # collapse of every vertex of the pairs, -1 for the others
+        owner = np.full(len(vertices), -1)
+        owner[pairs[:, 0]] = np.arange(len(pairs))
+        owner[pairs[:, 1]] = np.arange(len(pairs))
+        moved, changed = ApplyCollapses(vertices, triangles, pairs)
+
+        # the triangles around a collapse that remain
+        around = owner[triangles].max(axis=1)
+        remaining = (around >= 0) & (changed[:, 0] != changed[:, 1]) & (changed[:, 1] != changed[:, 2]) & (changed[:, 0] != changed[:, 2])
+        turn = np.einsum("ij,ij->i", Normals(vertices, triangles[remaining]), Normals(moved, changed[remaining]))
+        corners = moved[changed[remaining]]
+        longest = np.max(np.linalg.norm(corners[:, [1, 2, 0]] - corners, axis=2), axis=1)
+        refused = np.unique(around[remaining][(turn < cosLimit) | (longest > MAX_EDGE_FACTOR * target)])
+        keep = np.ones(len(pairs), dtype=bool)
+        keep[refused] = False
+        if not keep.any():
+            break
+        vertices, triangles = ApplyCollapses(vertices, triangles, pairs[keep])
+        # the two triangles of every collapsed edge; the unused vertices are removed at the end
+        triangles = triangles[(triangles[:, 0] != triangles[:, 1]) & (triangles[:, 1] != triangles[:, 2])
+                              & (triangles[:, 0] != triangles[:, 2])]
+        collapsed += int(keep.sum())
+    vertices, triangles, _ = CleanTriangles(vertices, triangles)
+    return vertices, triangles, {"collapsedEdges": collapsed, "rounds": rounds}
+
+
+# returns (vertices, triangles, summary); the input is returned unchanged if the decimated
+# surface has other open edges or more non-manifold / inconsistent edges (see the header)
+def Decimate(vertices, triangles, target, before):
+    summary = {"targetEdgeLength": float(target)}
+    # a surface that is fine only in places still has edges to collapse
+    directed = np.concatenate([triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]]])
+    edges = Edges(directed, len(vertices))[0]
+    if not (np.linalg.norm(vertices[edges[:, 0]] - vertices[edges[:, 1]], axis=1) < target).any():
+        summary["result"] = "skipped, no edge shorter than the target"
+        return vertices, triangles, summary
+    decimatedVertices, decimatedTriangles, collapses = CollapseShortEdges(vertices, triangles, target)
+    summary.update(collapses)
+    after = CheckSurface(decimatedVertices, decimatedTriangles)
+    if (after["openEdges"] != before["openEdges"] or after["nonManifoldEdges"] > before["nonManifoldEdges"]
+            or after["inconsistentEdges"] > before["inconsistentEdges"]):
+        summary["result"] = "rejected, the decimated surface changes the topology"
+        summary["rejected"] = after
+        return vertices, triangles, summary
+    summary["result"] = "decimated"
+    return decimatedVertices, decimatedTriangles, summary
+# ===============================================
+
+
+# ===============================================
+# read, clean (and decimate) the surface of path and give it to gmsh
+# returns the summary for the run record
+def ImportPreparedSurface(path, options, meshSize):
+    options = ResolvePrepOptions(options)
+    timings = {}
+    start = time.perf_counter()
+    vertices, triangles = surfaceio.ReadSurface(path, options["tolerance"])
+    timings["readWeld"] = time.perf_counter() - start
+    soupVertices = 3 * len(triangles)
+
+    start = time.perf_counter()
+    before = CheckSurface(vertices, triangles)
+    vertices, triangles, counts = CleanTriangles(vertices, triangles)
+    repaired = CheckSurface(vertices, triangles)
+    timings["repair"] = time.perf_counter() - start
+    summary = {"mode": options["mode"], "tolerance": options["tolerance"], "inputVertices": soupVertices,
+               "before": before, "repair": counts, "after": repaired}
+
+    if options["mode"] == "decimate":
+        start = time.perf_counter()
+        vertices, triangles, summary["decimate"] = Decimate(vertices, triangles, options["decimateFactor"] * meshSize, repaired)
+        summary["after"] = CheckSurface(vertices, triangles)
+        timings["decimate"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    surfaceio.AddSurfaceToGmsh(vertices, triangles)
+    timings["gmsh"] = time.perf_counter() - start
+    summary["timings"] = timings
+    after = summary["after"]
+    print(f"surface prep {options['mode']}: {before['triangles']} -> {after['triangles']} triangles, "
+          f"{before['vertices']} -> {after['vertices']} vertices, {after['openLoops']} open loops, "
+          f"{after['nonManifoldEdges']} non-manifold edges, {sum(timings.values()):.2f} s")
+    if after["nonManifoldEdges"] or after["inconsistentEdges"]:
+        print(f"warning: the surface has {after['nonManifoldEdges']} non-manifold and "
+              f"{after['inconsistentEdges']} inconsistently oriented edges")
+    return summary
+# ===============================================
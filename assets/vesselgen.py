@@ -0,0 +1,434 @@
+# *************************************************************
+# Synthetic vessel surfaces for tests and scaling benchmarks.
+# A vessel is a tree of branches. Every branch follows a parametric
+# centerline made of straight pieces and circular bends, and its radius
+# can taper and have stenoses (cosine narrowing) and aneurysms (cosine
+# bulge, all around or to one side). A branch can end in a bifurcation
+# into two children. The children start from the two halves of the last
+# ring of the parent and a shared crotch curve, and blend into their own
+# circular cross section. The sharp carina along the crotch curve is then
+# rounded by smoothing, as the boundary layer cannot follow a sharp edge. Like data/gmsh22.stl, the surface is one
+# manifold with outward normals. It is open only at the inlet and the
+# outlets, and every open end is a planar circle.
+# The number of vertices per ring is the same in the whole tree. It is
+# chosen from --triangles or --edge-length, and the rings are spaced by
+# the local radius so that the triangles are close to equilateral.
+# input  : --shape (one of SHAPES) or --spec vessel.json (same form as SHAPES)
+# output : vessel.stl (ASCII, or *.npz, see surfaceio.py)
+#          vessel_centerline.txt (#pt3d, inlet -> first outlet)
+#          vessel_centerline_1.txt, ... (inlet -> the other outlets)
+#
+# usage  : python vesselgen.py vessel.stl --shape mixed --triangles 200000
+#          python vesselgen.py vessel.stl --spec vessel.json --edge-length 0.3
+# *************************************************************
+
+import argparse
+import json
+import math
+import os
+
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.spatial import cKDTree
+
+import centerline
+import surfaceio
+import surfaceprep
+
+# a branch, lengths in the unit of the STL
+# segments  : {"length": L} straight, or {"bend": deg, "bendRadius": Rb, "plane": deg}
+#             (the bend turns toward the direction "plane" around the centerline)
+# stenoses  : {"at": fraction of the branch, "length": L, "severity": reduction of the radius}
+# aneurysms : {"at": fraction, "length": L, "size": growth of the radius,
+#              "direction": deg (one-sided, None: all around)}
+# bifurcation : {"plane": deg, "angles": [deg, deg]} with two children
+DEFAULT_BRANCH = {
+    "radius": 3.0,
+    "radiusEnd": None,
+    "segments": [{"length": 30.0}],
+    "stenoses": [],
+    "aneurysms": [],
+    "bifurcation": None,
+    "children": [],
+}
+SHAPES = {
+    "straight": {"segments": [{"length": 40.0}]},
+    "bend": {"segments": [{"length": 10.0}, {"bend": 90.0, "bendRadius": 12.0}, {"length": 10.0}]},
+    "stenosis": {"segments": [{"length": 40.0}],
+                 "stenoses": [{"at": 0.5, "length": 10.0, "severity": 0.5}]},
+    "aneurysm": {"segments": [{"length": 40.0}],
+                 "aneurysms": [{"at": 0.5, "length": 12.0, "size": 0.8, "direction": 90.0}]},
+    "bifurcation": {"segments": [{"length": 20.0}],
+                    "bifurcation": {"plane": 0.0, "angles": [30.0, 30.0]},
+                    "children": [{"radius": 2.4, "segments": [{"length": 25.0}]},
+                                 {"radius": 2.4, "segments": [{"length": 25.0}]}]},
+    "mixed": {"segments": [{"length": 10.0}, {"bend": 60.0, "bendRadius": 15.0, "plane": 90.0}, {"length": 12.0}],
+              "radiusEnd": 2.8,
+              "stenoses": [{"at": 0.3, "length": 8.0, "severity": 0.4}],
+              "bifurcation": {"plane": 0.0, "angles": [35.0, 25.0]},
+              "children": [{"radius": 2.2, "segments": [{"length": 28.0}],
+                            "aneurysms": [{"at": 0.65, "length": 9.0, "size": 0.7, "direction": 0.0}]},
+                           {"radius": 2.5, "segments": [{"length": 14.0}, {"bend": 70.0, "bendRadius": 12.0, "plane": 180.0},
+                                                        {"length": 8.0}]}]},
+}
+# a child blends into its circle over TRANSITION * parent radius / sin(angle),
+# far enough for the two circles to be apart
+TRANSITION = 1.5
+# a bend must be this much wider than the largest radius of its branch
+MIN_BEND_FACTOR = 1.2
+MIN_RING = 16
+# samples of the radius per unit radius along a branch (ring spacing and volume)
+DENSITY = 20
+ANGLE_SAMPLES = 64
+# the carina is rounded over about FILLET * parent radius
+FILLET = 0.3
+
+
+# ===============================================
+# specification
+def ResolveBranch(spec):
+    branch = dict(DEFAULT_BRANCH)
+    branch.update(spec or {})
+    unknown = set(branch) - set(DEFAULT_BRANCH)
+    if unknown:
+        raise ValueError(f"unknown branch keys {sorted(unknown)}")
+    if branch["radiusEnd"] is None:
+        branch["radiusEnd"] = branch["radius"]
+    if (branch["bifurcation"] is None) != (len(branch["children"]) == 0) or len(branch["children"]) not in (0, 2):
+        raise ValueError("a branch with a bifurcation needs exactly two children and the other way round")
+    branch["children"] = [ResolveBranch(child) for child in branch["children"]]
+    branch["length"] = sum(SegmentLength(segment) for segment in branch["segments"])
+    maxRadius = MaxRadius(branch)
+    for segment in branch["segments"]:
+        if "bend" in segment and segment["bendRadius"] < MIN_BEND_FACTOR * maxRadius:
+            raise ValueError(f"bendRadius {segment['bendRadius']} is too tight for radius {maxRadius:.3g}, "
+                             f"use at least {MIN_BEND_FACTOR * maxRadius:.3g}")
+    if branch["bifurcation"]:
+        for angle, child in zip(branch["bifurcation"]["angles"], branch["children"]):
+            if not 0.0 < angle < 90.0:
+                raise ValueError(f"bifurcation angle {angle} deg, give a value in (0, 90)")
+            if TransitionLength(branch, angle) >= child["length"]:
+                raise ValueError(f"child at {angle} deg is shorter than its transition "
+                                 f"{TransitionLength(branch, angle):.3g}, make it longer")
+    return branch
+
+
+def SegmentLength(segment):
+    if "bend" in segment:
+        return abs(math.radians(segment["bend"])) * segment["bendRadius"]
+    return float(segment["length"])
+
+
+def TransitionLength(parent, angle):
+    return TRANSITION * parent["radiusEnd"] / math.sin(math.radians(angle))
+
+
+def MaxRadius(branch):
+    s = np.linspace(0.0, branch["length"], 256)
+    return float(Radius(branch, s, np.linspace(0.0, 2.0 * np.pi, ANGLE_SAMPLES, endpoint=False)).max())
+# ===============================================
+
+
+# ===============================================
+# centerline of a branch: straight pieces and circular bends with a
+# rotation-minimizing frame (tangent, e1, e2)
+# Rodrigues rotation of vectors (..., 3) around the unit axis by angle (...)
+def Rotate(vectors, axis, angle):
+    angle = np.asarray(angle)[..., None]
+    return (vectors * np.cos(angle) + np.cross(axis, vectors) * np.sin(angle)
+            + axis * (vectors @ axis)[..., None] * (1.0 - np.cos(angle)))
+
+
+def CompilePath(start, tangent, e1, segments):
+    e2 = np.cross(tangent, e1)
+    pieces = []
+    s0 = 0.0
+    for segment in segments:
+        length = SegmentLength(segment)
+        piece = {"s0": s0, "length": length, "start": start, "tangent": tangent, "e1": e1, "e2": e2}
+        if "bend" in segment:
+            plane = math.radians(segment.get("plane", 0.0))
+            toward = math.cos(plane) * e1 + math.sin(plane) * e2
+            if segment["bend"] < 0:
+                toward = -toward
+            piece.update(bendRadius=segment["bendRadius"], toward=toward, axis=np.cross(tangent, toward))
+        pieces.append(piece)
+        start, tangent, e1, e2 = (v[0] for v in PieceAt(piece, np.array([length])))
+        s0 += length
+    return pieces
+
+
+def PieceAt(piece, s):
+    if "bendRadius" not in piece:
+        count = len(s)
+        return (piece["start"] + s[:, None] * piece["tangent"], np.tile(piece["tangent"], (count, 1)),
+                np.tile(piece["e1"], (count, 1)), np.tile(piece["e2"], (count, 1)))
+    radius, toward, axis = piece["bendRadius"], piece["toward"], piece["axis"]
+    angle = s / radius
+    position = (piece["start"] + radius * (1.0 - np.cos(angle))[:, None] * toward
+                + radius * np.sin(angle)[:, None] * piece["tangent"])
+    tangent = np.cos(angle)[:, None] * piece["tangent"] + np.sin(angle)[:, None] * toward
+    return position, tangent, Rotate(piece["e1"], axis, angle), Rotate(piece["e2"], axis, angle)
+
+
+# position, tangent, e1, e2 at the arc lengths s (k,) -> 4 x (k, 3)
+def PathAt(pieces, s):
+    frames = [np.zeros((len(s), 3)) for _ in range(4)]
+    for piece in pieces:
+        mask = s >= piece["s0"]
+        if not mask.any():
+            continue
+        values = PieceAt(piece, s[mask] - piece["s0"])
+        for frame, value in zip(frames, values):
+            frame[mask] = value
+    return frames
+# ===============================================
+
+
+# ===============================================
+# radius of a branch at the arc lengths s (k,) and angles theta (n,) around e1 -> (k, n)
+def Bump(s, at, length):
+    x = 2.0 * (s - at) / length
+    return np.where(np.abs(x) < 1.0, 0.5 * (1.0 + np.cos(np.pi * x)), 0.0)
+
+
+def Radius(branch, s, theta):
+    length = max(branch["length"], 1e-12)
+    base = branch["radius"] + (branch["radiusEnd"] - branch["radius"]) * s / length
+    for stenosis in branch["stenoses"]:
+        base = base * (1.0 - stenosis["severity"] * Bump(s, stenosis["at"] * length, stenosis["length"]))
+    radius = np.repeat(base[:, None], len(theta), axis=1)
+    for aneurysm in branch["aneurysms"]:
+        bump = aneurysm["size"] * Bump(s, aneurysm["at"] * length, aneurysm["length"])[:, None]
+        if aneurysm.get("direction") is not None:
+            bump = bump * np.maximum(np.cos(theta - math.radians(aneurysm["direction"])), 0.0) ** 2
+        radius *= 1.0 + bump
+    return radius
+
+
+# sum of the integral of ds / mean radius over the tree (rings per vertex of a ring, times 2 pi)
+def InverseRadiusLength(branch):
+    s, meanRadius = MeanRadius(branch)
+    return Integral(1.0 / meanRadius, s)[-1] + sum(InverseRadiusLength(child) for child in branch["children"])
+
+
+# mean radius around the centerline, sampled along the branch
+def MeanRadius(branch):
+    s = np.linspace(0.0, branch["length"], max(64, int(DENSITY * branch["length"] / branch["radius"])))
+    return s, Radius(branch, s, np.linspace(0.0, 2.0 * np.pi, ANGLE_SAMPLES, endpoint=False)).mean(axis=1)
+
+
+# cumulative trapezoidal integral of y over x, starting at 0
+def Integral(y, x):
+    return np.concatenate([[0.0], np.cumsum(0.5 * (y[1:] + y[:-1]) * np.diff(x))])
+
+
+# every ring has n vertices, the spacing is the length of the ring edge (2 pi r / n)
+# triangles ~ 2 n rings = n^2 / pi * integral(ds / r)
+def RingVertices(root, triangles=None, edgeLength=None):
+    if edgeLength:
+        n = 2.0 * math.pi * root["radius"] / edgeLength
+    else:
+        n = math.sqrt(math.pi * triangles / InverseRadiusLength(root))
+    return max(MIN_RING, 2 * int(round(n / 2.0)))
+
+
+# arc lengths of the rings of a branch, spaced by the local radius
+def RingPositions(branch, n):
+    s, meanRadius = MeanRadius(branch)
+    rings = Integral(n / (2.0 * math.pi * meanRadius), s)
+    count = max(1, int(round(rings[-1])))
+    return np.interp(np.linspace(0.0, rings[-1], count + 1), rings, s)
+# ===============================================
+
+
+# ===============================================
+# surface of the tree
+# state: vertices / triangles (lists of arrays), count of vertices, rims and centerlines
+def AddVertices(state, points):
+    indices = np.arange(state["count"], state["count"] + len(points))
+    state["vertices"].append(points)
+    state["count"] += len(points)
+    return indices
+
+
+# triangles between two rings of the same length, outward for rings counterclockwise around the centerline
+def AddStrip(state, ringA, ringB):
+    nextA, nextB = np.roll(ringA, -1), np.roll(ringB, -1)
+    state["triangles"].append(np.concatenate([np.stack([ringA, nextA, nextB], axis=1),
+                                              np.stack([ringA, nextB, ringB], axis=1)]))
+
+
+# one branch and its children
+# loop: None for the root, else (indices, points) of the first ring, counterclockwise around tangent
+# returns the centerline of the branch to every outlet below it
+def SweepBranch(state, branch, start, tangent, e1, n, loop=None, transition=0.0):
+    pieces = CompilePath(start, tangent, e1, branch["segments"])
+    s = RingPositions(branch, n)
+    bifurcation = branch["bifurcation"]
+    # the vertices 0 and n/2 of the last ring are where the crotch curve starts
+    offset = math.radians(bifurcation["plane"]) - 0.5 * math.pi if bifurcation else 0.0
+    theta = offset + 2.0 * np.pi * np.arange(n) / n
+    position, tangents, e1s, e2s = PathAt(pieces, s)
+    radius = Radius(branch, s, theta)
+    rings = (position[:, None, :] + radius[:, :, None] * (np.cos(theta)[None, :, None] * e1s[:, None, :]
+                                                          + np.sin(theta)[None, :, None] * e2s[:, None, :]))
+    if loop is None:
+        previous = AddVertices(state, rings[0])
+        state["rims"].append((previous, position[0], -1.0))
+    else:
+        indices, points = loop
+        # the loop in the frame of the first ring, rotated so that its vertex 0 is next to theta[0]
+        local = np.stack([(points - start) @ e1s[0], (points - start) @ e2s[0], (points - start) @ tangents[0]], axis=1)
+        center = local[:, :2].mean(axis=0)
+        angles = np.arctan2(local[:, 1] - center[1], local[:, 0] - center[0])
+        shift = int(np.argmin(np.abs(np.angle(np.exp(1j * (angles - theta[0]))))))
+        indices, local = np.roll(indices, -shift), np.roll(local, -shift, axis=0)
+        # the loop moves along the child centerline and blends into the circle
+        x = np.clip(s / transition, 0.0, 1.0)
+        weight = (3.0 * x ** 2 - 2.0 * x ** 3)[:, None, None]
+        loopPoints = (position[:, None, :] + local[None, :, 0, None] * e1s[:, None, :]
+                      + local[None, :, 1, None] * e2s[:, None, :] + local[None, :, 2, None] * tangents[:, None, :])
+        rings = (1.0 - weight) * loopPoints + weight * rings
+        previous = indices
+    for ring in rings[1:]:
+        current = AddVertices(state, ring)
+        AddStrip(state, previous, current)
+        previous = current
+
+    samples = np.linspace(0.0, branch["length"], max(2, int(math.ceil(branch["length"] / state["centerlineStep"])) + 1))
+    path = PathAt(pieces, samples)[0]
+    if not bifurcation:
+        state["rims"].append((previous, position[-1], 1.0))
+        return [path]
+
+    # the two halves of the last ring and the crotch curve between vertex n/2 and vertex 0
+    end, endTangent, endE1, endE2 = position[-1], tangents[-1], e1s[-1], e2s[-1]
+    half = n // 2
+    plane = math.radians(bifurcation["plane"])
+    toward = math.cos(plane) * endE1 + math.sin(plane) * endE2
+    side = rings[-1][half] - end
+    endRadius = np.linalg.norm(side)
+    psi = 0.5 * np.pi - np.pi * np.arange(1, half) / half
+    # where two cylinders of the parent radius around the child axes meet (at the mean angle),
+    # so that the loops move along the child axes as round tubes without corners at the ends of the crotch
+    height = endRadius / math.sin(math.radians(np.mean(bifurcation["angles"])))
+    crotch = end + np.sin(psi)[:, None] * side + height * np.cos(psi)[:, None] * endTangent
+    crotchIndices = AddVertices(state, crotch)
+    state["crotches"].append((crotchIndices, endRadius))
+    ringPoints = rings[-1]
+    loops = [
+        (np.concatenate([previous[:half + 1], crotchIndices]), np.concatenate([ringPoints[:half + 1], crotch])),
+        (np.concatenate([previous[half:], previous[:1], crotchIndices[::-1]]),
+         np.concatenate([ringPoints[half:], ringPoints[:1], crotch[::-1]])),
+    ]
+    paths = []
+    for sign, angle, child, childLoop in zip((1.0, -1.0), bifurcation["angles"], branch["children"], loops):
+        angleRad = math.radians(angle)
+        direction = math.cos(angleRad) * endTangent + sign * math.sin(angleRad) * toward
+        outward = sign * toward - (sign * toward @ direction) * direction
+        outward /= np.linalg.norm(outward)
+        for childPath in SweepBranch(state, child, end, direction, outward, n, childLoop, TransitionLength(branch, angle)):
+            paths.append(np.concatenate([path, childPath[1:]]))
+    return paths
+
+
+# Laplacian smoothing weighted by a Gaussian of the distance to the crotch curves;
+# the iterations grow with (fillet / edge)^2 so that the rounding does not depend on the resolution
+# only the vertices near a crotch move, and the open ends stay planar circles
+def FilletCrotches(vertices, triangles, crotches, rims, n):
+    if not crotches:
+        return vertices
+    weight = np.zeros(len(vertices))
+    iterations = 0
+    for indices, radius in crotches:
+        width = FILLET * radius
+        distance = cKDTree(vertices[indices]).query(vertices, distance_upper_bound=4.0 * width)[0]
+        weight = np.maximum(weight, np.exp(-(distance / width) ** 2))
+        iterations = max(iterations, int(math.ceil(2.0 * (width * n / (2.0 * np.pi * radius)) ** 2)))
+    for indices, center, sign in rims:
+        weight[indices] = 0.0
+    moving = np.flatnonzero(weight > 1e-6)
+    edges = surfaceprep.Edges(np.concatenate([triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]]]),
+                              len(vertices))[0]
+    rows = np.concatenate([edges[:, 0], edges[:, 1]])
+    columns = np.concatenate([edges[:, 1], edges[:, 0]])
+    adjacency = coo_matrix((np.ones(len(rows)), (rows, columns)), shape=(len(vertices),) * 2).tocsr()[moving]
+    adjacency = adjacency.multiply(1.0 / adjacency.sum(axis=1)).tocsr()
+    step = 0.5 * weight[moving, None]
+    vertices = vertices.copy()
+    for _ in range(iterations):
+        vertices[moving] += step * (adjacency @ vertices - vertices[moving])
+    return vertices
+
+
+# volume inside the wall and the planar caps of the open ends
+def EnclosedVolume(vertices, triangles, rims):
+    caps = []
+    for indices, center, sign in rims:
+        fan = np.stack([np.full(len(indices), len(vertices)), indices, np.roll(indices, -1)], axis=1)
+        if sign < 0:
+            fan = fan[:, [0, 2, 1]]
+        caps.append(np.vstack([vertices, center])[fan])
+    points = np.concatenate([vertices[triangles]] + caps)
+    return float(np.einsum("ij,ij->i", points[:, 0], np.cross(points[:, 1], points[:, 2])).sum() / 6.0)
+
+
+# vessel of the specification -> summary with vertices, triangles and one centerline per outlet
+# the inlet starts at the origin along +z
+def GenerateVessel(spec, triangles=20000, edgeLength=None, centerlineStep=0.5):
+    root = ResolveBranch(spec)
+    n = RingVertices(root, triangles, edgeLength)
+    state = {"vertices": [], "triangles": [], "count": 0, "rims": [], "crotches": [], "centerlineStep": centerlineStep}
+    paths = SweepBranch(state, root, np.zeros(3), np.array([0.0, 0.0, 1.0]), np.array([1.0, 0.0, 0.0]), n)
+    faces = np.concatenate(state["triangles"])
+    vertices = FilletCrotches(np.concatenate(state["vertices"]), faces, state["crotches"], state["rims"], n)
+    return {
+        "vertices": vertices,
+        "triangles": faces,
+        "centerlines": paths,
+        "ringVertices": n,
+        "outlets": len(state["rims"]) - 1,
+        "volume": EnclosedVolume(vertices, faces, state["rims"]),
+    }
+
+
+def CenterlinePaths(stlPath, count):
+    stem = os.path.splitext(stlPath)[0]
+    return [f"{stem}_centerline.txt"] + [f"{stem}_centerline_{i}.txt" for i in range(1, count)]
+
+
+def WriteVessel(vessel, stlPath):
+    surfaceio.WriteSurface(stlPath, vessel["vertices"], vessel["triangles"])
+    paths = CenterlinePaths(stlPath, len(vessel["centerlines"]))
+    for path, points in zip(paths, vessel["centerlines"]):
+        centerline.WriteCenterline(path, points)
+    return paths
+
+
+def LoadSpec(shape=None, specPath=None):
+    if specPath:
+        with open(specPath) as f:
+            return json.load(f)
+    if shape not in SHAPES:
+        raise ValueError(f"unknown shape {shape!r}, choose from {sorted(SHAPES)}")
+    return SHAPES[shape]
+# ===============================================
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="generate a synthetic vessel surface and its centerlines")
+    parser.add_argument("stl", help="output surface (*.stl or *.npz)")
+    parser.add_argument("--shape", choices=sorted(SHAPES), default="mixed")
+    parser.add_argument("--spec", default=None, help="vessel as JSON (same form as SHAPES), overrides --shape")
+    parser.add_argument("--triangles", type=int, default=20000, help="about this many surface triangles")
+    parser.add_argument("--edge-length", type=float, default=None, help="edge length of the inlet ring instead of --triangles")
+    parser.add_argument("--centerline-step", type=float, default=0.5, help="spacing of the centerline nodes")
+    args = parser.parse_args()
+
+    vessel = GenerateVessel(LoadSpec(args.shape, args.spec), args.triangles, args.edge_length, args.centerline_step)
+    paths = WriteVessel(vessel, args.stl)
+    print(f"{len(vessel['triangles'])} triangles, {len(vessel['vertices'])} vertices, {vessel['ringVertices']} per ring, "
+          f"{vessel['outlets']} outlets, volume {vessel['volume']:.4g} -> {args.stl}")
+    for path in paths:
+        print(f"centerline -> {path}")
@@ -0,0 +1,7 @@
+# the scripts in assets/ import each other by module name, as when they are run from that folder
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "assets"))
+DATA = os.path.join(ROOT, "data")
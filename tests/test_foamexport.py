@@ -0,0 +1,69 @@
+# polyMesh of data/MeshNeed.msh: closed cells and the face order OpenFOAM needs
+import os
+
+import numpy as np
+import pytest
+
+import foamexport
+import msh22
+from conftest import DATA
+
+
+@pytest.fixture(scope="module")
+def polyMesh():
+    return foamexport.PolyMesh(msh22.ReadMsh22(os.path.join(DATA, "MeshNeed.msh")))
+
+
+def FaceAreas(polyMesh):
+    offsets = polyMesh["faceOffsets"]
+    labels = polyMesh["faceLabels"]
+    points = polyMesh["points"]
+    areas = np.zeros((len(offsets) - 1, 3))
+    for size in (3, 4):
+        faces = np.flatnonzero(np.diff(offsets) == size)
+        corners = points[labels[offsets[faces][:, None] + np.arange(size)]]
+        center = corners.mean(axis=1)
+        areas[faces] = 0.5 * np.cross(corners - center[:, None], np.roll(corners, -1, axis=1) - center[:, None]).sum(axis=1)
+    return areas
+
+
+def test_owner_below_neighbour(polyMesh):
+    owner, neighbour = polyMesh["owner"], polyMesh["neighbour"]
+    internal = len(neighbour)
+    assert np.all(owner[:internal] < neighbour)
+    # upper-triangular order
+    order = np.lexsort((neighbour, owner[:internal]))
+    np.testing.assert_array_equal(order, np.arange(internal))
+
+
+def test_closed_cells(polyMesh):
+    areas = FaceAreas(polyMesh)
+    owner, neighbour = polyMesh["owner"], polyMesh["neighbour"]
+    internal = len(neighbour)
+    total = np.zeros((polyMesh["numCells"], 3))
+    np.add.at(total, owner, areas)
+    np.add.at(total, neighbour, -areas[:internal])
+    size = np.zeros(polyMesh["numCells"])
+    np.add.at(size, owner, np.linalg.norm(areas, axis=1))
+    np.add.at(size, neighbour, np.linalg.norm(areas[:internal], axis=1))
+    assert np.all(np.linalg.norm(total, axis=1) < 1e-9 * size)
+    # 5 faces per prism
+    np.testing.assert_array_equal(np.bincount(np.concatenate([owner, neighbour]), minlength=polyMesh["numCells"]), 5)
+
+
+def test_patches(polyMesh):
+    assert polyMesh["numCells"] == 53010
+    assert [patch[:3] for patch in polyMesh["patches"]] == [
+        ("WALL", "wall", 10602), ("INLET", "patch", 190), ("OUTLET", "patch", 190), ("defaultFaces", "patch", 10602)]
+    start = len(polyMesh["neighbour"])
+    for _, _, count, startFace in polyMesh["patches"]:
+        assert startFace == start
+        start += count
+    assert start == len(polyMesh["owner"])
+
+
+def test_write(polyMesh, tmp_path):
+    directory = foamexport.WritePolyMesh(str(tmp_path), polyMesh)
+    assert sorted(os.listdir(directory)) == ["boundary", "faces", "neighbour", "owner", "points"]
+    with open(os.path.join(directory, "owner"), "rb") as f:
+        assert f"nCells:{polyMesh['numCells']}".encode("ascii") in f.read()
@@ -0,0 +1,75 @@
+# keys, store / lookup and the least recently used eviction of the mesh cache
+import json
+import os
+
+import pytest
+
+try:
+    # the key contains the gmsh version
+    import meshcache
+except (ImportError, OSError):
+    pytest.skip("gmsh is not available", allow_module_level=True)
+
+
+def WriteFile(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+    return str(path)
+
+
+def SetLastAccess(cache, key, lastAccess):
+    entry = cache.EntryPath(key)
+    with open(os.path.join(entry, "meta.json")) as f:
+        meta = json.load(f)
+    meta["lastAccess"] = lastAccess
+    cache.WriteMeta(entry, meta)
+
+
+def test_key(tmp_path):
+    cache = meshcache.MeshCache(tmp_path / "cache", 10 ** 9)
+    stl = WriteFile(tmp_path / "a.stl", b"solid a")
+    other = WriteFile(tmp_path / "b.stl", b"solid b")
+    key = cache.Key(stl, {"meshSize": 0.9, "N": 5})
+    assert cache.Key(stl, {"N": 5, "meshSize": 0.9}) == key
+    assert cache.Key(stl, {"meshSize": 1.0, "N": 5}) != key
+    assert cache.Key(other, {"meshSize": 0.9, "N": 5}) != key
+
+
+def test_store_lookup(tmp_path):
+    cache = meshcache.MeshCache(tmp_path / "cache", 10 ** 9)
+    stl = WriteFile(tmp_path / "a.stl", b"solid a")
+    key = cache.Key(stl, {"meshSize": 0.9})
+    msh = WriteFile(tmp_path / "a.msh", b"$MeshFormat")
+    arrays = tmp_path / "a.arrays"
+    arrays.mkdir()
+    WriteFile(arrays / "nodes.npy", b"nodes")
+    assert cache.Lookup(key, {"msh": str(tmp_path / "b.msh")}) is None
+
+    cache.Store(key, {"msh": msh, "arrays": str(arrays)}, {"nodes": 3})
+    target = tmp_path / "out"
+    target.mkdir()
+    outputs = {"msh": str(target / "b.msh"), "arrays": str(target / "b.arrays")}
+    assert cache.Lookup(key, outputs) == {"nodes": 3}
+    assert (target / "b.msh").read_bytes() == b"$MeshFormat"
+    assert (target / "b.arrays" / "nodes.npy").read_bytes() == b"nodes"
+    # a file the entry does not have is a miss
+    assert cache.Lookup(key, {"vtk": str(target / "b.vtk")}) is None
+
+
+def test_evict_least_recently_used(tmp_path):
+    cache = meshcache.MeshCache(tmp_path / "cache", 10 ** 9)
+    keys = []
+    for name, lastAccess in (("a", 1.0), ("b", 3.0), ("c", 2.0)):
+        key = cache.Key(WriteFile(tmp_path / f"{name}.stl", name.encode()), {})
+        cache.Store(key, {"msh": WriteFile(tmp_path / f"{name}.msh", b"x" * 1000)}, {})
+        SetLastAccess(cache, key, lastAccess)
+        keys.append(key)
+    size = meshcache.DirectorySize(cache.EntryPath(keys[0]))
+
+    cache.budgetBytes = 3 * size - 1
+    cache.Evict()
+    assert [os.path.exists(cache.EntryPath(key)) for key in keys] == [False, True, True]
+    cache.budgetBytes = size
+    cache.Evict()
+    assert [os.path.exists(cache.EntryPath(key)) for key in keys] == [False, True, False]
+    assert meshcache.DirectorySize(cache.cacheDir) <= cache.budgetBytes
@@ -0,0 +1,52 @@
+# deformation of data/MeshNeed.msh toward centerlines whose result is known,
+# and all targets at once == one target at a time
+import os
+
+import numpy as np
+import pytest
+
+import centerline
+import meshdeform
+import msh22
+from conftest import DATA
+
+
+@pytest.fixture(scope="module")
+def inputs():
+    mesh = msh22.ReadMsh22(os.path.join(DATA, "MeshNeed.msh"))
+    points = centerline.ReadCenterline(os.path.join(DATA, "centerline.txt"))
+    final = centerline.ReadCenterline(os.path.join(DATA, "centerlineFinal.txt"))
+    _, _, surfaceCorrespond = centerline.ReadCorrespondPly(os.path.join(DATA, "test.ply"))
+    return mesh, points, final, surfaceCorrespond
+
+
+def test_same_centerline_keeps_nodes(inputs):
+    mesh, points, _, surfaceCorrespond = inputs
+    base = meshdeform.PrepareDeformation(mesh, points, surfaceCorrespond)
+    np.testing.assert_allclose(meshdeform.DeformTargets(base, points[None])[0], base["mesh"]["nodes"], atol=1e-9)
+
+
+def test_shifted_centerline_shifts_nodes(inputs):
+    mesh, points, _, surfaceCorrespond = inputs
+    base = meshdeform.PrepareDeformation(mesh, points, surfaceCorrespond)
+    shift = np.array([1.0, -2.0, 0.5])
+    np.testing.assert_allclose(meshdeform.DeformTargets(base, (points + shift)[None])[0],
+                               base["mesh"]["nodes"] + shift, atol=1e-6)
+
+
+def test_batch_equals_single(inputs):
+    mesh, points, final, surfaceCorrespond = inputs
+    base = meshdeform.PrepareDeformation(mesh, points, surfaceCorrespond)
+    targets = np.stack([final, 0.5 * (points + final), points + np.array([0.0, 0.0, 1.0])])
+    # chunks of 2 so that a chunk boundary is crossed
+    batch = meshdeform.DeformTargets(base, targets, chunkSize=2)
+    for target, points_ in zip(targets, batch):
+        single = meshdeform.DeformMesh(mesh, points, target, surfaceCorrespond)
+        np.testing.assert_allclose(points_, single["nodes"], rtol=0, atol=1e-12)
+
+
+def test_target_with_other_node_count(inputs):
+    mesh, points, _, surfaceCorrespond = inputs
+    base = meshdeform.PrepareDeformation(mesh, points, surfaceCorrespond)
+    with pytest.raises(ValueError):
+        meshdeform.DeformTargets(base, points[None, :-1])
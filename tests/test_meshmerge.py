@@ -0,0 +1,78 @@
+# weld of an inner mesh to the innermost prisms of data/MeshNeed.msh
+import os
+
+import numpy as np
+import pytest
+
+import meshdeform
+import meshmerge
+import msh22
+from conftest import DATA
+
+
+@pytest.fixture(scope="module")
+def need():
+    return msh22.ReadMsh22(os.path.join(DATA, "MeshNeed.msh"))
+
+
+# inner mesh of the inner prism faces (INNERWALL) and one tetra on an extra node, nodes in another order
+def InnerMesh(need, offset=0.0, dropTriangles=0):
+    faces = meshdeform.InnerSurfaceRows(need)[dropTriangles:]
+    rows, local = np.unique(faces, return_inverse=True)
+    order = np.random.default_rng(0).permutation(len(rows))
+    position = np.empty(len(rows), dtype=np.int64)
+    position[order] = np.arange(len(rows))
+    nodes = np.concatenate([need["nodes"][rows][order] + offset, [need["nodes"][rows].mean(axis=0)]])
+    triangles = position[local.reshape(-1, 3)] + 1
+    tetra = np.append(triangles[0], len(nodes))
+    counts = np.append(np.full(len(triangles), 3), 4)
+    return {
+        "physicalNames": [(2, meshmerge.INNERWALL, "INNERWALL"), (3, meshmerge.INTERNAL, "INTERNAL")],
+        "nodeTags": np.arange(1, len(nodes) + 1),
+        "nodes": nodes,
+        "elementTags": np.arange(1, len(counts) + 1),
+        "elementTypes": np.append(np.full(len(triangles), meshmerge.TRIANGLE), meshmerge.TETRA).astype(np.int32),
+        "elementPhysical": np.append(np.full(len(triangles), meshmerge.INNERWALL), meshmerge.INTERNAL).astype(np.int32),
+        "elementEntity": np.ones(len(counts), dtype=np.int32),
+        "elementOffsets": np.concatenate([[0], np.cumsum(counts)]),
+        "elementNodes": np.concatenate([triangles.ravel(), tetra]),
+    }
+
+
+def test_weld(need):
+    inner = InnerMesh(need, offset=1e-6)
+    innerNodes, needRows, statistics = meshmerge.WeldInterface(need, inner, meshmerge.DEFAULT_TOLERANCE)
+    np.testing.assert_allclose(need["nodes"][needRows], inner["nodes"][innerNodes], atol=2e-6)
+    assert statistics["interfaceNodes"] == len(inner["nodes"]) - 1
+    assert statistics["maxDistance"] < 2e-6
+
+
+def test_merge(need):
+    inner = InnerMesh(need)
+    inlet, outlet = meshmerge.InletOutletLocations(need)
+    merged, statistics = meshmerge.MergeMesh(need, inner, inlet, outlet)
+    # only the extra node of the tetra is added
+    assert len(merged["nodes"]) == len(need["nodes"]) + 1
+    _, tetra = msh22.ElementsOfType(merged, meshmerge.TETRA, meshmerge.INTERNAL)
+    np.testing.assert_array_equal(merged["nodes"][tetra[0]], inner["nodes"][msh22.ElementsOfType(inner, meshmerge.TETRA)[1][0]])
+    np.testing.assert_array_equal(merged["nodeTags"], np.arange(1, len(merged["nodes"]) + 1))
+
+
+def test_nodes_too_far(need):
+    with pytest.raises(meshmerge.InterfaceMismatch, match="no prism node within"):
+        meshmerge.WeldInterface(need, InnerMesh(need, offset=1e-3), meshmerge.DEFAULT_TOLERANCE)
+
+
+def test_missing_triangles(need):
+    with pytest.raises(meshmerge.InterfaceMismatch, match="INNERWALL triangles"):
+        meshmerge.WeldInterface(need, InnerMesh(need, dropTriangles=10), meshmerge.DEFAULT_TOLERANCE)
+
+
+
+# other errors are not reported as an interface mismatch
+def test_other_errors_are_not_mismatch(need):
+    caps = (need["elementTypes"] == meshmerge.QUADRANGLE)
+    noCaps = msh22.SubMesh(need, ~caps)
+    with pytest.raises(ValueError) as error:
+        meshmerge.InletOutletLocations(noCaps)
+    assert not isinstance(error.value, meshmerge.InterfaceMismatch)
@@ -0,0 +1,85 @@
+# the cell map of a partitioned prism + tetra mesh follows the cell order of the written *.msh
+import numpy as np
+import pytest
+
+try:
+    import gmsh
+except (ImportError, OSError):
+    pytest.skip("gmsh is not available", allow_module_level=True)
+
+import foamexport
+import meshoutput
+import meshpartition
+import msh22
+
+
+# prisms extruded from a square, tetrahedra above them
+def PrismTetraModel():
+    gmsh.model.add("prismTetra")
+    points = [gmsh.model.geo.addPoint(x, y, 0.0, 0.4) for x, y in ((0, 0), (1, 0), (1, 1), (0, 1))]
+    lines = [gmsh.model.geo.addLine(points[i], points[(i + 1) % 4]) for i in range(4)]
+    square = gmsh.model.geo.addPlaneSurface([gmsh.model.geo.addCurveLoop(lines)])
+    layers = gmsh.model.geo.extrude([(2, square)], 0, 0, 0.3, [3], recombine=True)
+    tetra = gmsh.model.geo.extrude([layers[0]], 0, 0, 1.0)
+    gmsh.model.geo.synchronize()
+    volumes = [layers[1][1], tetra[1][1]]
+    gmsh.model.addPhysicalGroup(3, volumes, 100)
+    gmsh.model.setPhysicalName(3, 100, "INTERNAL")
+    walls = [tag for _, tag in gmsh.model.getBoundary([(3, v) for v in volumes], combined=True, oriented=False)]
+    gmsh.model.addPhysicalGroup(2, walls, 10)
+    gmsh.model.setPhysicalName(2, 10, "WALL")
+    gmsh.model.mesh.generate(3)
+
+
+def ReadCellDecomposition(path):
+    with open(path) as f:
+        text = f.read()
+    return np.array(text[text.rindex("(") + 1:text.rindex(")")].split(), dtype=np.int64)
+
+
+@pytest.fixture
+def session():
+    gmsh.initialize()
+    gmsh.option.setNumber("General.Terminal", 0)
+    yield
+    gmsh.finalize()
+
+
+@pytest.mark.parametrize("msh", ["ascii", "binary"])
+def test_map_in_file_order(session, tmp_path, msh):
+    PrismTetraModel()
+    options = meshoutput.ResolveOutputOptions({"msh": msh, "vtk": "none", "partitions": 2, "partitioner": "simple"})
+    _, processor = meshpartition.PartitionMesh(options)
+    path = str(tmp_path / "mesh.msh")
+    written = meshoutput.WriteOutputs(path, str(tmp_path / "mesh.vtk"), options, processor)
+
+    mesh = msh22.ReadMsh22(path)
+    rows = foamexport.VolumeRows(mesh)
+    # the writer puts all tetrahedra before the prisms
+    types = mesh["elementTypes"][rows]
+    assert types[0] == 4 and types[-1] == 6
+    # the simple partitioner cuts along z: every cell of part 0 lies below every cell of part 1
+    index = np.zeros(int(mesh["nodeTags"].max()) + 1, dtype=np.int64)
+    index[mesh["nodeTags"]] = np.arange(len(mesh["nodeTags"]))
+    centerZ = np.array([mesh["nodes"][index[mesh["elementNodes"][mesh["elementOffsets"][row]:mesh["elementOffsets"][row + 1]]], 2].mean()
+                        for row in rows])
+    decomposition = ReadCellDecomposition(written["decomposition"])
+    assert len(decomposition) == len(rows)
+    assert set(decomposition.tolist()) == {0, 1}
+    assert centerZ[decomposition == 0].max() <= centerZ[decomposition == 1].min()
+    # processor is in entity order (prisms first), it would not fit this file
+    assert not np.array_equal(processor, decomposition)
+
+
+def test_map_matches_partition_tags(session, tmp_path):
+    PrismTetraModel()
+    options = meshoutput.ResolveOutputOptions({"vtk": "none", "partitions": 2, "partitioner": "metis"})
+    _, processor = meshpartition.PartitionMesh(options)
+    path = str(tmp_path / "mesh.msh")
+    written = meshoutput.WriteOutputs(path, str(tmp_path / "mesh.vtk"), options, processor)
+
+    mesh = msh22.ReadMsh22(path)
+    rows = foamexport.VolumeRows(mesh)
+    # PartitionOldStyleMsh2 tags after the entity: number of partitions, then the partition (from 1)
+    filePartitions = mesh["elementExtraTags"][mesh["elementExtraOffsets"][rows] + 1] - 1
+    np.testing.assert_array_equal(ReadCellDecomposition(written["decomposition"]), filePartitions)
@@ -0,0 +1,52 @@
+# broken protocol lines of a job are plain output, and the job still gets its end event
+import asyncio
+
+import pytest
+
+try:
+    # meshprofile reads the gmsh logger
+    import meshprofile
+except (ImportError, OSError):
+    pytest.skip("gmsh is not available", allow_module_level=True)
+
+import meshrunner
+
+SCRIPT = f"""
+import sys
+print({meshprofile.PHASE_PREFIX!r} + '{{"phase": "Meshing", "sta')
+print({meshprofile.REPORT_PREFIX!r} + 'not json')
+print("x" * (2 ** 24 + 10))
+print({meshprofile.PHASE_PREFIX!r} + '{{"phase": "Meshing", "state": "start"}}')
+print({meshprofile.REPORT_PREFIX!r} + '{{"nodes": 3}}')
+sys.exit(int(sys.argv[1]))
+"""
+
+
+def RunScript(tmp_path, returncode):
+    script = tmp_path / "job.py"
+    script.write_text(SCRIPT)
+    events = []
+
+    async def Run():
+        runner = meshrunner.MeshRunner(1, events.append, timeout=60)
+        runner.Submit({"id": "a", "script": str(script), "args": [returncode]})
+        await runner.Wait()
+
+    asyncio.run(Run())
+    return events
+
+
+def test_broken_lines_are_output(tmp_path):
+    events = RunScript(tmp_path, 0)
+    phases = [e for e in events if e["event"] == "phase"]
+    assert [(e["phase"], e["state"]) for e in phases] == [("Meshing", "start")]
+    assert events[-1]["event"] == "finished"
+    assert events[-1]["record"] == {"nodes": 3}
+
+
+def test_failed_job_keeps_tail(tmp_path):
+    events = RunScript(tmp_path, 3)
+    assert events[-1]["event"] == "failed"
+    assert events[-1]["returncode"] == 3
+    tail = events[-1]["tail"]
+    assert tail[0].startswith(meshprofile.PHASE_PREFIX) and "(line too long)" in tail
@@ -0,0 +1,80 @@
+# MSH 2.2 read / write of data/MeshNeed.msh without gmsh
+import os
+import re
+
+import numpy as np
+import pytest
+
+import msh22
+from conftest import DATA
+
+MESH_NEED = os.path.join(DATA, "MeshNeed.msh")
+ARRAYS = ("nodeTags", "nodes", "elementTags", "elementTypes", "elementPhysical", "elementEntity",
+          "elementOffsets", "elementNodes")
+
+
+@pytest.fixture(scope="module")
+def mesh():
+    return msh22.ReadMsh22(MESH_NEED)
+
+
+def AssertSameMesh(a, b):
+    assert a["physicalNames"] == b["physicalNames"]
+    for name in ARRAYS:
+        np.testing.assert_array_equal(a[name], b[name], err_msg=name)
+
+
+def test_read(mesh):
+    assert len(mesh["nodes"]) == 32034
+    types, counts = np.unique(mesh["elementTypes"], return_counts=True)
+    assert dict(zip(types.tolist(), counts.tolist())) == {2: 10602, 3: 380, 6: 53010}
+    assert (2, 10, "WALL") in mesh["physicalNames"]
+
+
+# the text is the one of the file, only the exponents were written with "E" by the C# tool
+def test_ascii_same_text(mesh, tmp_path):
+    path = tmp_path / "MeshNeed.msh"
+    msh22.WriteMsh22(str(path), mesh)
+    with open(MESH_NEED) as f:
+        assert path.read_text() == re.sub(r"(\d)E([+-])", r"\1e\2", f.read())
+
+
+@pytest.mark.parametrize("name, binary", [("a.msh", False), ("b.msh", True), ("c.msh.gz", False), ("d.msh.gz", True)])
+def test_round_trip(mesh, tmp_path, name, binary):
+    path = str(tmp_path / name)
+    msh22.WriteMsh22(path, mesh, binary)
+    AssertSameMesh(msh22.ReadMsh22(path), mesh)
+
+
+def test_element_blocks(mesh):
+    blocks = msh22.ElementBlocks(mesh)
+    rows, prisms = blocks[6]
+    assert prisms.shape == (53010, 6)
+    assert prisms.min() >= 0 and prisms.max() < len(mesh["nodes"])
+    np.testing.assert_array_equal(mesh["elementTypes"][rows], 6)
+
+
+# partition tags as written with Mesh.PartitionOldStyleMsh2: number of partitions, then the partitions
+def test_round_trip_partition_tags(mesh, tmp_path):
+    partitioned = dict(mesh)
+    count = len(mesh["elementTags"])
+    extraCounts = np.where(np.arange(count) % 3 == 0, 3, 2)
+    partitioned["elementExtraOffsets"] = np.concatenate([[0], np.cumsum(extraCounts)])
+    partitioned["elementExtraTags"] = np.arange(partitioned["elementExtraOffsets"][-1]) % 7 + 1
+    for name, binary in (("a.msh", False), ("b.msh", True)):
+        path = str(tmp_path / name)
+        msh22.WriteMsh22(path, partitioned, binary)
+        read = msh22.ReadMsh22(path)
+        AssertSameMesh(read, partitioned)
+        np.testing.assert_array_equal(read["elementExtraOffsets"], partitioned["elementExtraOffsets"])
+        np.testing.assert_array_equal(read["elementExtraTags"], partitioned["elementExtraTags"])
+    # a part of the mesh keeps the tags of its elements
+    keep = mesh["elementTypes"] == 6
+    sub = msh22.SubMesh(partitioned, keep)
+    offsets = partitioned["elementExtraOffsets"]
+    expected = np.concatenate([partitioned["elementExtraTags"][offsets[i]:offsets[i + 1]] for i in np.flatnonzero(keep)])
+    np.testing.assert_array_equal(sub["elementExtraTags"], expected)
+
+
+def test_no_extra_tags(mesh):
+    assert "elementExtraTags" not in mesh
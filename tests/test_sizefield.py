@@ -0,0 +1,59 @@
+# radius, clamping and grid layout of the size field on a straight cylinder
+import numpy as np
+import pytest
+
+try:
+    import sizefield
+except (ImportError, OSError):
+    pytest.skip("gmsh is not available", allow_module_level=True)
+
+RADIUS = 2.0
+
+
+# centerline along x, rings of the surface at the centerline nodes
+def Cylinder(radius=RADIUS, length=20.0, step=0.5, ring=64):
+    x = np.arange(0.0, length + step / 2, step)
+    centerlinePoints = np.column_stack([x, np.zeros_like(x), np.zeros_like(x)])
+    angle = 2 * np.pi * np.arange(ring) / ring
+    surfacePoints = np.stack([np.repeat(x, ring),
+                              np.tile(radius * np.cos(angle), len(x)),
+                              np.tile(radius * np.sin(angle), len(x))], axis=1)
+    return centerlinePoints, surfacePoints
+
+
+def test_lumen_radius():
+    centerlinePoints, surfacePoints = Cylinder()
+    np.testing.assert_allclose(sizefield.LumenRadius(centerlinePoints, surfacePoints), RADIUS, rtol=1e-12)
+
+
+def test_clamped_size():
+    centerlinePoints, surfacePoints = Cylinder()
+    # a radius growing along the centerline, the size 0.3 * radius runs from 0.3 to 3
+    radius = np.linspace(1.0, 10.0, len(centerlinePoints))
+    _, _, _, values = sizefield.SizeGrid(centerlinePoints, radius, surfacePoints, 0.3, 0.5, 2.0)
+    assert values.min() == 0.5 and values.max() == 2.0
+    inside = (values > 0.5) & (values < 2.0)
+    assert inside.any()
+    assert np.isin(values[inside], 0.3 * radius).all()
+
+
+def test_grid_order(tmp_path):
+    centerlinePoints, surfacePoints = Cylinder()
+    radius = np.linspace(1.0, 5.0, len(centerlinePoints))
+    origin, spacing, shape, values = sizefield.SizeGrid(centerlinePoints, radius, surfacePoints, 0.3, 0.5, 2.0)
+    path = tmp_path / "field.txt"
+    sizefield.WriteStructuredField(str(path), origin, spacing, shape, values)
+
+    lines = path.read_text().splitlines()
+    np.testing.assert_array_equal([float(v) for v in lines[0].split()], origin)
+    np.testing.assert_array_equal([float(v) for v in lines[1].split()], spacing)
+    assert [int(v) for v in lines[2].split()] == list(shape)
+    written = np.array(lines[3:], dtype=np.float64).reshape(shape)
+    # x slowest: value [i, j, k] belongs to the point origin + spacing * (i, j, k)
+    for i, j, k in ((0, 0, 0), (shape[0] - 1, 0, shape[2] - 1), (shape[0] // 3, shape[1] // 2, 1)):
+        point = origin + spacing * np.array([i, j, k])
+        nearest = np.argmin(np.linalg.norm(centerlinePoints - point, axis=1))
+        assert written[i, j, k] == pytest.approx(np.clip(0.3 * radius[nearest], 0.5, 2.0), rel=1e-5)
+    # the size grows along x only
+    assert np.all(np.diff(written[:, shape[1] // 2, shape[2] // 2]) >= 0)
+    assert written[0].max() < written[-1].min()
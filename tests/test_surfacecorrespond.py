@@ -0,0 +1,32 @@
+# correspondence of data/gmsh22.stl and data/centerline.txt == data/test.ply
+import os
+
+import numpy as np
+
+import centerline
+import surfacecorrespond
+import surfaceio
+from conftest import DATA
+
+
+def test_same_as_test_ply(tmp_path):
+    vertices, triangles = surfaceio.ReadSurface(os.path.join(DATA, "gmsh22.stl"))
+    points = centerline.ReadCenterline(os.path.join(DATA, "centerline.txt"))
+    index, vector = surfacecorrespond.TriangleCorrespondence(vertices, triangles, points)
+    np.testing.assert_allclose(vertices[triangles].mean(axis=1) + vector, points[index], atol=1e-12)
+
+    path = str(tmp_path / "test.ply")
+    centerline.WriteCorrespondPly(path, vertices, triangles, index)
+    _, writtenTriangles, writtenIndex = centerline.ReadCorrespondPly(path)
+    _, expectedTriangles, expectedIndex = centerline.ReadCorrespondPly(os.path.join(DATA, "test.ply"))
+    np.testing.assert_array_equal(writtenTriangles, expectedTriangles)
+    np.testing.assert_array_equal(writtenIndex, expectedIndex)
+
+
+def test_edge_radius(tmp_path):
+    vertices, _ = surfaceio.ReadSurface(os.path.join(DATA, "gmsh22.stl"))
+    points = centerline.ReadCenterline(os.path.join(DATA, "centerline.txt"))
+    radius = surfacecorrespond.EdgeRadius(vertices, points)
+    assert radius.shape == (len(points) - 1,)
+    # the tube of data/gmsh22.stl has a radius of about 3
+    assert 2.0 < np.median(radius[radius > 0]) < 4.0
@@ -0,0 +1,80 @@
+# repair, checks and decimation of the surface on a small triangle set and an open vesselgen bifurcation
+import numpy as np
+import pytest
+
+import surfaceprep
+import vesselgen
+
+
+@pytest.fixture(scope="module")
+def vessel():
+    generated = vesselgen.GenerateVessel(vesselgen.SHAPES["bifurcation"], 5000)
+    return generated["vertices"], generated["triangles"]
+
+
+def EdgeLengths(vertices, triangles):
+    directed = np.concatenate([triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]]])
+    edges = surfaceprep.Edges(directed, len(vertices))[0]
+    return np.linalg.norm(vertices[edges[:, 0]] - vertices[edges[:, 1]], axis=1)
+
+
+def test_clean_triangles():
+    # unit square of two triangles, vertex 4 on the edge 0-1 and vertex 5 unused
+    vertices = np.array([[0, 0, 0], [1, 0, 0], [1, 1, 0], [0, 1, 0], [0.5, 0, 0], [5, 5, 5]], dtype=np.float64)
+    triangles = np.array([[0, 1, 2], [0, 2, 3],
+                          [2, 0, 1],   # duplicate in another order
+                          [0, 0, 3],   # repeated vertex
+                          [0, 4, 1]])  # zero area
+    cleaned, kept, counts = surfaceprep.CleanTriangles(vertices, triangles)
+    assert counts == {"degenerateTriangles": 2, "duplicateTriangles": 1, "unusedVertices": 2}
+    np.testing.assert_array_equal(cleaned[kept], vertices[triangles[:2]])
+
+
+def test_open_vessel(vessel):
+    check = surfaceprep.CheckSurface(*vessel)
+    # inlet and two outlets
+    assert check["openLoops"] == 3
+    assert check["nonManifoldEdges"] == 0 and check["inconsistentEdges"] == 0
+    assert not check["watertight"]
+
+
+def test_decimate_keeps_rims(vessel):
+    before = surfaceprep.CheckSurface(*vessel)
+    meshSize = 2.0 * before["meanEdgeLength"] / 0.5
+    vertices, triangles, summary = surfaceprep.Decimate(*vessel, 0.5 * meshSize, before)
+    assert summary["result"] == "decimated"
+    after = surfaceprep.CheckSurface(vertices, triangles)
+    assert after["triangles"] < before["triangles"] / 2
+    assert after["openLoops"] == 3 and after["openEdges"] == before["openEdges"]
+    assert after["nonManifoldEdges"] == 0 and after["inconsistentEdges"] == 0
+
+
+def test_decimate_fine_in_places(vessel):
+    # the children are thinner than the parent with the same ring, so only some edges are short
+    lengths = EdgeLengths(*vessel)
+    target = np.percentile(lengths, 10)
+    assert lengths.mean() > target
+    before = surfaceprep.CheckSurface(*vessel)
+    vertices, triangles, summary = surfaceprep.Decimate(*vessel, target, before)
+    assert summary["result"] == "decimated" and summary["collapsedEdges"] > 0
+    assert len(triangles) < len(vessel[1])
+
+
+def test_decimate_without_short_edges(vessel):
+    target = 0.5 * EdgeLengths(*vessel).min()
+    vertices, triangles, summary = surfaceprep.Decimate(*vessel, target, surfaceprep.CheckSurface(*vessel))
+    assert summary["result"].startswith("skipped")
+    assert triangles is vessel[1]
+
+
+def test_decimate_rejects_topology_change(vessel, monkeypatch):
+    # a decimation that opens a hole
+    def CollapseOpening(vertices, triangles, target):
+        return vertices, triangles[1:], {"collapsedEdges": 1, "rounds": 1}
+
+    monkeypatch.setattr(surfaceprep, "CollapseShortEdges", CollapseOpening)
+    before = surfaceprep.CheckSurface(*vessel)
+    vertices, triangles, summary = surfaceprep.Decimate(*vessel, before["meanEdgeLength"], before)
+    assert summary["result"].startswith("rejected")
+    assert summary["rejected"]["openEdges"] != before["openEdges"]
+    assert vertices is vessel[0] and triangles is vessel[1]